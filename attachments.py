@@ -0,0 +1,205 @@
+import binascii
+import hashlib
+import os
+import shutil
+import tempfile
+from email.header import decode_header, make_header
+from email.parser import BytesHeaderParser
+from typing import List, Optional
+
+
+class AttachmentWriteError(Exception):
+    """附件写入本地文件失败（如磁盘已满），与连接错误区分开"""
+
+
+class Attachment(dict):
+    """邮件记录中的附件：可直接序列化为JSON，需要内容时才打开文件
+
+    键: filename, content_type, size, sha256, path
+    """
+
+    def open(self):
+        return open(self['path'], 'rb')
+
+    def read(self) -> bytes:
+        with self.open() as f:
+            return f.read()
+
+    def exists(self) -> bool:
+        return os.path.exists(self.get('path', ''))
+
+    def save_as(self, path: str):
+        shutil.copyfile(self['path'], path)
+
+
+def _header_text(value) -> str:
+    try:
+        return str(make_header(decode_header(value or '')))
+    except Exception:
+        return str(value or '')
+
+
+class _AttachmentSink:
+    """把一个附件部分按传输编码逐行解码写入临时文件，同时计算SHA-256"""
+
+    def __init__(self, directory: str, encoding: str, filename: str, content_type: str):
+        self.directory = directory
+        self.encoding = encoding
+        self.filename = filename
+        self.content_type = content_type
+        self.digest = hashlib.sha256()
+        self.size = 0
+        fd, self.tmp_path = tempfile.mkstemp(prefix='.part.', dir=directory)
+        self.file = os.fdopen(fd, 'wb')
+        # base64未凑满4个字符的剩余部分
+        self._leftover = b''
+        # 行尾换行属于下一行之前（最后一行的换行属于边界，不写入）
+        self._pending_newline = b''
+
+    def _write(self, data: bytes):
+        if data:
+            self.file.write(data)
+            self.digest.update(data)
+            self.size += len(data)
+
+    def feed(self, line: bytes):
+        if self.encoding == 'base64':
+            data = self._leftover + b''.join(line.split())
+            usable = len(data) // 4 * 4
+            self._leftover = data[usable:]
+            if usable:
+                self._write(binascii.a2b_base64(data[:usable]))
+        elif self.encoding == 'quoted-printable':
+            content = line.rstrip(b'\r\n')
+            self._write(self._pending_newline)
+            if content.endswith(b'='):
+                # 软换行
+                self._write(binascii.a2b_qp(content[:-1]))
+                self._pending_newline = b''
+            else:
+                self._write(binascii.a2b_qp(content))
+                self._pending_newline = b'\n'
+        else:
+            content = line.rstrip(b'\r\n')
+            self._write(self._pending_newline)
+            self._write(content)
+            self._pending_newline = line[len(content):]
+
+    def close(self) -> Attachment:
+        if self._leftover.strip(b'='):
+            padded = self._leftover + b'=' * (-len(self._leftover) % 4)
+            try:
+                self._write(binascii.a2b_base64(padded))
+            except binascii.Error:
+                pass
+        self.file.close()
+        sha256 = self.digest.hexdigest()
+        path = os.path.join(self.directory, sha256)
+        # 按内容哈希命名，相同内容只保存一份
+        if os.path.exists(path):
+            os.remove(self.tmp_path)
+        else:
+            os.replace(self.tmp_path, path)
+        return Attachment(
+            filename=self.filename,
+            content_type=self.content_type,
+            size=self.size,
+            sha256=sha256,
+            path=path
+        )
+
+    def abort(self):
+        self.file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+class AttachmentExtractor:
+    """逐行接收原始邮件，把附件直接解码到文件，其余内容原样保留
+
+    附件部分只保留其邮件头（正文为空），保留下来的数据仍可交给_parse_email解析。
+    内存占用与邮件头和文本部分的大小相关，与附件大小无关。
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        try:
+            os.makedirs(directory, exist_ok=True)
+        except OSError as e:
+            raise AttachmentWriteError(f"创建附件目录失败: {str(e)}") from e
+        self.attachments: List[Attachment] = []
+        self._retained: List[bytes] = []
+        self._boundaries: List[bytes] = []
+        self._header_lines: Optional[List[bytes]] = []
+        self._sink: Optional[_AttachmentSink] = None
+
+    def feed(self, line: bytes):
+        try:
+            self._feed(line)
+        except OSError as e:
+            raise AttachmentWriteError(f"保存附件失败: {str(e)}") from e
+
+    def _feed(self, line: bytes):
+        if self._header_lines is not None:
+            self._retained.append(line)
+            self._header_lines.append(line)
+            if not line.strip():
+                self._start_body()
+            return
+        if self._boundaries and line.startswith(b'--'):
+            stripped = line.rstrip()
+            for depth in range(len(self._boundaries) - 1, -1, -1):
+                boundary = self._boundaries[depth]
+                if stripped == boundary or stripped == boundary + b'--':
+                    self._finish_part()
+                    self._retained.append(line)
+                    if stripped == boundary:
+                        # 下一个部分的邮件头
+                        del self._boundaries[depth + 1:]
+                        self._header_lines = []
+                    else:
+                        del self._boundaries[depth:]
+                    return
+        if self._sink is not None:
+            self._sink.feed(line)
+        else:
+            self._retained.append(line)
+
+    def _start_body(self):
+        headers = BytesHeaderParser().parsebytes(b''.join(self._header_lines))
+        self._header_lines = None
+        content_type = headers.get_content_type()
+        maintype = headers.get_content_maintype()
+        if maintype == 'multipart':
+            boundary = headers.get_param('boundary')
+            if boundary:
+                self._boundaries.append(b'--' + str(boundary).encode('utf-8', errors='ignore'))
+            return
+        disposition = (headers.get('Content-Disposition') or '').split(';', 1)[0].strip().lower()
+        if disposition == 'attachment' or maintype not in ('text', 'message'):
+            encoding = (headers.get('Content-Transfer-Encoding') or '7bit').strip().lower()
+            filename = _header_text(headers.get_filename() or '')
+            self._sink = _AttachmentSink(self.directory, encoding, filename, content_type)
+
+    def _finish_part(self):
+        if self._sink is not None:
+            sink, self._sink = self._sink, None
+            self.attachments.append(sink.close())
+
+    def close(self) -> bytes:
+        # 返回保留下来的邮件数据（邮件头与文本部分）
+        if self._header_lines is not None:
+            self._header_lines = None
+        try:
+            self._finish_part()
+        except OSError as e:
+            raise AttachmentWriteError(f"保存附件失败: {str(e)}") from e
+        data = b''.join(self._retained)
+        self._retained = []
+        return data
+
+    def abort(self):
+        if self._sink is not None:
+            self._sink.abort()
+            self._sink = None
+        self._retained = []
@@ -0,0 +1 @@
+# 基准测试：进程内SMTP/POP3/IMAP测试服务器、测试邮件生成与场景运行（python -m benchmarks.run）
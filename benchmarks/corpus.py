@@ -0,0 +1,70 @@
+import random
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.header import Header
+from email.utils import formatdate
+from typing import List, Optional
+
+# 邮件结构
+STRUCTURES = ('plain', 'alternative', 'attachment')
+# 正文字符集
+CHARSETS = ('utf-8', 'gbk', 'iso-8859-1')
+
+_WORDS = {
+    'utf-8': ['邮件', '测试', '性能', '客户端', 'hello', 'world', 'benchmark', '数据'],
+    'gbk': ['邮件', '测试', '性能', '客户端', '服务器', '接收', '发送', '数据'],
+    'iso-8859-1': ['café', 'naïve', 'façade', 'hello', 'world', 'résumé', 'benchmark', 'données'],
+}
+
+
+def _text(rng: random.Random, charset: str, size: int) -> str:
+    words = _WORDS[charset]
+    parts = []
+    length = 0
+    while length < size:
+        word = rng.choice(words)
+        parts.append(word)
+        length += len(word.encode(charset)) + 1
+        if len(parts) % 12 == 0:
+            parts.append('\n')
+    return ' '.join(parts)
+
+
+def make_message(index: int, size: int = 2048, structure: str = 'plain', charset: str = 'utf-8',
+                 seed: Optional[int] = None) -> bytes:
+    """生成一封测试邮件，size为正文（或附件）的大致字节数"""
+    seed = seed or 0
+    rng = random.Random(seed * 1000003 + index)
+    body = _text(rng, charset, size)
+    if structure == 'plain':
+        msg = MIMEText(body, 'plain', charset)
+    elif structure == 'alternative':
+        msg = MIMEMultipart('alternative')
+        msg.attach(MIMEText(body, 'plain', charset))
+        msg.attach(MIMEText(f"<html><body><p>{body}</p></body></html>", 'html', charset))
+    elif structure == 'attachment':
+        msg = MIMEMultipart()
+        msg.attach(MIMEText(body[:512], 'plain', charset))
+        attachment = MIMEApplication(rng.randbytes(size), Name=f'data{index}.bin')
+        attachment['Content-Disposition'] = f'attachment; filename="data{index}.bin"'
+        msg.attach(attachment)
+    else:
+        raise ValueError(f"未知的邮件结构: {structure}")
+    msg['From'] = Header(f'发件人{index % 97}', 'utf-8').encode() + f' <sender{index % 97}@example.com>'
+    msg['To'] = 'user@example.com'
+    msg['Subject'] = Header(f'测试邮件 {index}', 'utf-8')
+    msg['Date'] = formatdate(1700000000 + index * 60)
+    msg['Message-ID'] = f'<bench.{seed}.{index}@example.com>'
+    return msg.as_bytes()
+
+
+def make_corpus(count: int, size: int = 2048, structures=STRUCTURES, charsets=CHARSETS,
+                seed: int = 0) -> List[bytes]:
+    """按轮转方式组合结构和字符集，生成可复现的邮件集合"""
+    corpus = []
+    for i in range(count):
+        structure = structures[i % len(structures)]
+        charset = charsets[(i // len(structures)) % len(charsets)]
+        corpus.append(make_message(i, size, structure, charset, seed))
+    return corpus
@@ -0,0 +1,456 @@
+import re
+import socketserver
+import threading
+import time
+from typing import List, Optional
+
+
+class _ThreadingServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class _FakeHandler(socketserver.StreamRequestHandler):
+    """带延迟和带宽限制的行协议处理器"""
+
+    CHUNK_SIZE = 16 * 1024
+
+    @property
+    def owner(self):
+        return self.server.owner
+
+    def send(self, data: bytes):
+        owner = self.owner
+        if owner.latency:
+            time.sleep(owner.latency)
+        if not owner.bandwidth:
+            self.wfile.write(data)
+        else:
+            # 按带宽上限分块发送
+            for start in range(0, len(data), self.CHUNK_SIZE):
+                chunk = data[start:start + self.CHUNK_SIZE]
+                self.wfile.write(chunk)
+                self.wfile.flush()
+                time.sleep(len(chunk) / owner.bandwidth)
+        self.wfile.flush()
+
+    def read_line(self) -> Optional[bytes]:
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if self.owner.bandwidth:
+            time.sleep(len(line) / self.owner.bandwidth)
+        return line
+
+
+class _FakeServer:
+
+    handler_class = _FakeHandler
+
+    def __init__(self, latency: float = 0.0, bandwidth: Optional[float] = None, host: str = '127.0.0.1', port: int = 0):
+        # latency: 每个响应前的延迟（秒）；bandwidth: 字节/秒，None表示不限
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.host = host
+        self._requested_port = port
+        self._server = None
+        self._thread = None
+
+    @property
+    def port(self) -> int:
+        return self._server.server_address[1]
+
+    def start(self):
+        self._server = _ThreadingServer((self.host, self._requested_port), self.handler_class)
+        self._server.owner = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+class _SMTPHandler(_FakeHandler):
+
+    def handle(self):
+        owner = self.owner
+        self.send(b'220 fake-smtp ESMTP ready\r\n')
+        mail_from = None
+        recipients = []
+        while True:
+            line = self.read_line()
+            if line is None:
+                return
+            command = line.decode('utf-8', errors='ignore').strip()
+            verb = command.split(' ', 1)[0].upper()
+            if verb in ('EHLO', 'HELO'):
+                self.send(b'250-fake-smtp\r\n250-AUTH PLAIN\r\n250-8BITMIME\r\n250 SIZE 104857600\r\n')
+            elif verb == 'AUTH':
+                self.send(b'235 2.7.0 Authentication successful\r\n')
+            elif verb == 'MAIL':
+                mail_from = command[10:].strip()
+                recipients = []
+                self.send(b'250 2.1.0 Ok\r\n')
+            elif verb == 'RCPT':
+                if owner.max_recipients and len(recipients) >= owner.max_recipients:
+                    self.send(b'452 4.5.3 Too many recipients\r\n')
+                else:
+                    recipients.append(command[8:].strip())
+                    self.send(b'250 2.1.5 Ok\r\n')
+            elif verb == 'DATA':
+                self.send(b'354 End data with <CR><LF>.<CR><LF>\r\n')
+                lines = []
+                while True:
+                    data_line = self.rfile.readline()
+                    if not data_line or data_line == b'.\r\n':
+                        break
+                    if data_line.startswith(b'..'):
+                        data_line = data_line[1:]
+                    lines.append(data_line)
+                data = b''.join(lines)
+                if owner.bandwidth:
+                    time.sleep(len(data) / owner.bandwidth)
+                if owner.fault and owner.fault(self, recipients):
+                    self.send(b'554 5.7.1 Transaction failed\r\n')
+                    continue
+                with owner.lock:
+                    owner.transactions += 1
+                    if owner.keep_messages:
+                        owner.received.append((mail_from, list(recipients), data))
+                    owner.bytes_received += len(data)
+                self.send(b'250 2.0.0 Ok: queued\r\n')
+            elif verb == 'RSET':
+                mail_from = None
+                recipients = []
+                self.send(b'250 2.0.0 Ok\r\n')
+            elif verb == 'NOOP':
+                self.send(b'250 2.0.0 Ok\r\n')
+            elif verb == 'QUIT':
+                self.send(b'221 2.0.0 Bye\r\n')
+                return
+            else:
+                self.send(b'502 5.5.2 Command not recognized\r\n')
+
+
+class FakeSMTPServer(_FakeServer):
+    """进程内SMTP测试服务器（不支持TLS，客户端需use_ssl=False, use_starttls=False）
+
+    fault为可选的故障注入函数fault(handler, 收件人列表)，返回True时该次DATA以554拒绝。
+    """
+
+    handler_class = _SMTPHandler
+
+    def __init__(self, latency: float = 0.0, bandwidth: Optional[float] = None, max_recipients: Optional[int] = None,
+                 keep_messages: bool = True, fault=None, **kwargs):
+        super().__init__(latency, bandwidth, **kwargs)
+        self.max_recipients = max_recipients
+        self.keep_messages = keep_messages
+        self.fault = fault
+        self.lock = threading.Lock()
+        self.received = []
+        self.transactions = 0
+        self.bytes_received = 0
+
+
+def _pop3_payload(message: bytes) -> bytes:
+    # 统一为CRLF并做点填充，RETR时直接发送
+    lines = message.replace(b'\r\n', b'\n').split(b'\n')
+    if lines and lines[-1] == b'':
+        lines.pop()
+    stuffed = [b'.' + line if line.startswith(b'.') else line for line in lines]
+    return b'\r\n'.join(stuffed) + b'\r\n.\r\n'
+
+
+class _POP3Handler(_FakeHandler):
+
+    def handle(self):
+        owner = self.owner
+        self.send(b'+OK fake-pop3 ready\r\n')
+        deleted = set()
+        while True:
+            line = self.read_line()
+            if line is None:
+                return
+            parts = line.decode('utf-8', errors='ignore').split()
+            if not parts:
+                self.send(b'-ERR empty command\r\n')
+                continue
+            verb = parts[0].upper()
+            args = parts[1:]
+            messages = owner.messages
+            if verb in ('USER', 'PASS', 'NOOP'):
+                self.send(b'+OK\r\n')
+            elif verb == 'CAPA':
+                self.send(b'+OK\r\nUSER\r\n' + (b'UIDL\r\n' if owner.uidl else b'') + b'TOP\r\n.\r\n')
+            elif verb == 'UIDL' and not owner.uidl:
+                self.send(b'-ERR unknown command\r\n')
+            elif verb == 'STAT':
+                live = [i for i in range(len(messages)) if i not in deleted]
+                size = sum(len(messages[i]) for i in live)
+                self.send(f'+OK {len(live)} {size}\r\n'.encode())
+            elif verb in ('LIST', 'UIDL'):
+                def value(i):
+                    return len(messages[i]) if verb == 'LIST' else owner.uid(i)
+                if args:
+                    i = int(args[0]) - 1
+                    self.send(f'+OK {i + 1} {value(i)}\r\n'.encode())
+                else:
+                    lines = [f'{i + 1} {value(i)}\r\n' for i in range(len(messages)) if i not in deleted]
+                    self.send(('+OK\r\n' + ''.join(lines) + '.\r\n').encode())
+            elif verb in ('RETR', 'TOP'):
+                i = int(args[0]) - 1
+                if i < 0 or i >= len(messages) or i in deleted:
+                    self.send(b'-ERR no such message\r\n')
+                    continue
+                if verb == 'RETR':
+                    payload = owner.payload(i)
+                    if owner.fault and owner.fault(self, i):
+                        # 故障注入：发送一部分后断开连接
+                        self.wfile.write(b'+OK\r\n' + payload[:len(payload) // 2])
+                        self.wfile.flush()
+                        return
+                else:
+                    header = messages[i].replace(b'\r\n', b'\n').split(b'\n\n', 1)[0] + b'\n\n'
+                    payload = _pop3_payload(header)
+                self.send(f'+OK {len(messages[i])} octets\r\n'.encode() + payload)
+            elif verb == 'DELE':
+                deleted.add(int(args[0]) - 1)
+                self.send(b'+OK\r\n')
+            elif verb == 'RSET':
+                deleted.clear()
+                self.send(b'+OK\r\n')
+            elif verb == 'QUIT':
+                with owner.lock:
+                    owner.deleted.update(deleted)
+                self.send(b'+OK bye\r\n')
+                return
+            else:
+                self.send(b'-ERR unknown command\r\n')
+
+
+class FakePOP3Server(_FakeServer):
+    """进程内POP3测试服务器，邮件集合由调用者提供（见corpus.py）
+
+    fault为可选的故障注入函数fault(handler, index)，返回True时
+    该次RETR只发送一半数据就断开连接。uidl=False模拟不支持UIDL的服务器。
+    """
+
+    handler_class = _POP3Handler
+
+    def __init__(self, messages: List[bytes], latency: float = 0.0, bandwidth: Optional[float] = None,
+                 fault=None, uidl: bool = True, **kwargs):
+        super().__init__(latency, bandwidth, **kwargs)
+        self.messages = messages
+        self.fault = fault
+        self.uidl = uidl
+        self.lock = threading.Lock()
+        self.deleted = set()
+        self._payloads = {}
+
+    def uid(self, index: int) -> str:
+        return f'uid-{index + 1:08d}'
+
+    def payload(self, index: int) -> bytes:
+        payload = self._payloads.get(index)
+        if payload is None:
+            payload = self._payloads[index] = _pop3_payload(self.messages[index])
+        return payload
+
+
+def _imap_uid_ranges(spec: str, largest: int) -> List[tuple]:
+    # 解析UID集合（如 "1,3:5,7:*"），*为当前最大UID
+    ranges = []
+    for part in spec.split(','):
+        low, _, high = part.partition(':')
+        low = largest if low == '*' else int(low)
+        high = low if not high else (largest if high == '*' else int(high))
+        ranges.append((min(low, high), max(low, high)))
+    return ranges
+
+
+class _IMAPHandler(_FakeHandler):
+
+    def setup(self):
+        super().setup()
+        # IDLE期间服务器推送与本线程的响应可能同时写入
+        self.write_lock = threading.Lock()
+
+    def send(self, data: bytes):
+        with self.write_lock:
+            super().send(data)
+
+    def handle(self):
+        owner = self.owner
+        self.send(b'* OK fake-imap ready\r\n')
+        while True:
+            line = self.read_line()
+            if line is None:
+                return
+            parts = line.decode('utf-8', errors='ignore').strip().split(' ', 2)
+            if len(parts) < 2:
+                self.send(b'* BAD empty command\r\n')
+                continue
+            tag, verb = parts[0], parts[1].upper()
+            args = parts[2] if len(parts) > 2 else ''
+            if verb == 'UID':
+                sub, _, args = args.partition(' ')
+                verb = 'UID ' + sub.upper()
+            ok = f'{tag} OK {verb} completed\r\n'.encode()
+            if verb == 'CAPABILITY':
+                self.send(('* CAPABILITY IMAP4rev1 ' + ' '.join(owner.capabilities) + '\r\n').encode() + ok)
+            elif verb in ('LOGIN', 'NOOP'):
+                self.send(ok)
+            elif verb in ('SELECT', 'EXAMINE'):
+                self.send(self.select_response() + f'{tag} OK [READ-WRITE] {verb} completed\r\n'.encode())
+            elif verb == 'UID SEARCH':
+                uids = self.search(args)
+                self.send(('* SEARCH' + ''.join(f' {uid}' for uid in uids) + '\r\n').encode() + ok)
+            elif verb == 'UID FETCH':
+                self.send(self.fetch_response(args) + ok)
+            elif verb == 'IDLE' and 'IDLE' in owner.capabilities:
+                if not self.idle(tag):
+                    return
+            elif verb == 'LOGOUT':
+                self.send(b'* BYE fake-imap logging out\r\n' + ok)
+                return
+            else:
+                self.send(f'{tag} BAD unknown command\r\n'.encode())
+
+    def select_response(self) -> bytes:
+        owner = self.owner
+        with owner.lock:
+            lines = [
+                f'* {len(owner.messages)} EXISTS',
+                '* 0 RECENT',
+                '* FLAGS (\\Seen \\Answered \\Flagged \\Deleted \\Draft)',
+                f'* OK [UIDVALIDITY {owner.uidvalidity}] UIDs valid',
+                f'* OK [UIDNEXT {owner.uidnext}] Predicted next UID'
+            ]
+            if 'CONDSTORE' in owner.capabilities:
+                lines.append(f'* OK [HIGHESTMODSEQ {owner.highestmodseq}] Highest')
+        return ('\r\n'.join(lines) + '\r\n').encode()
+
+    def search(self, criteria: str) -> List[int]:
+        with self.owner.lock:
+            uids = [message[0] for message in self.owner.messages]
+        if criteria.upper().startswith('UID '):
+            ranges = _imap_uid_ranges(criteria[4:].strip(), uids[-1] if uids else 0)
+            uids = [uid for uid in uids if any(low <= uid <= high for low, high in ranges)]
+        return uids
+
+    def fetch_response(self, args: str) -> bytes:
+        owner = self.owner
+        spec, _, items = args.partition(' ')
+        items = items.upper()
+        changed = re.search(r'CHANGEDSINCE (\d+)', items)
+        changedsince = int(changed.group(1)) if changed else None
+        with owner.lock:
+            messages = list(owner.messages)
+        ranges = _imap_uid_ranges(spec, messages[-1][0] if messages else 0)
+        response = []
+        for seq, (uid, data, flags, modseq) in enumerate(messages, 1):
+            if not any(low <= uid <= high for low, high in ranges):
+                continue
+            if changedsince is not None and modseq <= changedsince:
+                continue
+            fields = [f'UID {uid}']
+            if 'RFC822.SIZE' in items:
+                fields.append(f'RFC822.SIZE {len(data)}')
+            if 'FLAGS' in items:
+                fields.append(f'FLAGS ({" ".join(flags)})')
+            if changedsince is not None:
+                fields.append(f'MODSEQ ({modseq})')
+            head = f'* {seq} FETCH (' + ' '.join(fields)
+            if 'BODY.PEEK[HEADER]' in items:
+                literal = data.split(b'\r\n\r\n', 1)[0] + b'\r\n\r\n'
+                response.append(f'{head} BODY[HEADER] {{{len(literal)}}}\r\n'.encode() + literal + b')\r\n')
+            elif 'BODY.PEEK[]' in items:
+                response.append(f'{head} BODY[] {{{len(data)}}}\r\n'.encode() + data + b')\r\n')
+            else:
+                response.append(f'{head})\r\n'.encode())
+        return b''.join(response)
+
+    def idle(self, tag: str) -> bool:
+        owner = self.owner
+        self.send(b'+ idling\r\n')
+        with owner.lock:
+            owner.idlers.add(self)
+        try:
+            line = self.read_line()
+        finally:
+            with owner.lock:
+                owner.idlers.discard(self)
+        if line is None:
+            return False
+        if line.strip().upper() == b'DONE':
+            with owner.lock:
+                trailer, owner.after_idle = owner.after_idle, []
+            self.send(f'{tag} OK IDLE terminated\r\n'.encode() + b''.join(line + b'\r\n' for line in trailer))
+        else:
+            self.send(f'{tag} BAD expected DONE\r\n'.encode())
+        return True
+
+
+class FakeIMAPServer(_FakeServer):
+    """进程内IMAP测试服务器（不支持TLS，客户端需use_ssl=False）
+
+    只实现IMAPClient用到的命令：CAPABILITY、LOGIN、SELECT（带UIDVALIDITY/UIDNEXT，
+    支持CONDSTORE时带HIGHESTMODSEQ）、UID SEARCH、UID FETCH（邮件头、完整邮件、
+    FLAGS及CHANGEDSINCE）、IDLE和LOGOUT。add_message()会向处于IDLE的连接推送EXISTS，
+    add_message()和set_flags()都会增大MODSEQ。after_idle中的未标记响应在结束IDLE的
+    标记响应之后、同一次写入中发送。
+    """
+
+    handler_class = _IMAPHandler
+
+    def __init__(self, messages: List[bytes], latency: float = 0.0, bandwidth: Optional[float] = None,
+                 capabilities=('IDLE', 'CONDSTORE'), uidvalidity: int = 1, **kwargs):
+        super().__init__(latency, bandwidth, **kwargs)
+        self.capabilities = list(capabilities)
+        self.uidvalidity = uidvalidity
+        self.lock = threading.Lock()
+        # [(UID, 邮件, 标志, MODSEQ)]，按UID升序
+        self.messages = []
+        self.uidnext = 1
+        self.highestmodseq = 1
+        self.idlers = set()
+        self.after_idle: List[bytes] = []
+        for message in messages:
+            self._append(message)
+
+    def _append(self, message: bytes) -> int:
+        # IMAP中邮件统一为CRLF换行
+        data = message.replace(b'\r\n', b'\n').replace(b'\n', b'\r\n')
+        uid = self.uidnext
+        self.uidnext += 1
+        self.highestmodseq += 1
+        self.messages.append((uid, data, [], self.highestmodseq))
+        return uid
+
+    def add_message(self, message: bytes) -> int:
+        with self.lock:
+            uid = self._append(message)
+            exists = len(self.messages)
+            idlers = list(self.idlers)
+        for handler in idlers:
+            handler.send(f'* {exists} EXISTS\r\n'.encode())
+        return uid
+
+    def set_flags(self, uid: int, flags: List[str]):
+        with self.lock:
+            for i, message in enumerate(self.messages):
+                if message[0] == uid:
+                    self.highestmodseq += 1
+                    self.messages[i] = (uid, message[1], list(flags), self.highestmodseq)
+                    return
+        raise KeyError(uid)
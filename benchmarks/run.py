@@ -0,0 +1,837 @@
+"""性能基准测试
+
+在仓库根目录运行:
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --quick --compare results.json
+
+每个场景给出一个score（越大越好），--compare时与基线结果比较，
+score下降超过阈值的场景视为性能回退，进程以非零状态退出。
+"""
+
+import argparse
+import json
+import multiprocessing
+import platform
+import random
+import tempfile
+import threading
+import tracemalloc
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List
+from unittest import mock
+
+import attachments
+from benchmarks.corpus import make_corpus, make_message, STRUCTURES
+from benchmarks.fake_servers import FakeSMTPServer, FakePOP3Server, FakeIMAPServer
+from email_encoder import EmailEncoder
+from encoder_registry import EncoderRegistry
+from imap_client import IMAPClient
+from mail_archive import LocalArchive, export_archive, import_mail, open_writer, parse_message
+from mail_store import MailStore, resumable_sync
+from metadata_index import MetadataIndex, READ, parse_date
+from mime_cache import EncodedPartCache
+from prefetch import BodyCache, BodyPrefetcher, neighbor_positions
+from metrics import MetricsRegistry
+from pop3_client import POP3Client
+from smtp_client import PartialDeliveryError, SMTPClient
+
+
+def _phase_summary(metrics: MetricsRegistry) -> Dict:
+    summary = {}
+    for item in metrics.snapshot()['latency']:
+        key = f"{item['protocol']}.{item['phase']}"
+        summary[key] = {
+            'count': item['count'],
+            'total_seconds': round(item['sum'], 6),
+            'mean_ms': round(item['sum'] / item['count'] * 1000, 4) if item['count'] else 0.0
+        }
+    return summary
+
+
+def bench_smtp_send(count: int, body_size: int = 2048, latency: float = 0.0) -> Dict:
+    body = ('性能测试 benchmark ' * (body_size // 24 + 1))[:body_size]
+    metrics = MetricsRegistry()
+    with FakeSMTPServer(latency=latency, keep_messages=False) as server:
+        client = SMTPClient('127.0.0.1', server.port, 'bench@example.com', 'secret',
+                            use_ssl=False, use_starttls=False, metrics=metrics)
+        with client:
+            start = time.perf_counter()
+            for i in range(count):
+                client.send_email(['user@example.com'], f'基准测试 {i}', body)
+            elapsed = time.perf_counter() - start
+        assert server.transactions == count
+    _check_partial_delivery()
+    return {
+        'params': {'count': count, 'body_size': body_size, 'latency': latency},
+        'seconds': elapsed,
+        'messages_per_second': count / elapsed,
+        'score': count / elapsed,
+        'phases': _phase_summary(metrics)
+    }
+
+
+def _check_partial_delivery():
+    # 收件人分成多个事务时，后面的事务失败要列出已发送和未发送的收件人，重试时不重复发送
+    recipients = [f'user{i}@example.com' for i in range(5)]
+    with FakeSMTPServer(fault=lambda handler, batch: '<user2@example.com>' in batch) as server:
+        client = SMTPClient('127.0.0.1', server.port, 'bench@example.com', 'secret',
+                            use_ssl=False, use_starttls=False, metrics=MetricsRegistry(), max_recipients=2)
+        with client:
+            try:
+                client.send_email(recipients, '部分发送', '正文')
+                raise AssertionError("第二个事务失败时应抛出PartialDeliveryError")
+            except PartialDeliveryError as e:
+                assert e.delivered == recipients[:2] and e.failed == recipients[2:], (e.delivered, e.failed)
+                failed = e.failed
+            # 只重发未发送的部分
+            server.fault = None
+            client.send_email(failed, '部分发送', '正文')
+        delivered = sorted(addr.strip('<>') for _, batch, _ in server.received for addr in batch)
+        assert delivered == recipients, delivered
+
+
+_corpus_cache = {}
+
+
+def _corpus(count: int, size: int) -> List[bytes]:
+    key = (count, size)
+    if key not in _corpus_cache:
+        _corpus_cache[key] = make_corpus(count, size)
+    return _corpus_cache[key]
+
+
+def bench_pop3_list(count: int, size: int = 2048, latency: float = 0.0, bandwidth: float = None) -> Dict:
+    corpus = _corpus(count, size)
+    metrics = MetricsRegistry()
+    with FakePOP3Server(corpus, latency=latency, bandwidth=bandwidth) as server:
+        client = POP3Client('127.0.0.1', server.port, 'user@example.com', 'secret',
+                            use_ssl=False, metrics=metrics)
+        with client:
+            start = time.perf_counter()
+            emails = client.list_emails()
+            elapsed = time.perf_counter() - start
+    assert len(emails) == count, f"期望 {count} 封邮件，实际 {len(emails)} 封"
+    total_bytes = sum(len(m) for m in corpus)
+    return {
+        'params': {'count': count, 'size': size, 'latency': latency, 'bandwidth': bandwidth},
+        'seconds': elapsed,
+        'messages_per_second': count / elapsed,
+        'mb_per_second': total_bytes / elapsed / 1e6,
+        'score': count / elapsed,
+        'phases': _phase_summary(metrics)
+    }
+
+
+def bench_imap_sync(count: int, size: int = 2048, latency: float = 0.0) -> Dict:
+    # IMAP：先批量取邮件头再逐封取正文，之后用CONDSTORE增量同步，并检查IDLE推送与取消
+    corpus = _corpus(count, size)
+    with FakeIMAPServer(corpus, latency=latency) as server:
+        client = IMAPClient('127.0.0.1', server.port, 'user@example.com', 'secret',
+                            use_ssl=False, metrics=MetricsRegistry())
+        with client:
+            state = dict(client.mailbox_state)
+            assert state == {'exists': count, 'uidvalidity': 1, 'uidnext': count + 1,
+                             'highestmodseq': server.highestmodseq}, state
+
+            start = time.perf_counter()
+            uids = client.search_uids('ALL')
+            headers = client.fetch_headers(uids)
+            header_seconds = time.perf_counter() - start
+            assert sorted(headers) == uids
+            assert all(headers[uid]['size'] == len(server.messages[uid - 1][1]) for uid in uids)
+            start = time.perf_counter()
+            bodies = {uid: client.fetch_body(uid) for uid in uids}
+            body_seconds = time.perf_counter() - start
+            assert all(bodies[uid] == server.messages[uid - 1][1] for uid in uids)
+
+            new_uids, changed, sync_state = client.sync_changes()
+            assert new_uids == uids and not changed
+            added = [server.add_message(message) for message in corpus[:3]]
+            server.set_flags(uids[0], ['\\Seen'])
+            start = time.perf_counter()
+            new_uids, changed, sync_state = client.sync_changes(sync_state)
+            sync_seconds = time.perf_counter() - start
+            assert new_uids == added, new_uids
+            assert changed == {uids[0]: ['\\Seen']}, changed
+            assert sync_state['last_uid'] == added[-1]
+            assert sync_state['highestmodseq'] == server.highestmodseq
+
+            # 服务器推送EXISTS时结束IDLE
+            timer = threading.Timer(0.1, server.add_message, [corpus[0]])
+            timer.start()
+            start = time.perf_counter()
+            responses = client.idle(timeout=10, poll_interval=0.05)
+            idle_push_seconds = time.perf_counter() - start
+            timer.join()
+            assert responses == [f'* {count + 4} EXISTS'.encode()], responses
+            # 取消时结束IDLE
+            cancel = threading.Event()
+            timer = threading.Timer(0.1, cancel.set)
+            timer.start()
+            start = time.perf_counter()
+            responses = client.idle(timeout=10, cancel_token=cancel, poll_interval=0.05)
+            idle_cancel_seconds = time.perf_counter() - start
+            timer.join()
+            assert responses == [] and idle_cancel_seconds < 1, (responses, idle_cancel_seconds)
+            # 与结束IDLE的标记响应一起到达的未标记响应不丢失
+            server.after_idle = [f'* {count + 4} EXISTS'.encode()]
+            cancel.set()
+            responses = client.idle(timeout=10, cancel_token=cancel, poll_interval=0.05)
+            assert responses == [f'* {count + 4} EXISTS'.encode()], responses
+            pushed = client.connection.response('EXISTS')[1][-1]
+            assert pushed == str(count + 4).encode(), pushed
+            # IDLE之后连接仍可正常使用
+            assert client.search_uids('ALL')[-1] == count + 4
+    return {
+        'params': {'count': count, 'size': size, 'latency': latency},
+        'header_seconds': header_seconds,
+        'body_seconds': body_seconds,
+        'sync_seconds': sync_seconds,
+        'idle_push_seconds': idle_push_seconds,
+        'idle_cancel_seconds': idle_cancel_seconds,
+        'score': count / (header_seconds + body_seconds)
+    }
+
+
+def bench_parse_email(repeat: int, size: int = 4096) -> Dict:
+    client = POP3Client('localhost', 110, '', '', use_ssl=False)
+    per_structure = {}
+    total_seconds = 0.0
+    total_messages = 0
+    for structure in STRUCTURES:
+        messages = [make_message(i, size, structure, 'utf-8') for i in range(20)]
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for message in messages:
+                client._parse_email(message)
+        elapsed = time.perf_counter() - start
+        parsed = repeat * len(messages)
+        per_structure[structure] = {
+            'us_per_message': elapsed / parsed * 1e6,
+            'mb_per_second': sum(len(m) for m in messages) * repeat / elapsed / 1e6
+        }
+        total_seconds += elapsed
+        total_messages += parsed
+    return {
+        'params': {'repeat': repeat, 'size': size},
+        'structures': per_structure,
+        'us_per_message': total_seconds / total_messages * 1e6,
+        'score': total_messages / total_seconds
+    }
+
+
+def bench_encoder(size_mb: float) -> Dict:
+    text = ('邮件编码测试 Base64 benchmark 0123456789\n' * int(size_mb * 1e6 / 48 + 1))
+    data_mb = len(text.encode('utf-8')) / 1e6
+    results = {}
+    for name, encoder in (('standard', EmailEncoder()),
+                          ('custom', EmailEncoder(EmailEncoder.negotiate_table('benchmark')))):
+        start = time.perf_counter()
+        encoded = encoder.encode(text)
+        encode_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        decoded = encoder.decode(encoded)
+        decode_seconds = time.perf_counter() - start
+        assert decoded == text
+        results[name] = {
+            'encode_mb_per_second': data_mb / encode_seconds,
+            'decode_mb_per_second': data_mb / decode_seconds
+        }
+    return {
+        'params': {'size_mb': round(data_mb, 3)},
+        'encoders': results,
+        'score': results['custom']['encode_mb_per_second']
+    }
+
+
+def bench_cli_cold_start(repeat: int) -> Dict:
+    # 命令行不应导入tkinter，启动时间取多次运行的中位数
+    check = subprocess.run([sys.executable, '-c', "import sys, cli; print('tkinter' in sys.modules)"],
+                           capture_output=True, text=True)
+    assert check.stdout.strip() == 'False', "cli模块不应导入tkinter"
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, 'main.py', '--help'], capture_output=True, check=True)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    median = timings[len(timings) // 2]
+    return {
+        'params': {'repeat': repeat},
+        'median_seconds': median,
+        'min_seconds': timings[0],
+        'score': 1 / median
+    }
+
+
+def bench_snapshot_load(count: int, repeat: int = 5) -> Dict:
+    # 启动时读取收件箱快照的耗时（首屏显示前唯一的阻塞操作）
+    import tempfile
+    client = POP3Client('localhost', 110, '', '', use_ssl=False)
+    emails = []
+    for i, message in enumerate(_corpus(count, 2048)):
+        email = client._parse_email(message)
+        email['index'] = i + 1
+        email['uid'] = f'uid-{i + 1:08d}'
+        emails.append(email)
+    with tempfile.TemporaryDirectory() as data_dir:
+        store = MailStore(data_dir)
+        store.save_snapshot('bench', emails, 'pop3')
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            snapshot = store.load_snapshot('bench')
+            timings.append(time.perf_counter() - start)
+        assert len(snapshot['emails']) == count
+    best = min(timings)
+    return {
+        'params': {'count': count, 'repeat': repeat},
+        'seconds': best,
+        'score': count / best
+    }
+
+
+def _serve_pop3(messages: List[bytes], port_queue, stop_event):
+    # 在独立进程中运行服务器，避免其内存计入客户端
+    with FakePOP3Server(messages) as server:
+        port_queue.put(server.port)
+        stop_event.wait(300)
+
+
+def bench_attachment_extract(size: int) -> Dict:
+    # 比较附件流式解码到磁盘与整封读入内存两种方式的峰值内存和速度
+    message = make_message(0, size, 'attachment')
+    port_queue = multiprocessing.Queue()
+    stop_event = multiprocessing.Event()
+    process = multiprocessing.Process(target=_serve_pop3, args=([message], port_queue, stop_event), daemon=True)
+    process.start()
+    results = {}
+    try:
+        port = port_queue.get(timeout=30)
+        with tempfile.TemporaryDirectory() as attachment_dir:
+            for name, directory in (('in_memory', None), ('streaming', attachment_dir)):
+                client = POP3Client('127.0.0.1', port, 'user@example.com', 'secret', use_ssl=False,
+                                    metrics=MetricsRegistry(), attachment_dir=directory)
+                with client:
+                    tracemalloc.start()
+                    start = time.perf_counter()
+                    email = client.get_email(1)
+                    elapsed = time.perf_counter() - start
+                    _, peak = tracemalloc.get_traced_memory()
+                    tracemalloc.stop()
+                results[name] = {
+                    'seconds': elapsed,
+                    'peak_mb': peak / 1e6,
+                    'attachments': len(email.get('attachments', []))
+                }
+    finally:
+        stop_event.set()
+        process.join(5)
+    assert results['streaming']['attachments'] == 1
+    _check_attachment_failure()
+    return {
+        'params': {'size': size},
+        'modes': results,
+        'score': size / 1e6 / results['streaming']['seconds']
+    }
+
+
+def _check_attachment_failure():
+    # 某封邮件的附件写入失败（如磁盘已满）时跳过该邮件，其余邮件仍能在同一会话中取回
+    messages = [make_message(i, 100000, 'attachment') for i in range(4)]
+    write = attachments._AttachmentSink._write
+
+    def failing_write(sink, data):
+        if sink.filename == 'data2.bin':
+            raise OSError(28, 'No space left on device')
+        write(sink, data)
+
+    with FakePOP3Server(messages) as server, tempfile.TemporaryDirectory() as attachment_dir:
+        client = POP3Client('127.0.0.1', server.port, 'user@example.com', 'secret', use_ssl=False,
+                            metrics=MetricsRegistry(), attachment_dir=attachment_dir)
+        with client, mock.patch.object(attachments._AttachmentSink, '_write', failing_write):
+            emails = list(client.iter_emails(len(messages)))
+        assert [email['attachments'][0]['filename'] for email in emails] == ['data3.bin', 'data1.bin', 'data0.bin']
+
+
+def bench_attachment_send(count: int, size: int) -> Dict:
+    # 群发同一附件时每封邮件的构建耗时：每封都重新编码（缓存容量为0）与使用编码缓存
+    import os
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'report.pdf')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(size))
+        for name, cache in (('no_cache', EncodedPartCache(0)), ('cached', EncodedPartCache())):
+            client = SMTPClient('localhost', 25, 'bench@example.com', '', use_ssl=False, part_cache=cache)
+            start = time.perf_counter()
+            for i in range(count):
+                message = client.build_message([f'user{i}@example.com'], '月度报告', '请查收附件', attachments=[path])
+            elapsed = time.perf_counter() - start
+            results[name] = {
+                'ms_per_message': elapsed / count * 1000,
+                'encodes': cache.misses,
+                'message_bytes': len(message)
+            }
+        # 端到端发送一封，确认服务器收到的附件内容正确
+        with FakeSMTPServer() as server:
+            with SMTPClient('127.0.0.1', server.port, 'bench@example.com', 'secret', use_ssl=False,
+                            use_starttls=False, metrics=MetricsRegistry(), part_cache=cache) as client:
+                client.send_email(['user@example.com'], '月度报告', '请查收附件', attachments=[path])
+            import email
+            received = email.message_from_bytes(server.received[0][2])
+            with open(path, 'rb') as f:
+                assert received.get_payload()[1].get_payload(decode=True) == f.read()
+    assert results['cached']['encodes'] == 1
+    return {
+        'params': {'count': count, 'size': size},
+        'modes': results,
+        'speedup': results['no_cache']['ms_per_message'] / results['cached']['ms_per_message'],
+        'score': 1000 / results['cached']['ms_per_message']
+    }
+
+
+def bench_template_build(count: int) -> Dict:
+    # 群发时每封邮件的构建耗时：逐封build_message与预编译模板
+    client = SMTPClient('localhost', 25, '市场部 <bench@example.com>', '', use_ssl=False)
+    subject = '{name}，您的{month}月账单'
+    body = '尊敬的{name}：\n\n您本月的消费金额为{amount}元，详情见附件。\n' + '此邮件由系统自动发送，请勿回复。\n' * 20
+    jobs = [{'to': f'user{i}@example.com', 'name': f'用户{i}', 'month': '10', 'amount': f'{i * 3.5:.2f}'}
+            for i in range(count)]
+    start = time.perf_counter()
+    for job in jobs:
+        client.build_message([job['to']], subject.format(**job), body.format(**job))
+    direct = time.perf_counter() - start
+    start = time.perf_counter()
+    template = client.compile_template(subject, body)
+    for job in jobs:
+        template.render([job['to']], job)
+    templated = time.perf_counter() - start
+    import email
+    expected = email.message_from_string(client.build_message([jobs[-1]['to']], subject.format(**jobs[-1]),
+                                                              body.format(**jobs[-1])))
+    rendered = email.message_from_string(template.render([jobs[-1]['to']], jobs[-1]))
+    assert rendered['Subject'] == expected['Subject']
+    assert rendered.get_payload()[0].get_payload(decode=True) == expected.get_payload()[0].get_payload(decode=True)
+    return {
+        'params': {'count': count},
+        'build_message_us': direct / count * 1e6,
+        'template_us': templated / count * 1e6,
+        'speedup': direct / templated,
+        'score': count / templated
+    }
+
+
+def bench_resumable_sync(count: int, size: int = 2048) -> Dict:
+    # 故障注入：RETR进行到一半时断开连接，检查断点续传不丢邮件、不重复下载
+    corpus = _corpus(count, size)
+    drop_at = count // 2
+    retrieved = []
+
+    def drop_once(handler, index):
+        # 第一次取到drop_at时断开，之后正常
+        retrieved.append(index)
+        return index == drop_at and retrieved.count(index) == 1
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        store = MailStore(data_dir)
+        with FakePOP3Server(corpus, fault=drop_once) as server:
+            client = POP3Client('127.0.0.1', server.port, 'user@example.com', 'secret',
+                                use_ssl=False, metrics=MetricsRegistry())
+            with client:
+                start = time.perf_counter()
+                emails = resumable_sync(client, store.checkpoint('bench'), retry_delay=0)
+                elapsed = time.perf_counter() - start
+        assert len(emails) == count, f"期望 {count} 封邮件，实际 {len(emails)} 封"
+        assert len(retrieved) == count + 1, "断点之前的邮件不应重复下载"
+
+        # 程序中途退出：服务器从某封起一直断开，重试用尽后抛出异常，重新同步时只下载剩下的邮件
+        retrieved.clear()
+        stop_at = count // 3
+        checkpoint = store.checkpoint('crash')
+        with FakePOP3Server(corpus, fault=lambda handler, index: retrieved.append(index) or index == stop_at) as server:
+            client = POP3Client('127.0.0.1', server.port, 'user@example.com', 'secret',
+                                use_ssl=False, metrics=MetricsRegistry())
+            try:
+                with client:
+                    resumable_sync(client, checkpoint, max_retries=1, retry_delay=0)
+                raise AssertionError("连接一直中断时应抛出异常")
+            except Exception as e:
+                if isinstance(e, AssertionError):
+                    raise
+        checkpoint.close()
+        committed = len(store.checkpoint('crash'))
+        retrieved.clear()
+        with FakePOP3Server(corpus, fault=lambda handler, index: retrieved.append(index) and False) as server:
+            client = POP3Client('127.0.0.1', server.port, 'user@example.com', 'secret',
+                                use_ssl=False, metrics=MetricsRegistry())
+            with client:
+                emails = resumable_sync(client, store.checkpoint('crash'), retry_delay=0)
+        assert len(emails) == count
+        assert len(retrieved) == count - committed, "恢复后应只下载检查点之后的邮件"
+
+        # 邮件本身的问题（这里是附件写入失败）只跳过该邮件，不重新连接、不重复下载
+        retrieved.clear()
+        write = attachments._AttachmentSink._write
+
+        def failing_write(sink, data):
+            if sink.filename == 'data2.bin':
+                raise OSError(28, 'No space left on device')
+            write(sink, data)
+
+        with FakePOP3Server(corpus, fault=lambda handler, index: retrieved.append(index) and False) as server:
+            client = POP3Client('127.0.0.1', server.port, 'user@example.com', 'secret', use_ssl=False,
+                                metrics=MetricsRegistry(), attachment_dir=store.attachment_dir('skip'))
+            with client, mock.patch.object(attachments._AttachmentSink, '_write', failing_write):
+                emails = resumable_sync(client, store.checkpoint('skip'), retry_delay=0)
+        assert len(emails) == count - 1 and 'uid-00000003' not in {email['uid'] for email in emails}
+        assert len(retrieved) == count, "跳过的邮件不应重新连接后重复下载"
+
+        # 服务器不支持UIDL时退化为普通接收
+        with FakePOP3Server(corpus, uidl=False) as server:
+            client = POP3Client('127.0.0.1', server.port, 'user@example.com', 'secret',
+                                use_ssl=False, metrics=MetricsRegistry())
+            received = []
+            with client:
+                emails = resumable_sync(client, store.checkpoint('no-uidl'), retry_delay=0, on_email=received.append)
+        assert len(emails) == count and received == emails
+        assert emails[0]['subject'] == parse_message(corpus[-1])['subject'], "应按从新到旧排列"
+    return {
+        'params': {'count': count, 'size': size},
+        'seconds': elapsed,
+        'committed_before_crash': committed,
+        'score': count / elapsed
+    }
+
+
+def bench_prefetch_navigation(count: int, latency: float = 0.01, dwell: float = 0.1) -> Dict:
+    # 逐封向下浏览只有正文开头的邮件（快照）和按规则跳过正文的邮件，统计每次选中后等待完整正文的时间
+    corpus = _corpus(count, 8192)
+    results = {}
+    with FakePOP3Server(corpus, latency=latency) as server:
+        def make_client():
+            return POP3Client('127.0.0.1', server.port, 'user@example.com', 'secret',
+                              use_ssl=False, metrics=MetricsRegistry())
+        with make_client() as client:
+            emails = [dict(email, body=email['body'][:100], partial=True) if i % 3
+                      else dict(email, body='', body_skipped=True)
+                      for i, email in enumerate(client.list_emails())]
+        for name, prefetch in (('on_demand', False), ('prefetch', True)):
+            cache = BodyCache()
+            ready = threading.Condition()
+
+            def on_ready(key, record):
+                with ready:
+                    ready.notify_all()
+            prefetcher = BodyPrefetcher('bench', make_client, cache, on_ready=on_ready)
+            prefetcher.IDLE_DELAY = dwell / 4
+            waits = []
+            for i, email in enumerate(emails):
+                key = ('bench', email['uid'])
+                start = time.perf_counter()
+                if key not in cache:
+                    prefetcher.fetch_now(key, email)
+                if prefetch:
+                    prefetcher.schedule([(('bench', emails[j]['uid']), emails[j])
+                                         for j in neighbor_positions(i, len(emails), prefetcher.RADIUS)])
+                with ready:
+                    ready.wait_for(lambda: key in cache, timeout=10)
+                waits.append(time.perf_counter() - start)
+                # 阅读当前邮件
+                time.sleep(dwell)
+            prefetcher.close()
+            waits.sort()
+            results[name] = {
+                'mean_wait_ms': sum(waits) / len(waits) * 1000,
+                'p90_wait_ms': waits[int(len(waits) * 0.9)] * 1000,
+                'instant': sum(1 for wait in waits if wait < 0.001)
+            }
+    # 两种需要正文的邮件都会排入预取队列
+    prefetcher = BodyPrefetcher('bench', None, BodyCache())
+    prefetcher.pause(0)
+    prefetcher.schedule([(('bench', email['uid']), email) for email in emails[:6]])
+    assert len(prefetcher._queue) == 6, "跳过正文的邮件也应预取"
+    prefetcher.close()
+    return {
+        'params': {'count': count, 'latency': latency, 'dwell': dwell},
+        'modes': results,
+        'score': 1000 / max(results['prefetch']['mean_wait_ms'], 0.01)
+    }
+
+
+def bench_metadata_index(count: int) -> Dict:
+    # 大邮箱的排序、筛选与分组：逐个邮件字典处理 vs 列式索引
+    import random
+    from email.utils import formatdate
+    rng = random.Random(0)
+    senders = [f'User {i} <user{i}@example{i % 50}.com>' for i in range(5000)]
+    folders = ['', '', '', 'Work', 'Lists', 'Archive']
+    base = 1.6e9
+    dates = [formatdate(base + i * 3600, localtime=False) for i in range(2000)]
+    # 邮件大致按到达时间排列，偶有乱序
+    items = [{
+        'from': rng.choice(senders),
+        'subject': f'Subject {rng.randrange(count)}',
+        'date': dates[min(max(i * len(dates) // count + rng.randrange(-3, 4), 0), len(dates) - 1)],
+        'size': rng.randrange(500, 200000),
+        'folder': rng.choice(folders),
+        'read': rng.random() < 0.7
+    } for i in range(count)]
+
+    def timed(func):
+        start = time.perf_counter()
+        result = func()
+        return time.perf_counter() - start, result
+
+    # 逐个字典：排序键为入库时解析好的列表，筛选和分组访问字典
+    dict_times = {}
+    dict_times['ingest'], date_keys = timed(lambda: [parse_date(item['date']) for item in items])
+    dict_times['sort_date'], _ = timed(lambda: sorted(range(count), key=date_keys.__getitem__, reverse=True))
+    dict_times['filter'], expected = timed(lambda: [i for i, item in enumerate(items)
+                                                     if item.get('folder') == 'Work' and not item.get('read')])
+
+    def group_dicts():
+        counts = {}
+        for item in items:
+            counts[item['from']] = counts.get(item['from'], 0) + 1
+        return counts
+    dict_times['group_sender'], _ = timed(group_dicts)
+
+    for item in items:
+        item.pop('timestamp', None)
+    index_times = {}
+    index_times['ingest'], index = timed(lambda: MetadataIndex(items))
+    index_times['sort_date'], _ = timed(lambda: index.sorted_rows('date', reverse=True))
+    index_times['resort_date'], _ = timed(lambda: index.sorted_rows('date'))
+    index_times['filter'], rows = timed(lambda: index.select(index.mask(folder='Work', flags_clear=READ),
+                                                             range(count)))
+    assert rows == expected
+    since, until = base + 500 * 3600, base + 520 * 3600
+    index_times['filter_range'], rows = timed(lambda: index.select(
+        index.mask(sender='user7@example7.com', since=since, until=until), range(count)))
+    assert rows == [i for i, item in enumerate(items) if item['from'] == senders[7]
+                    and since <= date_keys[i] < until]
+    index_times['group_sender'], _ = timed(lambda: index.count_by('sender'))
+    index_times['group_day'], _ = timed(lambda: index.count_by_day())
+
+    # 接收时每批追加50封：按日期的排列只合并新行
+    head = count - count // 10
+    streamed = MetadataIndex(items[:head])
+    streamed.sorted_rows('date')
+
+    def append_batches():
+        for start in range(head, count, 50):
+            streamed.append(items[start:start + 50])
+    index_times['append_batches'], _ = timed(append_batches)
+    assert streamed.sorted_rows('date') == index.sorted_rows('date')
+    query = index_times['filter'] + index_times['group_sender'] + index_times['resort_date']
+    return {
+        'params': {'count': count},
+        'dicts_ms': {name: value * 1000 for name, value in dict_times.items()},
+        'index_ms': {name: value * 1000 for name, value in index_times.items()},
+        'score': count / query
+    }
+
+
+def bench_mbox_import(count: int, size: int = 4096) -> Dict:
+    # 导入mbox到本地存档：标准库mailbox逐封读取解析 vs mmap扫描边界+多进程解析；以及流式导出
+    import mailbox
+    import os
+    corpus = _corpus(count, size)
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = os.path.join(work_dir, 'source.mbox')
+        with open(path, 'wb') as f:
+            for message in corpus:
+                f.write(b'From sender@example.com Mon Jan  1 00:00:00 2024\n')
+                f.write(message.replace(b'\r\n', b'\n').rstrip(b'\n') + b'\n\n')
+        total = os.path.getsize(path)
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        parsed = sum(1 for message in mailbox.mbox(path, create=False) if parse_message(message.as_bytes()))
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        results['stdlib_mailbox'] = {'seconds': elapsed, 'mb_per_second': total / elapsed / 1e6,
+                                     'peak_mb': peak / 1e6, 'messages': parsed}
+
+        for name, workers in (('import_1_worker', 1), ('import_parallel', max(os.cpu_count() or 1, 2))):
+            archive = LocalArchive(os.path.join(work_dir, name))
+            tracemalloc.start()
+            start = time.perf_counter()
+            result = import_mail(archive, [path], workers=workers)
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            assert result.imported == count, f"期望导入 {count} 封，实际 {result.imported} 封"
+            results[name] = {'seconds': elapsed, 'mb_per_second': total / elapsed / 1e6,
+                             'peak_mb': peak / 1e6, 'workers': workers}
+            archive.close()
+
+        writer = open_writer(os.path.join(work_dir, 'export.mbox'))
+        tracemalloc.start()
+        start = time.perf_counter()
+        exported = export_archive(archive, writer)
+        writer.close()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert exported == count
+        results['export'] = {'seconds': elapsed, 'mb_per_second': total / elapsed / 1e6, 'peak_mb': peak / 1e6}
+    best = min(results['import_1_worker']['seconds'], results['import_parallel']['seconds'])
+    return {
+        'params': {'count': count, 'size': size, 'mb': total / 1e6, 'cpus': os.cpu_count()},
+        'modes': results,
+        'score': total / best / 1e6
+    }
+
+
+def bench_encoder_registry(count: int, contacts: int = 200) -> Dict:
+    # 收件箱中的邮件来自使用不同编码表的联系人：逐个尝试已知编码表 vs 按发件人查登记表
+    from email.mime.text import MIMEText
+    rng = random.Random(0)
+    registry = EncoderRegistry()
+    tables = []
+    for i in range(contacts):
+        table = EmailEncoder.negotiate_table(f'secret-{i}-{rng.random()}')
+        registry.set(f'contact{i}@example.com', table)
+        tables.append(table)
+    messages, expected = [], []
+    for i in range(count):
+        contact = rng.randrange(contacts)
+        text = f'第{i}封邮件的正文 message {i} ' * 20
+        message = MIMEText(EmailEncoder(tables[contact]).encode(text), 'plain', 'utf-8')
+        message['From'] = f'Contact {contact} <contact{contact}@example.com>'
+        message['Subject'] = f'Subject {i}'
+        messages.append(message.as_bytes())
+        expected.append(text)
+    client = POP3Client('localhost', 110, '', '', use_ssl=False, metrics=MetricsRegistry())
+    encoders = [EmailEncoder(table) for table in tables]
+
+    def trial_decode(text):
+        # 没有登记表时只能依次尝试，解出合法UTF-8即认为成功（可能解错）
+        for encoder in encoders:
+            try:
+                return encoder.decode(text)
+            except Exception:
+                continue
+        return text
+
+    results = {}
+    for name, decoder_func in (('trial', trial_decode), ('registry', registry.decoder())):
+        start = time.perf_counter()
+        bodies = [client._parse_email(message, decoder_func)['body'] for message in messages]
+        elapsed = time.perf_counter() - start
+        results[name] = {
+            'seconds': elapsed,
+            'messages_per_second': count / elapsed,
+            'correct': sum(body == text for body, text in zip(bodies, expected))
+        }
+    assert results['registry']['correct'] == count
+    return {
+        'params': {'count': count, 'contacts': contacts},
+        'modes': results,
+        'score': results['registry']['messages_per_second']
+    }
+
+
+def scenarios(quick: bool) -> Dict[str, Callable[[], Dict]]:
+    scale = 0.1 if quick else 1.0
+    return {
+        'smtp_send': lambda: bench_smtp_send(int(500 * scale) or 1),
+        'smtp_send_latency': lambda: bench_smtp_send(int(50 * scale) or 1, latency=0.002),
+        'pop3_list_50': lambda: bench_pop3_list(50),
+        'pop3_list_1000': lambda: bench_pop3_list(1000),
+        'pop3_list_10000': lambda: bench_pop3_list(1000 if quick else 10000),
+        'pop3_list_slow_link': lambda: bench_pop3_list(50, latency=0.005, bandwidth=2e6),
+        'imap_sync': lambda: bench_imap_sync(100 if quick else 1000),
+        'parse_email': lambda: bench_parse_email(int(20 * scale) or 1),
+        'encoder': lambda: bench_encoder(4 * scale),
+        'encoder_registry': lambda: bench_encoder_registry(200 if quick else 1000),
+        'snapshot_load': lambda: bench_snapshot_load(1000),
+        'mbox_import': lambda: bench_mbox_import(2000 if quick else 20000),
+        'metadata_index': lambda: bench_metadata_index(100000 if quick else 1000000),
+        'prefetch_navigation': lambda: bench_prefetch_navigation(10 if quick else 30),
+        'resumable_sync': lambda: bench_resumable_sync(100 if quick else 1000),
+        'attachment_extract': lambda: bench_attachment_extract(int(20e6 * scale)),
+        'attachment_send': lambda: bench_attachment_send(int(200 * scale) or 1, 1000000),
+        'template_build': lambda: bench_template_build(int(10000 * scale) or 1),
+        'cli_cold_start': lambda: bench_cli_cold_start(3 if quick else 10),
+    }
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, timeout=10).stdout.strip()
+    except Exception:
+        return ''
+
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> List[str]:
+    regressions = []
+    for name, result in results['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if not base or not base.get('score'):
+            continue
+        ratio = result['score'] / base['score']
+        result['baseline_ratio'] = ratio
+        if ratio < 1 - threshold:
+            regressions.append(f"{name}: {base['score']:.2f} -> {result['score']:.2f} ({ratio:.0%})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="邮件客户端性能基准测试")
+    parser.add_argument('--quick', action='store_true', help="缩小规模，快速运行")
+    parser.add_argument('--scenario', action='append', help="只运行指定场景（可重复）")
+    parser.add_argument('--output', help="结果JSON输出路径（默认输出到标准输出）")
+    parser.add_argument('--compare', help="与之前的结果JSON比较")
+    parser.add_argument('--threshold', type=float, default=0.2, help="判定回退的score下降比例（默认0.2）")
+    args = parser.parse_args(argv)
+
+    available = scenarios(args.quick)
+    selected = args.scenario or list(available)
+    unknown = [name for name in selected if name not in available]
+    if unknown:
+        parser.error(f"未知场景: {', '.join(unknown)}（可选: {', '.join(available)}）")
+
+    results = {
+        'meta': {
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': time.time(),
+            'quick': args.quick
+        },
+        'results': {}
+    }
+    for name in selected:
+        print(f"运行 {name} ...", file=sys.stderr)
+        results['results'][name] = available[name]()
+        print(f"  score = {results['results'][name]['score']:.2f}", file=sys.stderr)
+
+    regressions = []
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        results['regressions'] = regressions
+
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if regressions:
+        print("性能回退:\n  " + "\n  ".join(regressions), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
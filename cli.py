@@ -0,0 +1,471 @@
+"""命令行入口（不导入tkinter，可在无图形界面的服务器上使用）
+
+    python main.py send --to a@example.com --subject 主题 --body 正文
+    python main.py bulk-send jobs.csv
+    python main.py bulk-send jobs.csv --subject "{name}的月度报告" --body-file body.txt
+    python main.py sync --count 20
+    python main.py export --output mail.jsonl
+    python main.py import archive.mbox ~/Mail/eml目录
+    python main.py export-mail --output backup.mbox
+    python main.py daemon --interval 300
+
+客户端模块在子命令内部才导入，保证 --help 等命令的启动开销最小。
+"""
+
+import argparse
+import json
+import sys
+import time
+from typing import Dict, Iterator, List, Optional
+
+
+def _split_addrs(value) -> List[str]:
+    # 与图形界面相同的拆分规则；批量任务JSON中的地址也可以是数组
+    from recipients import split_addresses
+    if isinstance(value, (list, tuple)):
+        value = ','.join(str(addr) for addr in value)
+    return split_addresses(str(value or ''))
+
+
+def _split_paths(value) -> List[str]:
+    # 附件路径可能含逗号，只按分号分隔
+    if not value:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(path).strip() for path in value if str(path).strip()]
+    return [path.strip() for path in str(value).split(';') if path.strip()]
+
+
+def _load_account(args) -> Dict:
+    from config_manager import ConfigManager
+    with ConfigManager(args.config) as config_manager:
+        account = config_manager.get_account(args.account)
+    if not account:
+        if args.account:
+            raise Exception(f"账号 '{args.account}' 不存在")
+        raise Exception("未配置账号，请先在图形界面或配置文件中添加账号")
+    return account
+
+
+def _mail_store(args):
+    from config_manager import ConfigManager
+    from mail_store import MailStore
+    with ConfigManager(args.config) as config_manager:
+        return MailStore(config_manager.get_setting('data_dir'))
+
+
+def _open_archive(args, account: Dict):
+    # 当前账号的本地邮件存档（导入的mbox/.eml）
+    return _mail_store(args).archive(account['name'])
+
+
+def _encoder_func(args, addrs: List[str]):
+    # 收件人登记了编码表时使用（见encoder_registry.py）
+    encoder = _mail_store(args).encoder_registry().encoder_for_recipients(addrs)
+    return encoder.encode if encoder else None
+
+
+def _create_smtp_client(account: Dict):
+    from smtp_client import SMTPClient
+    return SMTPClient(
+        account['smtp_server'],
+        account['smtp_port'],
+        account['email'],
+        account['password'],
+        account.get('use_ssl', True),
+        use_starttls=account.get('use_starttls', True),
+        max_recipients=account.get('max_recipients')
+    )
+
+
+def _create_receive_client(account: Dict):
+    if account.get('receive_protocol', 'pop3') == 'imap':
+        from imap_client import IMAPClient
+        return IMAPClient(
+            account['imap_server'],
+            account['imap_port'],
+            account['email'],
+            account['password'],
+            account.get('use_ssl', True)
+        )
+    from pop3_client import POP3Client
+    return POP3Client(
+        account['pop3_server'],
+        account['pop3_port'],
+        account['email'],
+        account['password'],
+        account.get('use_ssl', True)
+    )
+
+
+def _print_refused(refused: Dict, prefix: str = ''):
+    for addr, (code, resp) in refused.items():
+        if isinstance(resp, bytes):
+            resp = resp.decode('utf-8', errors='replace')
+        print(f"{prefix}收件人 {addr} 被拒绝: {code} {resp}", file=sys.stderr)
+
+
+def _print_email(email: Dict):
+    print(f"[{email.get('index')}] {email.get('date', '')} | {email.get('from', '')} | {email.get('subject', '')}")
+
+
+def _read_body(args) -> str:
+    if args.body_file:
+        with open(args.body_file, 'r', encoding='utf-8') as f:
+            return f.read()
+    if args.body is not None:
+        return args.body
+    return sys.stdin.read()
+
+
+def cmd_send(args) -> int:
+    account = _load_account(args)
+    to_addrs = _split_addrs(args.to)
+    if not to_addrs:
+        raise Exception("请输入收件人地址")
+    encoder_func = _encoder_func(args, to_addrs + _split_addrs(args.cc) + _split_addrs(args.bcc))
+    with _create_smtp_client(account) as smtp_client:
+        smtp_client.send_email(
+            to_addrs,
+            args.subject,
+            _read_body(args),
+            cc_addrs=_split_addrs(args.cc) or None,
+            bcc_addrs=_split_addrs(args.bcc) or None,
+            encoder_func=encoder_func,
+            attachments=args.attach or None
+        )
+        _print_refused(smtp_client.last_refused)
+    print("邮件发送成功")
+    return 0
+
+
+def _iter_jobs(path: str) -> Iterator[Dict]:
+    # CSV需包含to、subject、body列（cc、bcc、attachments可选）；JSONL每行一个同样字段的对象
+    if path.lower().endswith('.csv'):
+        import csv
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            for row in csv.DictReader(f):
+                yield row
+    else:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def cmd_bulk_send(args) -> int:
+    account = _load_account(args)
+    sent = 0
+    failed = 0
+    with _create_smtp_client(account) as smtp_client:
+        template = None
+        if args.subject is not None or args.body_file:
+            # 模板模式：主题和正文中的{列名}替换为每行对应列的值
+            body = ''
+            if args.body_file:
+                with open(args.body_file, 'r', encoding='utf-8') as f:
+                    body = f.read()
+            template = smtp_client.compile_template(args.subject or '', body, attachments=args.attach or None)
+        for number, job in enumerate(_iter_jobs(args.file), 1):
+            to_addrs = _split_addrs(job.get('to'))
+            if not to_addrs:
+                print(f"第 {number} 条缺少收件人，已跳过", file=sys.stderr)
+                failed += 1
+                continue
+            try:
+                if template is not None:
+                    smtp_client.send_template(
+                        template,
+                        to_addrs,
+                        job,
+                        cc_addrs=_split_addrs(job.get('cc')) or None,
+                        bcc_addrs=_split_addrs(job.get('bcc')) or None
+                    )
+                else:
+                    smtp_client.send_email(
+                        to_addrs,
+                        job.get('subject', ''),
+                        job.get('body', ''),
+                        cc_addrs=_split_addrs(job.get('cc')) or None,
+                        bcc_addrs=_split_addrs(job.get('bcc')) or None,
+                        attachments=_split_paths(job.get('attachments')) or args.attach or None
+                    )
+                sent += 1
+                _print_refused(smtp_client.last_refused, f"第 {number} 条: ")
+            except Exception as e:
+                print(f"第 {number} 条发送失败: {str(e)}", file=sys.stderr)
+                failed += 1
+            if args.delay:
+                time.sleep(args.delay)
+    print(f"发送完成: 成功 {sent} 封，失败 {failed} 封")
+    return 0 if failed == 0 else 1
+
+
+def _write_jsonl(emails: List[Dict], path: str, mode: str = 'w'):
+    with open(path, mode, encoding='utf-8') as f:
+        for email in emails:
+            f.write(json.dumps(email, ensure_ascii=False) + '\n')
+
+
+def _fetch(args) -> List[Dict]:
+    account = _load_account(args)
+    decoder_func = _mail_store(args).encoder_registry().decoder()
+    with _create_receive_client(account) as receive_client:
+        return receive_client.list_emails(count=args.count, decoder_func=decoder_func)
+
+
+def cmd_sync(args) -> int:
+    emails = _fetch(args)
+    for email in emails:
+        _print_email(email)
+    print(f"共接收 {len(emails)} 封邮件")
+    return 0
+
+
+def cmd_export(args) -> int:
+    emails = _fetch(args)
+    _write_jsonl(emails, args.output)
+    print(f"已导出 {len(emails)} 封邮件到 {args.output}")
+    return 0
+
+
+def cmd_import(args) -> int:
+    from mail_archive import import_mail
+    account = _load_account(args)
+    archive = _open_archive(args, account)
+
+    def on_progress(result):
+        print(f"\r已导入 {result.imported} 封（{result.bytes / 1e6:.1f} MB）", end='', file=sys.stderr)
+
+    start = time.time()
+    try:
+        result = import_mail(archive, args.paths, folder=args.folder, workers=args.workers, on_progress=on_progress)
+    finally:
+        archive.close()
+    print(file=sys.stderr)
+    message = f"导入完成: {result.imported} 封，用时 {time.time() - start:.1f} 秒"
+    if result.duplicates:
+        message += f"，跳过 {result.duplicates} 封已有邮件"
+    if result.failed:
+        message += f"，{result.failed} 封无法解析"
+    print(message)
+    return 0 if result.failed == 0 else 1
+
+
+def cmd_export_mail(args) -> int:
+    from mail_archive import export_archive, export_server, open_writer
+    account = _load_account(args)
+    writer = open_writer(args.output, args.format)
+    try:
+        if args.server:
+            with _create_receive_client(account) as receive_client:
+                count = export_server(receive_client, writer, count=args.count)
+        else:
+            count = export_archive(_open_archive(args, account), writer, folder=args.folder)
+    finally:
+        writer.close()
+    print(f"已导出 {count} 封邮件到 {args.output}")
+    return 0
+
+
+def cmd_encoder(args) -> int:
+    from email_encoder import EmailEncoder
+    registry = _mail_store(args).encoder_registry()
+    if args.action == 'list':
+        for contact in registry.contacts():
+            expires = time.strftime('%Y-%m-%d', time.localtime(contact['expires']))
+            state = '已过期' if contact['expired'] else f"有效至 {expires}"
+            print(f"{contact['address']} | 版本 {contact['version']} | {state}")
+        print(f"共 {len(registry)} 个联系人")
+        return 0
+    if not args.address:
+        raise Exception("请指定联系人地址")
+    if args.action == 'set':
+        if args.table:
+            table = args.table
+        elif args.secret:
+            table = EmailEncoder.negotiate_table(args.secret)
+        else:
+            raise Exception("请用--secret或--table指定编码表")
+        registry.set(args.address, table, negotiation_id=args.negotiation_id,
+                     ttl=args.ttl_days * 24 * 3600 if args.ttl_days else None)
+        message = f"已登记 {args.address} 的编码表"
+    elif args.action == 'rotate':
+        if args.seed is None:
+            raise Exception("请用--seed指定轮换种子（与对方相同）")
+        message = f"{args.address} 的编码表已轮换为版本 {registry.rotate(args.address, args.seed)}"
+    else:
+        if not registry.remove(args.address):
+            raise Exception(f"联系人 {args.address} 没有登记编码表")
+        message = f"已删除 {args.address} 的编码表"
+    registry.purge()
+    if not registry.save():
+        raise Exception("保存编码表登记失败")
+    print(message)
+    return 0
+
+
+def _daemon_pop3(account: Dict, args, stop_after: Optional[int]):
+    # POP3没有推送，按间隔比较UIDL唯一标识，只取新出现的邮件（同时有邮件被删除也不会漏掉）；
+    # 服务器不支持UIDL时退化为比较邮件数量
+    seen = None
+    last_count = None
+    rounds = 0
+    while stop_after is None or rounds < stop_after:
+        rounds += 1
+        try:
+            with _create_receive_client(account) as receive_client:
+                try:
+                    uids = receive_client.list_uids()
+                except Exception:
+                    uids = None
+                if uids is not None:
+                    if seen is not None:
+                        # 从最新的邮件开始，与list_emails的顺序一致
+                        for index, uid in reversed([item for item in uids if item[1] not in seen]):
+                            email = receive_client.get_email(index)
+                            seen.add(uid)
+                            _print_email(email)
+                            if args.output:
+                                _write_jsonl([email], args.output, 'a')
+                        seen.intersection_update(uid for _, uid in uids)
+                    else:
+                        seen = {uid for _, uid in uids}
+                else:
+                    count = receive_client.get_email_count()
+                    if last_count is not None and count > last_count:
+                        emails = receive_client.list_emails(count=count - last_count)
+                        for email in emails:
+                            _print_email(email)
+                        if args.output:
+                            _write_jsonl(emails, args.output, 'a')
+                    last_count = count
+        except Exception as e:
+            print(f"同步失败: {str(e)}", file=sys.stderr)
+        sys.stdout.flush()
+        if stop_after is None or rounds < stop_after:
+            time.sleep(args.interval)
+
+
+def _daemon_imap(account: Dict, args, stop_after: Optional[int]):
+    # IMAP使用IDLE等待推送，服务器不支持时退化为按间隔轮询
+    sync_state = None
+    rounds = 0
+    while stop_after is None or rounds < stop_after:
+        # 连接失败也算一轮，服务器不可达时--rounds仍能结束
+        rounds += 1
+        try:
+            with _create_receive_client(account) as imap_client:
+                use_idle = imap_client.supports('IDLE')
+                while True:
+                    new_uids, _, sync_state_new = imap_client.sync_changes(sync_state)
+                    if sync_state is not None and new_uids:
+                        emails = []
+                        for uid in new_uids:
+                            email = imap_client.get_email(uid)
+                            emails.append(email)
+                            _print_email(email)
+                        if args.output:
+                            _write_jsonl(emails, args.output, 'a')
+                    sync_state = sync_state_new
+                    sys.stdout.flush()
+                    if stop_after is not None and rounds >= stop_after:
+                        break
+                    if use_idle:
+                        imap_client.idle(timeout=min(args.interval, 25 * 60))
+                    else:
+                        time.sleep(args.interval)
+                    rounds += 1
+        except Exception as e:
+            print(f"同步失败: {str(e)}", file=sys.stderr)
+            if stop_after is None or rounds < stop_after:
+                time.sleep(min(args.interval, 30))
+
+
+def cmd_daemon(args) -> int:
+    account = _load_account(args)
+    print(f"开始监听账号 {account['email']} 的新邮件（Ctrl+C退出）")
+    sys.stdout.flush()
+    try:
+        if account.get('receive_protocol', 'pop3') == 'imap':
+            _daemon_imap(account, args, args.rounds)
+        else:
+            _daemon_pop3(account, args, args.rounds)
+    except KeyboardInterrupt:
+        print("\n已停止")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='main.py', description="邮件用户代理命令行（不带参数运行时启动图形界面）")
+    parser.add_argument('--config', help="配置文件路径（默认config.json）")
+    parser.add_argument('--account', help="使用的账号名称（默认当前账号）")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    send = subparsers.add_parser('send', help="发送一封邮件")
+    send.add_argument('--to', required=True, help="收件人，多个用逗号分隔")
+    send.add_argument('--cc', help="抄送")
+    send.add_argument('--bcc', help="密送")
+    send.add_argument('--subject', required=True, help="主题")
+    send.add_argument('--body', help="正文（未指定时从--body-file或标准输入读取）")
+    send.add_argument('--body-file', help="正文文件")
+    send.add_argument('--attach', action='append', help="附件路径（可重复）")
+    send.set_defaults(func=cmd_send)
+
+    bulk = subparsers.add_parser('bulk-send', help="从CSV或JSONL批量发送")
+    bulk.add_argument('file', help="CSV（列: to,cc,bcc,subject,body,attachments）或JSONL文件；多个附件用分号分隔")
+    bulk.add_argument('--delay', type=float, default=0.0, help="每封之间的间隔（秒）")
+    bulk.add_argument('--subject', help="模板主题，{列名}替换为每行对应列的值（指定后忽略subject、body列）")
+    bulk.add_argument('--body-file', help="模板正文文件，格式同--subject")
+    bulk.add_argument('--attach', action='append', help="每封都带的附件路径（可重复）")
+    bulk.set_defaults(func=cmd_bulk_send)
+
+    sync = subparsers.add_parser('sync', help="接收邮件并列出")
+    sync.add_argument('--count', type=int, default=50, help="最多接收的邮件数")
+    sync.set_defaults(func=cmd_sync)
+
+    export = subparsers.add_parser('export', help="接收邮件并导出为JSONL")
+    export.add_argument('--output', required=True, help="输出文件")
+    export.add_argument('--count', type=int, default=None, help="最多导出的邮件数（默认全部）")
+    export.set_defaults(func=cmd_export)
+
+    imports = subparsers.add_parser('import', help="把mbox文件、.eml文件或.eml目录导入本地存档")
+    imports.add_argument('paths', nargs='+', help="mbox文件、.eml文件或包含.eml文件的目录")
+    imports.add_argument('--folder', help="导入到的文件夹（默认mbox文件名或.eml所在目录名）")
+    imports.add_argument('--workers', type=int, default=None, help="解析邮件的进程数（默认CPU核数）")
+    imports.set_defaults(func=cmd_import)
+
+    export_mail = subparsers.add_parser('export-mail', help="把本地存档或服务器上的邮件导出为mbox或.eml")
+    export_mail.add_argument('--output', required=True, help="输出的mbox文件（--format eml时为目录）")
+    export_mail.add_argument('--format', choices=('mbox', 'eml'), default='mbox', help="导出格式")
+    export_mail.add_argument('--folder', help="只导出本地存档中的某个文件夹")
+    export_mail.add_argument('--server', action='store_true', help="从服务器下载邮件原文导出，而不是本地存档")
+    export_mail.add_argument('--count', type=int, default=None, help="与--server一起使用，只导出最新的若干封")
+    export_mail.set_defaults(func=cmd_export_mail)
+
+    encoder = subparsers.add_parser('encoder', help="管理按联系人登记的编码表")
+    encoder.add_argument('action', choices=('list', 'set', 'rotate', 'remove'), help="操作")
+    encoder.add_argument('address', nargs='?', help="联系人地址")
+    encoder.add_argument('--secret', help="与联系人约定的共享密钥（set）")
+    encoder.add_argument('--table', help="直接指定64个字符的编码表（set）")
+    encoder.add_argument('--negotiation-id', help="协商标识（set）")
+    encoder.add_argument('--ttl-days', type=float, default=None, help="登记的有效天数（set，默认180天）")
+    encoder.add_argument('--seed', type=int, help="轮换种子（rotate）")
+    encoder.set_defaults(func=cmd_encoder)
+
+    daemon = subparsers.add_parser('daemon', help="常驻运行，持续接收新邮件")
+    daemon.add_argument('--interval', type=float, default=300, help="轮询间隔（秒），IMAP IDLE的重新发起间隔")
+    daemon.add_argument('--output', help="新邮件追加写入的JSONL文件")
+    daemon.add_argument('--rounds', type=int, default=None, help=argparse.SUPPRESS)
+    daemon.set_defaults(func=cmd_daemon)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except Exception as e:
+        print(f"错误: {str(e)}", file=sys.stderr)
+        return 1
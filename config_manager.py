@@ -1,26 +1,105 @@
+import atexit
 import json
 import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
 from typing import Dict, Optional, List
 
 
 class ConfigManager:
     DEFAULT_CONFIG_FILE = "config.json"
+    # 修改后延迟写盘的时间（秒），期间的多次修改合并为一次写入
+    DEFAULT_SAVE_DELAY = 0.5
+    # 检查配置文件是否被外部修改的最小间隔（秒）
+    RELOAD_CHECK_INTERVAL = 1.0
     
-    def __init__(self, config_file: Optional[str] = None):
+    def __init__(self, config_file: Optional[str] = None, save_delay: Optional[float] = None):
         self.config_file = config_file or self.DEFAULT_CONFIG_FILE
+        self.save_delay = self.DEFAULT_SAVE_DELAY if save_delay is None else save_delay
+        # 后台任务也会读写配置，所有访问都在这把锁下进行
+        self._lock = threading.RLock()
+        self._transaction_depth = 0
+        self._dirty = False
+        self._save_timer = None
+        # 配置文件的(mtime, size)，用于发现外部修改
+        self._file_signature = None
+        self._last_reload_check = 0.0
+        # 最近一次写盘失败的原因，写盘成功后清除
+        self.last_error: Optional[str] = None
         self.config = self._load_config()
+        # 账号名 -> 账号字典
+        self._accounts_by_name: Dict[str, Dict] = {}
+        self._rebuild_index()
+        # 退出前写入尚未保存的修改（close()时取消登记）
+        atexit.register(self.flush)
+
+    def close(self) -> bool:
+        """写入尚未保存的修改并取消退出时的登记，返回是否写入成功"""
+        result = self.flush()
+        atexit.unregister(self.flush)
+        return result
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
     
     def _load_config(self) -> Dict:
         if os.path.exists(self.config_file):
             try:
+                signature = self._stat_signature()
                 with open(self.config_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                    config = json.load(f)
+                self._file_signature = signature
+                return config
             except Exception as e:
                 print(f"加载配置文件失败: {str(e)}")
                 return self._get_default_config()
         else:
             return self._get_default_config()
     
+    def _stat_signature(self):
+        try:
+            st = os.stat(self.config_file)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _rebuild_index(self):
+        self._accounts_by_name = {account['name']: account for account in self.config['accounts']}
+
+    def reload_if_changed(self, force: bool = False) -> bool:
+        """配置文件被外部工具修改时重新加载，返回是否发生了重新加载
+
+        为避免频繁stat，默认每RELOAD_CHECK_INTERVAL秒最多检查一次。
+        本地有尚未写盘的修改时不重新加载，以免丢失这些修改。
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_reload_check < self.RELOAD_CHECK_INTERVAL:
+                return False
+            self._last_reload_check = now
+            signature = self._stat_signature()
+            if signature is None or signature == self._file_signature:
+                return False
+            if self._dirty:
+                print("配置文件已被外部修改，但本地有未保存的修改，暂不重新加载")
+                return False
+            try:
+                with open(self.config_file, 'r', encoding='utf-8') as f:
+                    config = json.load(f)
+            except Exception as e:
+                # 外部工具可能正在写入，下次再试
+                print(f"重新加载配置文件失败: {str(e)}")
+                return False
+            self.config = config
+            self._file_signature = signature
+            self._rebuild_index()
+            return True
+
     def _get_default_config(self) -> Dict:
         return {
             'accounts': [],
@@ -30,100 +109,204 @@ class ConfigManager:
                 'receive_interval': 300,  # 自动接收间隔（秒）
                 'max_emails': 50,  # 每次接收的最大邮件数
                 'use_custom_encoder': False,
-                'shared_secret': ''
+                'shared_secret': '',
+                'profiling': False,  # 性能分析与追踪，输出到profiles目录
+                'data_dir': 'mail_data',  # 本地邮件数据（收件箱快照等）目录
+                'dedup': True  # 跳过多个账号重复收到的邮件
             }
         }
     
     def save_config(self) -> bool:
-        try:
-            with open(self.config_file, 'w', encoding='utf-8') as f:
-                json.dump(self.config, f, ensure_ascii=False, indent=2)
+        # 先写入同目录下的临时文件再原子替换，写到一半崩溃也不会损坏配置文件
+        with self._lock:
+            self._cancel_save_timer()
+            tmp_path = None
+            try:
+                data = json.dumps(self.config, ensure_ascii=False, indent=2)
+                config_dir = os.path.dirname(os.path.abspath(self.config_file))
+                fd, tmp_path = tempfile.mkstemp(
+                    prefix='.' + os.path.basename(self.config_file) + '.',
+                    suffix='.tmp',
+                    dir=config_dir
+                )
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.config_file)
+                self._file_signature = self._stat_signature()
+                self._dirty = False
+                self.last_error = None
+                return True
+            except Exception as e:
+                print(f"保存配置文件失败: {str(e)}")
+                self.last_error = str(e)
+                if tmp_path and os.path.exists(tmp_path):
+                    try:
+                        os.remove(tmp_path)
+                    except OSError:
+                        pass
+                return False
+
+    @contextmanager
+    def transaction(self):
+        """批量修改配置，退出时只写一次文件
+
+        with config_manager.transaction():
+            config_manager.set_setting('a', 1)
+            config_manager.set_setting('b', 2)
+        """
+        with self._lock:
+            self._transaction_depth += 1
+            try:
+                yield self
+            finally:
+                self._transaction_depth -= 1
+                if self._transaction_depth == 0 and self._dirty:
+                    self._schedule_save()
+
+    def flush(self) -> bool:
+        """立即写入尚未保存的修改
+
+        修改方法（add_account、set_setting等）只把写盘安排在save_delay秒后，返回True
+        表示修改已生效；需要确认已写入磁盘时调用flush()。返回False时原因见last_error，
+        修改仍保留在内存中，下次flush()（包括退出时）会再次尝试写入。
+        """
+        with self._lock:
+            if not self._dirty:
+                self._cancel_save_timer()
+                return True
+            return self.save_config()
+
+    def _mark_dirty(self) -> bool:
+        self._dirty = True
+        if self._transaction_depth > 0:
             return True
-        except Exception as e:
-            print(f"保存配置文件失败: {str(e)}")
-            return False
+        return self._schedule_save()
+
+    def _schedule_save(self) -> bool:
+        if self.save_delay <= 0:
+            return self.save_config()
+        if self._save_timer is None:
+            self._save_timer = threading.Timer(self.save_delay, self.flush)
+            self._save_timer.daemon = True
+            self._save_timer.start()
+        return True
+
+    def _cancel_save_timer(self):
+        if self._save_timer is not None:
+            self._save_timer.cancel()
+            self._save_timer = None
     
     def add_account(self, account: Dict) -> bool:
-        # 检查必需字段
-        required_fields = ['name', 'email', 'smtp_server', 'smtp_port', 'pop3_server', 'pop3_port', 'password']
+        # 检查必需字段（收信服务器字段取决于收信协议）
+        required_fields = ['name', 'email', 'smtp_server', 'smtp_port', 'password']
+        if account.get('receive_protocol', 'pop3') == 'imap':
+            required_fields += ['imap_server', 'imap_port']
+        else:
+            required_fields += ['pop3_server', 'pop3_port']
         for field in required_fields:
             if field not in account:
                 print(f"缺少必需字段: {field}")
                 return False
-        # 检查是否已存在同名账号
-        for existing_account in self.config['accounts']:
-            if existing_account['name'] == account['name']:
+        with self._lock:
+            self.reload_if_changed()
+            # 检查是否已存在同名账号
+            if account['name'] in self._accounts_by_name:
                 print(f"账号 '{account['name']}' 已存在")
                 return False
-        # 添加默认值
-        if 'use_ssl' not in account:
-            account['use_ssl'] = True
-        
-        self.config['accounts'].append(account)
-        
-        # 如果这是第一个账号，设为当前账号
-        if len(self.config['accounts']) == 1:
-            self.config['current_account'] = account['name']
-        
-        return self.save_config()
+            # 添加默认值
+            if 'use_ssl' not in account:
+                account['use_ssl'] = True
+            if 'receive_protocol' not in account:
+                account['receive_protocol'] = 'pop3'
+            
+            self.config['accounts'].append(account)
+            self._accounts_by_name[account['name']] = account
+            
+            # 如果这是第一个账号，设为当前账号
+            if len(self.config['accounts']) == 1:
+                self.config['current_account'] = account['name']
+            
+            return self._mark_dirty()
     
     def remove_account(self, account_name: str) -> bool:
-        for i, account in enumerate(self.config['accounts']):
-            if account['name'] == account_name:
-                self.config['accounts'].pop(i)
-                
-                # 如果删除的是当前账号，清除当前账号设置
-                if self.config['current_account'] == account_name:
-                    if self.config['accounts']:
-                        self.config['current_account'] = self.config['accounts'][0]['name']
-                    else:
-                        self.config['current_account'] = None
-                
-                return self.save_config()
-        
-        print(f"账号 '{account_name}' 不存在")
-        return False
+        with self._lock:
+            self.reload_if_changed()
+            account = self._accounts_by_name.pop(account_name, None)
+            if account is None:
+                print(f"账号 '{account_name}' 不存在")
+                return False
+            accounts = self.config['accounts']
+            for i, existing_account in enumerate(accounts):
+                if existing_account is account:
+                    accounts.pop(i)
+                    break
+            
+            # 如果删除的是当前账号，清除当前账号设置
+            if self.config['current_account'] == account_name:
+                if accounts:
+                    self.config['current_account'] = accounts[0]['name']
+                else:
+                    self.config['current_account'] = None
+            
+            return self._mark_dirty()
     
     def get_account(self, account_name: Optional[str] = None) -> Optional[Dict]:
-        if account_name is None:
-            account_name = self.config['current_account']
-        
-        if account_name is None:
-            return None
-        
-        for account in self.config['accounts']:
-            if account['name'] == account_name:
-                return account
-        
-        return None
+        with self._lock:
+            self.reload_if_changed()
+            if account_name is None:
+                account_name = self.config['current_account']
+            
+            if account_name is None:
+                return None
+            
+            return self._accounts_by_name.get(account_name)
     
     def list_accounts(self) -> List[str]:
-        return [account['name'] for account in self.config['accounts']]
+        with self._lock:
+            self.reload_if_changed()
+            return [account['name'] for account in self.config['accounts']]
     
     def set_current_account(self, account_name: str) -> bool:
-        for account in self.config['accounts']:
-            if account['name'] == account_name:
-                self.config['current_account'] = account_name
-                return self.save_config()
-        
-        print(f"账号 '{account_name}' 不存在")
-        return False
+        with self._lock:
+            self.reload_if_changed()
+            if account_name not in self._accounts_by_name:
+                print(f"账号 '{account_name}' 不存在")
+                return False
+            self.config['current_account'] = account_name
+            return self._mark_dirty()
     
     def get_current_account(self) -> Optional[Dict]:
         return self.get_account()
     
     def update_account(self, account_name: str, updates: Dict) -> bool:
-        for account in self.config['accounts']:
-            if account['name'] == account_name:
-                account.update(updates)
-                return self.save_config()
-        
-        print(f"账号 '{account_name}' 不存在")
-        return False
+        with self._lock:
+            self.reload_if_changed()
+            account = self._accounts_by_name.get(account_name)
+            if account is None:
+                print(f"账号 '{account_name}' 不存在")
+                return False
+            new_name = updates.get('name', account_name)
+            if new_name != account_name:
+                # 重命名时同步更新索引和当前账号
+                if new_name in self._accounts_by_name:
+                    print(f"账号 '{new_name}' 已存在")
+                    return False
+                del self._accounts_by_name[account_name]
+                self._accounts_by_name[new_name] = account
+                if self.config['current_account'] == account_name:
+                    self.config['current_account'] = new_name
+            account.update(updates)
+            return self._mark_dirty()
     
     def get_setting(self, key: str, default=None):
-        return self.config['settings'].get(key, default)
+        with self._lock:
+            self.reload_if_changed()
+            return self.config['settings'].get(key, default)
     
     def set_setting(self, key: str, value) -> bool:
-        self.config['settings'][key] = value
-        return self.save_config()
\ No newline at end of file
+        with self._lock:
+            self.reload_if_changed()
+            self.config['settings'][key] = value
+            return self._mark_dirty()
@@ -0,0 +1,238 @@
+import hashlib
+import math
+import os
+import sqlite3
+import struct
+import tempfile
+import threading
+from email.message import Message
+from typing import List, Optional, Tuple
+
+
+class BloomFilter:
+    """固定容量的布隆过滤器，位数组保存在bytearray中"""
+
+    def __init__(self, capacity: int, error_rate: float, num_bits: Optional[int] = None,
+                 num_hashes: Optional[int] = None, bits: Optional[bytearray] = None, count: int = 0):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        if num_bits is None:
+            num_bits = max(int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))), 8)
+        if num_hashes is None:
+            num_hashes = max(int(round(num_bits / capacity * math.log(2))), 1)
+        self.num_bits = num_bits
+        self.num_hashes = num_hashes
+        self.bits = bits if bits is not None else bytearray((num_bits + 7) // 8)
+        self.count = count
+
+    def _positions(self, hashes: Tuple[int, int]):
+        # 双重哈希：h1 + i*h2 模拟k个独立哈希函数
+        h1, h2 = hashes
+        num_bits = self.num_bits
+        return [(h1 + i * h2) % num_bits for i in range(self.num_hashes)]
+
+    def contains(self, hashes: Tuple[int, int]) -> bool:
+        bits = self.bits
+        for position in self._positions(hashes):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, hashes: Tuple[int, int]):
+        bits = self.bits
+        for position in self._positions(hashes):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    @property
+    def full(self) -> bool:
+        return self.count >= self.capacity
+
+
+class ScalableBloomFilter:
+    """可扩展布隆过滤器（Almeida等，2007）
+
+    当前过滤器装满后新建一个容量翻倍、误判率减半的过滤器，
+    总误判率不超过 error_rate / (1 - TIGHTENING)。
+    """
+
+    GROWTH = 2
+    TIGHTENING = 0.5
+    _MAGIC = b'EABF1'
+    _HEADER = struct.Struct('<QdQQI')
+
+    def __init__(self, initial_capacity: int = 100000, error_rate: float = 0.001):
+        self.initial_capacity = initial_capacity
+        self.error_rate = error_rate
+        self.filters: List[BloomFilter] = []
+
+    @staticmethod
+    def hashes(key: str) -> Tuple[int, int]:
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        return int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+
+    def __contains__(self, key: str) -> bool:
+        hashes = self.hashes(key)
+        return any(bloom.contains(hashes) for bloom in self.filters)
+
+    def __len__(self):
+        return sum(bloom.count for bloom in self.filters)
+
+    def add(self, key: str):
+        if not self.filters or self.filters[-1].full:
+            level = len(self.filters)
+            self.filters.append(BloomFilter(
+                self.initial_capacity * self.GROWTH ** level,
+                self.error_rate * (1 - self.TIGHTENING) * self.TIGHTENING ** level
+            ))
+        self.filters[-1].add(self.hashes(key))
+
+    @property
+    def size_in_bytes(self) -> int:
+        return sum(len(bloom.bits) for bloom in self.filters)
+
+    def to_bytes(self) -> bytes:
+        parts = [self._MAGIC, struct.pack('<QdI', self.initial_capacity, self.error_rate, len(self.filters))]
+        for bloom in self.filters:
+            parts.append(self._HEADER.pack(bloom.capacity, bloom.error_rate, bloom.count,
+                                           bloom.num_bits, bloom.num_hashes))
+            parts.append(bytes(bloom.bits))
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'ScalableBloomFilter':
+        if not data.startswith(cls._MAGIC):
+            raise ValueError("不是有效的布隆过滤器文件")
+        offset = len(cls._MAGIC)
+        initial_capacity, error_rate, count = struct.unpack_from('<QdI', data, offset)
+        offset += struct.calcsize('<QdI')
+        result = cls(initial_capacity, error_rate)
+        for _ in range(count):
+            capacity, rate, items, num_bits, num_hashes = cls._HEADER.unpack_from(data, offset)
+            offset += cls._HEADER.size
+            length = (num_bits + 7) // 8
+            bits = bytearray(data[offset:offset + length])
+            if len(bits) != length:
+                raise ValueError("布隆过滤器文件不完整")
+            offset += length
+            result.filters.append(BloomFilter(capacity, rate, num_bits, num_hashes, bits, items))
+        return result
+
+
+class MessageDeduplicator:
+    """跨账号的重复邮件检测，所有账号共用（data_dir/seen.*）
+
+    以Message-ID为键，没有Message-ID时用主要邮件头的哈希。布隆过滤器常驻内存，
+    绝大多数新邮件在这里就能确定没见过；过滤器给出"可能见过"时再到SQLite中精确确认。
+    同一邮件只在第一次出现的位置（账号+UID）显示，其他位置视为重复。
+    """
+
+    BLOOM_FILE = 'seen.bloom'
+    DB_FILE = 'seen.db'
+    # 计算内容哈希时使用的邮件头（Received、Delivered-To等随投递账号而变，不参与）
+    HASH_HEADERS = ('From', 'To', 'Cc', 'Date', 'Subject')
+
+    def __init__(self, data_dir: str, initial_capacity: int = 100000, error_rate: float = 0.001):
+        self.data_dir = data_dir
+        self.bloom_path = os.path.join(data_dir, self.BLOOM_FILE)
+        self.db_path = os.path.join(data_dir, self.DB_FILE)
+        self.initial_capacity = initial_capacity
+        self.error_rate = error_rate
+        self._lock = threading.Lock()
+        self._bloom = None
+        self._db = None
+        self._dirty = False
+
+    @classmethod
+    def key_for(cls, headers: Message) -> str:
+        message_id = (headers.get('Message-ID') or '').strip()
+        if message_id:
+            return message_id
+        digest = hashlib.sha1()
+        for name in cls.HASH_HEADERS:
+            digest.update(' '.join((headers.get(name) or '').split()).encode('utf-8', errors='ignore'))
+            digest.update(b'\0')
+        return 'sha1:' + digest.hexdigest()
+
+    def _open(self):
+        # 第一次使用时才打开，避免拖慢启动
+        if self._db is not None:
+            return
+        os.makedirs(self.data_dir, exist_ok=True)
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS seen (key TEXT PRIMARY KEY, account TEXT NOT NULL, uid TEXT NOT NULL)'
+        )
+        self._db.commit()
+        try:
+            with open(self.bloom_path, 'rb') as f:
+                self._bloom = ScalableBloomFilter.from_bytes(f.read())
+        except Exception:
+            self._bloom = None
+        count = self._db.execute('SELECT COUNT(*) FROM seen').fetchone()[0]
+        if self._bloom is None or len(self._bloom) != count:
+            # 过滤器文件缺失或与数据库不一致时，从数据库重建
+            self._bloom = ScalableBloomFilter(self.initial_capacity, self.error_rate)
+            for (key,) in self._db.execute('SELECT key FROM seen'):
+                self._bloom.add(key)
+            self._dirty = True
+
+    def is_duplicate(self, key: str, account: str, uid) -> bool:
+        """检查并记录：该邮件此前出现在别的位置时返回True"""
+        uid = str(uid)
+        with self._lock:
+            self._open()
+            if key in self._bloom:
+                row = self._db.execute('SELECT account, uid FROM seen WHERE key = ?', (key,)).fetchone()
+                if row is not None:
+                    return row != (account, uid)
+            self._db.execute('INSERT OR IGNORE INTO seen (key, account, uid) VALUES (?, ?, ?)', (key, account, uid))
+            self._bloom.add(key)
+            self._dirty = True
+            return False
+
+    def header_filter(self, account: str) -> 'DuplicateFilter':
+        return DuplicateFilter(self, account)
+
+    def save(self):
+        with self._lock:
+            if self._db is None or not self._dirty:
+                return
+            tmp_path = None
+            try:
+                self._db.commit()
+                fd, tmp_path = tempfile.mkstemp(prefix='.' + self.BLOOM_FILE + '.', suffix='.tmp', dir=self.data_dir)
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(self._bloom.to_bytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.bloom_path)
+                self._dirty = False
+            except Exception as e:
+                print(f"保存重复邮件记录失败: {str(e)}")
+                if tmp_path and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def close(self):
+        self.save()
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+                self._bloom = None
+
+
+class DuplicateFilter:
+    """传给iter_emails的header_filter：重复邮件返回False，不下载正文"""
+
+    def __init__(self, deduplicator: MessageDeduplicator, account: str):
+        self.deduplicator = deduplicator
+        self.account = account
+        self.skipped = 0
+
+    def __call__(self, headers: Message, uid) -> bool:
+        key = self.deduplicator.key_for(headers)
+        if self.deduplicator.is_duplicate(key, self.account, uid):
+            self.skipped += 1
+            return False
+        return True
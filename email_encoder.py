@@ -1,6 +1,8 @@
 import base64
 import random
 import json
+import time
+from collections import OrderedDict
 from typing import Optional, Dict, Tuple
 
 
@@ -97,8 +99,14 @@ class EmailEncoder:
 
 
 class EncoderNegotiator:
-    def __init__(self):
-        self.negotiation_data = {}
+    # 未完成的协商保留的时间（秒）和数量上限，超过后最早的被丢弃
+    PENDING_TTL = 24 * 3600
+    MAX_PENDING = 256
+
+    def __init__(self, clock=time.time):
+        self._clock = clock
+        # 协商标识 -> 协商信息，按创建时间排列
+        self.negotiation_data = OrderedDict()
     
     def create_negotiation_request(self, sender_id: str, shared_secret: str) -> Dict:
         # 生成编码表
@@ -107,10 +115,12 @@ class EncoderNegotiator:
         # 生成协商标识
         negotiation_id = f"{sender_id}_{random.randint(1000, 9999)}"
         
+        self._prune()
+        self.negotiation_data.pop(negotiation_id, None)
         self.negotiation_data[negotiation_id] = {
             'sender_id': sender_id,
             'table': table,
-            'timestamp': None  # 实际应用中应该使用真实时间戳
+            'timestamp': self._clock()
         }
         
         return {
@@ -126,11 +136,25 @@ class EncoderNegotiator:
         table = EmailEncoder.negotiate_table(shared_secret)
         
         return negotiation_id, table
+
+    def complete_negotiation(self, negotiation_id: str) -> Optional[Dict]:
+        # 对方已接受协商：取出并删除协商信息，已过期或不存在时返回None
+        self._prune()
+        return self.negotiation_data.pop(negotiation_id, None)
+
+    def _prune(self):
+        expire_before = self._clock() - self.PENDING_TTL
+        while self.negotiation_data:
+            negotiation_id, data = next(iter(self.negotiation_data.items()))
+            if data['timestamp'] >= expire_before and len(self.negotiation_data) < self.MAX_PENDING:
+                break
+            del self.negotiation_data[negotiation_id]
     
-    def rotate_table(self, current_table: str, rotation_seed: int) -> str:
+    @staticmethod
+    def rotate_table(current_table: str, rotation_seed: int) -> str:
+        # 使用独立的随机数生成器，结果与random.seed()后shuffle相同，但不影响全局随机状态
         chars = list(current_table)
-        random.seed(rotation_seed)
-        random.shuffle(chars)
+        random.Random(rotation_seed).shuffle(chars)
         
         return ''.join(chars)
 
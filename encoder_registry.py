@@ -0,0 +1,274 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from email.utils import parseaddr
+from typing import Callable, Dict, Iterable, List, Optional
+
+from email_encoder import EmailEncoder, EncoderNegotiator
+from metadata_index import parse_date
+
+
+def contact_key(address: str) -> str:
+    # 登记表的键：去掉显示名的小写地址
+    return (parseaddr(address or '')[1] or address or '').strip().lower()
+
+
+class _Contact:
+    """一个联系人的编码表，按版本保存：轮换后旧版本仍用于解码轮换前的邮件"""
+
+    __slots__ = ('versions', 'expires', 'negotiation_id')
+
+    def __init__(self, expires: float, negotiation_id: Optional[str] = None):
+        # [(生效时间, 编码表, 版本号)]，按版本从旧到新
+        self.versions: List[tuple] = []
+        self.expires = expires
+        self.negotiation_id = negotiation_id
+
+    @property
+    def table(self) -> str:
+        return self.versions[-1][1]
+
+    @property
+    def version(self) -> int:
+        return self.versions[-1][2]
+
+    def table_at(self, timestamp: Optional[float]) -> str:
+        # 邮件日期早于最新版本生效时间时，使用当时有效的版本
+        if timestamp is None or len(self.versions) == 1 or timestamp >= self.versions[-1][0]:
+            return self.versions[-1][1]
+        for since, table, _ in reversed(self.versions):
+            if timestamp >= since:
+                return table
+        return self.versions[0][1]
+
+
+class EncoderRegistry:
+    """联系人（邮件地址）到编码表的登记表
+
+    每个联系人可以有自己的编码表（如通过EncoderNegotiator协商得到），按地址或协商标识
+    以字典查找；相同编码表共用同一个EmailEncoder实例。登记在ttl秒后过期，过期后按默认编码处理。
+    rotate()轮换编码表时版本号加一，保留最近MAX_VERSIONS个版本，按邮件日期选择解码用的版本。
+    保存时编码表只写一次，联系人记录引用编码表的序号。
+    """
+
+    DEFAULT_TTL = 180 * 24 * 3600
+    MAX_VERSIONS = 4
+    FORMAT_VERSION = 1
+
+    def __init__(self, path: Optional[str] = None, default: Optional[EmailEncoder] = None,
+                 ttl: float = DEFAULT_TTL, clock=time.time):
+        self.path = path
+        # 没有登记的联系人使用的编码器，None表示不解码
+        self.default = default
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._contacts: Dict[str, _Contact] = {}
+        # 协商标识 -> 联系人地址
+        self._negotiations: Dict[str, str] = {}
+        # 编码表 -> EmailEncoder
+        self._encoders: Dict[str, EmailEncoder] = {}
+        self._dirty = False
+        if path and os.path.exists(path):
+            self._load()
+
+    def __len__(self):
+        return len(self._contacts)
+
+    def __contains__(self, address: str) -> bool:
+        return self._get(contact_key(address)) is not None
+
+    # ---------- 登记 ----------
+
+    def set(self, address: str, table: str, negotiation_id: Optional[str] = None, ttl: Optional[float] = None):
+        """登记联系人的编码表；与当前的不同时作为新版本（从现在起生效）"""
+        EmailEncoder(table)
+        key = contact_key(address)
+        now = self._clock()
+        with self._lock:
+            contact = self._contacts.get(key)
+            if contact is None or contact.expires <= now:
+                contact = self._contacts[key] = _Contact(now + (ttl or self.ttl))
+                contact.versions.append((0.0, table, 1))
+            else:
+                contact.expires = now + (ttl or self.ttl)
+                if table != contact.table:
+                    self._add_version(contact, table, now)
+            if negotiation_id:
+                if contact.negotiation_id:
+                    self._negotiations.pop(contact.negotiation_id, None)
+                contact.negotiation_id = negotiation_id
+                self._negotiations[negotiation_id] = key
+            self._dirty = True
+
+    def rotate(self, address: str, rotation_seed: int) -> int:
+        """轮换联系人的编码表（双方使用相同的种子），返回新的版本号"""
+        key = contact_key(address)
+        with self._lock:
+            contact = self._get(key)
+            if contact is None:
+                raise Exception(f"联系人 {address} 没有登记编码表")
+            self._add_version(contact, EncoderNegotiator.rotate_table(contact.table, rotation_seed), self._clock())
+            self._dirty = True
+            return contact.version
+
+    def _add_version(self, contact: _Contact, table: str, since: float):
+        contact.versions.append((since, table, contact.version + 1))
+        del contact.versions[:-self.MAX_VERSIONS]
+
+    def remove(self, address: str) -> bool:
+        with self._lock:
+            contact = self._contacts.pop(contact_key(address), None)
+            if contact is None:
+                return False
+            if contact.negotiation_id:
+                self._negotiations.pop(contact.negotiation_id, None)
+            self._dirty = True
+            return True
+
+    def purge(self) -> int:
+        # 删除所有已过期的登记，返回删除的数量
+        now = self._clock()
+        with self._lock:
+            expired = [key for key, contact in self._contacts.items() if contact.expires <= now]
+            for key in expired:
+                contact = self._contacts.pop(key)
+                if contact.negotiation_id:
+                    self._negotiations.pop(contact.negotiation_id, None)
+            if expired:
+                self._dirty = True
+            return len(expired)
+
+    # ---------- 查找 ----------
+
+    def _get(self, key: str) -> Optional[_Contact]:
+        contact = self._contacts.get(key)
+        if contact is not None and contact.expires <= self._clock():
+            return None
+        return contact
+
+    def _encoder(self, table: str) -> EmailEncoder:
+        encoder = self._encoders.get(table)
+        if encoder is None:
+            encoder = self._encoders[table] = EmailEncoder(table)
+        return encoder
+
+    def lookup(self, address: str, timestamp: Optional[float] = None) -> Optional[EmailEncoder]:
+        """联系人的编码器（timestamp为邮件日期时按当时有效的版本），没有登记或已过期时返回None"""
+        contact = self._get(contact_key(address))
+        if contact is None:
+            return None
+        return self._encoder(contact.table_at(timestamp))
+
+    def lookup_negotiation(self, negotiation_id: str) -> Optional[EmailEncoder]:
+        key = self._negotiations.get(negotiation_id)
+        return self.lookup(key) if key else None
+
+    def encoder_for(self, address: str, timestamp: Optional[float] = None) -> Optional[EmailEncoder]:
+        # 没有登记时使用默认编码器
+        encoder = self.lookup(address, timestamp)
+        return encoder if encoder is not None else self.default
+
+    def encoder_for_recipients(self, addresses: Iterable[str]) -> Optional[EmailEncoder]:
+        """发送时使用的编码器：所有收件人必须使用同一个编码表"""
+        encoders = {}
+        for address in addresses:
+            encoder = self.encoder_for(address)
+            encoders[encoder.export_table() if encoder is not None else None] = encoder
+        if len(encoders) > 1:
+            raise Exception("收件人使用不同的编码表，请分开发送")
+        return next(iter(encoders.values()), None)
+
+    def decoder(self) -> Optional['SenderDecoder']:
+        """接收时作为decoder_func传给客户端；没有任何登记也没有默认编码器时返回None（不解码）"""
+        if not self._contacts and self.default is None:
+            return None
+        return SenderDecoder(self)
+
+    def contacts(self) -> List[Dict]:
+        now = self._clock()
+        return [{
+            'address': key,
+            'version': contact.version,
+            'expires': contact.expires,
+            'expired': contact.expires <= now,
+            'negotiation_id': contact.negotiation_id
+        } for key, contact in sorted(self._contacts.items())]
+
+    # ---------- 保存 ----------
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') != self.FORMAT_VERSION:
+                return
+            tables = data['tables']
+            for key, expires, negotiation_id, versions in data['contacts']:
+                contact = _Contact(expires, negotiation_id)
+                contact.versions = [(since, tables[table_index], version) for since, table_index, version in versions]
+                self._contacts[key] = contact
+                if negotiation_id:
+                    self._negotiations[negotiation_id] = key
+        except Exception as e:
+            print(f"加载编码表登记失败: {str(e)}")
+
+    def save(self) -> bool:
+        if not self.path or not self._dirty:
+            return True
+        try:
+            with self._lock:
+                tables: Dict[str, int] = {}
+                contacts = []
+                for key, contact in self._contacts.items():
+                    versions = [[since, tables.setdefault(table, len(tables)), version]
+                                for since, table, version in contact.versions]
+                    contacts.append([key, contact.expires, contact.negotiation_id, versions])
+                data = json.dumps({'version': self.FORMAT_VERSION, 'tables': list(tables), 'contacts': contacts},
+                                  ensure_ascii=False, separators=(',', ':'))
+                self._dirty = False
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(prefix='.encoders.', suffix='.tmp', dir=directory)
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            return True
+        except Exception as e:
+            print(f"保存编码表登记失败: {str(e)}")
+            self._dirty = True
+            return False
+
+
+class SenderDecoder:
+    """按发件人选择编码表的decoder_func
+
+    直接调用时使用默认编码器；客户端解析邮件时先调用for_sender(发件人地址, Date)
+    取得该发件人的解码函数（一次字典查找），没有登记也没有默认编码器时返回None。
+    """
+
+    def __init__(self, registry: EncoderRegistry):
+        self.registry = registry
+
+    def __call__(self, text: str) -> str:
+        default = self.registry.default
+        return default.decode(text) if default is not None else text
+
+    def for_sender(self, from_addr: str, date: str = '') -> Optional[Callable[[str], str]]:
+        registry = self.registry
+        contact = registry._get(contact_key(from_addr))
+        if contact is None:
+            return registry.default.decode if registry.default is not None else None
+        timestamp = None
+        if len(contact.versions) > 1 and date:
+            timestamp = parse_date(date) or None
+        return registry._encoder(contact.table_at(timestamp)).decode
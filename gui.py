@@ -1,15 +1,44 @@
 import tkinter as tk
 from tkinter import ttk, scrolledtext, messagebox, filedialog
 from typing import Optional, Callable
-import threading
+import queue
 
 from smtp_client import SMTPClient
+from recipients import split_addresses
 from pop3_client import POP3Client
+from imap_client import IMAPClient
 from config_manager import ConfigManager
+from mail_store import MailStore, resumable_sync
+from dedup import MessageDeduplicator
+from prefetch import BodyCache, BodyPrefetcher, needs_body, neighbor_positions
+from rules import (RuleSet, RuleFilter, chain_header_filters, FIELDS, MATCH_TYPES, ACTIONS,
+                   FIELD_NAMES, MATCH_NAMES, ACTION_NAMES)
+from message_list import VirtualMessageList
+from message_view import MessageDetailView
+from task_manager import TaskManager
+from metrics import get_default_metrics
+from profiling import profile_run, span, get_tracer, set_profiling_enabled, is_profiling_enabled
 #from email_encoder import EmailEncoder, create_encoder
 
+def _flush_config(config_manager: ConfigManager, parent=None) -> bool:
+    # 设置窗口中的修改立即写盘；失败时提示（修改仍在内存中，退出时会再次尝试写入）
+    if config_manager.flush():
+        return True
+    messagebox.showerror("错误", f"保存配置文件失败:\n{config_manager.last_error}", parent=parent)
+    return False
+
+
 class EmailClientGUI:
 
+    # 接收时每帧最多放入列表的邮件数，以及队列轮询间隔（毫秒）
+    RECEIVE_BATCH_SIZE = 50
+    RECEIVE_PUMP_INTERVAL = 30
+    # 预取未读邮件时只看列表顶部的这么多封
+    PREFETCH_UNREAD_SCAN = 20
+    # 文件夹筛选：全部邮件、未被规则归入文件夹的邮件
+    FOLDER_ALL = '全部'
+    FOLDER_INBOX = '收件箱'
+
     def __init__(self, root: tk.Tk):
         self.root = root
         self.root.title("邮件用户代理 (Email User Agent)")
@@ -17,13 +46,50 @@ class EmailClientGUI:
         
         # 配置管理器
         self.config_manager = ConfigManager()
+        set_profiling_enabled(self.config_manager.get_setting('profiling', False))
+        # 本地邮件数据（收件箱快照）
+        self.mail_store = MailStore(self.config_manager.get_setting('data_dir'))
+        # 跨账号的重复邮件检测
+        self.deduplicator = MessageDeduplicator(self.mail_store.data_dir)
         # 编码器（用于未来的安全通信）
         self.encoder = None
+        # 按联系人登记的编码表，未登记的联系人使用self.encoder
+        self.encoder_registry = self.mail_store.encoder_registry()
+        # 完整正文缓存与后台预取（快照中的邮件只有正文开头）
+        self.body_cache = BodyCache()
+        self.prefetcher = None
+        self.selected_key = None
+        # 后台任务管理器，回调统一经root.after回到界面线程
+        self.task_manager = TaskManager(
+            max_workers=4,
+            dispatch=lambda func, *args: self.root.after(0, func, *args)
+        )
+        # 开启IDLE推送的账号
+        self.idle_account = None
+        # 正在进行的接收：账号、结果队列
+        self.receive_account = None
+        self.receive_queue = None
+        self.receive_total = 0
+        # 当前接收是否为启动时的快照核对
+        self.receive_reconciling = False
+        # 本次接收跳过的重复邮件数
+        self.receive_skipped = 0
         # 创建主界面
         self._create_menu()
         self._create_main_interface()
         # 加载当前账号
         self._load_current_account()
+        self.task_manager.add_listener(self._update_task_label)
+        self.root.protocol("WM_DELETE_WINDOW", self._on_close)
+
+    def _on_close(self):
+        # 取消所有后台任务、写入未保存的配置后退出
+        self.task_manager.shutdown()
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+        self.config_manager.close()
+        self.deduplicator.close()
+        self.root.destroy()
     
     def _create_menu(self):
         menubar = tk.Menu(self.root)
@@ -36,7 +102,13 @@ class EmailClientGUI:
         settings_menu = tk.Menu(menubar, tearoff=0)
         menubar.add_cascade(label="设置", menu=settings_menu)
         settings_menu.add_command(label="账号管理", command=self._show_account_manager)
+        settings_menu.add_command(label="收信规则", command=self._show_rules)
         settings_menu.add_command(label="高级设置", command=self._show_advanced_settings)
+        # 查看菜单
+        view_menu = tk.Menu(menubar, tearoff=0)
+        menubar.add_cascade(label="查看", menu=view_menu)
+        view_menu.add_command(label="后台任务", command=self._show_task_list)
+        view_menu.add_command(label="导出性能统计...", command=self._export_metrics)
 
     def _create_main_interface(self):
         # 创建选项卡
@@ -51,14 +123,25 @@ class EmailClientGUI:
         self.notebook.add(self.receive_frame, text="接收邮件")
         self._create_receive_interface()
         # 状态栏
+        status_frame = tk.Frame(self.root)
+        status_frame.pack(side=tk.BOTTOM, fill=tk.X)
+        self.task_label = tk.Label(
+            status_frame,
+            text="后台任务: 0",
+            bd=1,
+            relief=tk.SUNKEN,
+            width=14
+        )
+        self.task_label.pack(side=tk.RIGHT)
+        self.task_label.bind('<Button-1>', lambda e: self._show_task_list())
         self.status_bar = tk.Label(
-            self.root,
+            status_frame,
             text="就绪",
             bd=1,
             relief=tk.SUNKEN,
             anchor=tk.W
         )
-        self.status_bar.pack(side=tk.BOTTOM, fill=tk.X)
+        self.status_bar.pack(side=tk.LEFT, fill=tk.X, expand=True)
     
     def _create_send_interface(self):
         # 收件人
@@ -129,6 +212,55 @@ class EmailClientGUI:
             font=("Arial", 10, "bold")
         )
         receive_button.pack(side=tk.LEFT, padx=5)
+        # 取消接收按钮
+        self.cancel_receive_button = tk.Button(
+            control_frame,
+            text="取消",
+            command=self._cancel_receive,
+            state=tk.DISABLED
+        )
+        self.cancel_receive_button.pack(side=tk.LEFT, padx=5)
+        # 收信协议（按账号保存）
+        tk.Label(control_frame, text="协议:").pack(side=tk.LEFT, padx=(15, 2))
+        self.protocol_var = tk.StringVar(value='POP3')
+        protocol_combo = ttk.Combobox(
+            control_frame,
+            textvariable=self.protocol_var,
+            values=['POP3', 'IMAP'],
+            state='readonly',
+            width=6
+        )
+        protocol_combo.pack(side=tk.LEFT)
+        protocol_combo.bind('<<ComboboxSelected>>', self._on_protocol_change)
+        # IMAP IDLE推送
+        self.idle_var = tk.BooleanVar(value=False)
+        self.idle_check = tk.Checkbutton(
+            control_frame,
+            text="新邮件推送(IDLE)",
+            variable=self.idle_var,
+            command=self._toggle_idle
+        )
+        self.idle_check.pack(side=tk.LEFT, padx=5)
+        # 按会话显示
+        self.thread_view_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            control_frame,
+            text="会话视图",
+            variable=self.thread_view_var,
+            command=self._toggle_thread_view
+        ).pack(side=tk.LEFT, padx=5)
+        # 按收信规则归入的文件夹
+        tk.Label(control_frame, text="文件夹:").pack(side=tk.LEFT, padx=(5, 0))
+        self.folder_var = tk.StringVar(value=self.FOLDER_ALL)
+        self.folder_combo = ttk.Combobox(
+            control_frame,
+            textvariable=self.folder_var,
+            values=[self.FOLDER_ALL, self.FOLDER_INBOX],
+            state='readonly',
+            width=10
+        )
+        self.folder_combo.pack(side=tk.LEFT)
+        self.folder_combo.bind('<<ComboboxSelected>>', lambda e: self._apply_folder_filter())
         # 邮件数量标签
         self.email_count_label = tk.Label(
             control_frame,
@@ -138,15 +270,9 @@ class EmailClientGUI:
         # 邮件列表框架
         list_frame = tk.Frame(self.receive_frame)
         list_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
-        # 创建邮件列表
-        self.email_listbox = tk.Listbox(list_frame, height=10)
-        self.email_listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        self.email_listbox.bind('<<ListboxSelect>>', self._on_email_select)
-        # 滚动条
-        scrollbar = tk.Scrollbar(list_frame)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
-        self.email_listbox.config(yscrollcommand=scrollbar.set)
-        scrollbar.config(command=self.email_listbox.yview)
+        # 创建邮件列表（虚拟化列表，只创建可见行，点击表头排序）
+        self.email_list = VirtualMessageList(list_frame, on_select=self._on_email_select)
+        self.email_list.pack(fill=tk.BOTH, expand=True)
         # 邮件详情框架
         detail_frame = tk.LabelFrame(
             self.receive_frame,
@@ -155,14 +281,14 @@ class EmailClientGUI:
             pady=5
         )
         detail_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
-        # 邮件详情文本
-        self.email_detail_text = scrolledtext.ScrolledText(
+        # 邮件详情（大邮件分块渲染）
+        self.email_detail = MessageDetailView(
             detail_frame,
+            on_attachment=self._save_attachment,
             width=80,
-            height=15,
-            state=tk.DISABLED
+            height=15
         )
-        self.email_detail_text.pack(fill=tk.BOTH, expand=True)
+        self.email_detail.pack(fill=tk.BOTH, expand=True)
         # 存储邮件数据
         self.emails_data = []
 
@@ -173,6 +299,140 @@ class EmailClientGUI:
             self.status_bar.config(text=f"当前账号: {account['email']}")
         else:
             self.status_bar.config(text="未配置账号，请在设置中添加账号")
+        # 同步收信协议选择
+        self._stop_idle()
+        protocol = account.get('receive_protocol', 'pop3') if account else 'pop3'
+        self.protocol_var.set(protocol.upper())
+        self._update_idle_state()
+        if account:
+            self._show_snapshot(account)
+
+    def _show_snapshot(self, account):
+        # 立即显示上次的邮件列表，再在后台与服务器核对
+        snapshot = self.mail_store.load_snapshot(account['name'])
+        if not snapshot:
+            return
+        with span('render', count=len(snapshot['emails'])):
+            self.emails_data = snapshot['emails']
+            self.email_list.set_items(self.emails_data)
+            self.email_detail.clear()
+            self.email_count_label.config(text=f"邮件数: {len(self.emails_data)}")
+            self._update_folders()
+        self._receive_emails(snapshot=snapshot)
+
+    def _create_receive_client(self, account):
+        # 根据账号的收信协议创建客户端
+        # 附件在接收时直接保存到账号目录下
+        attachment_dir = self.mail_store.attachment_dir(account['name'])
+        if account.get('receive_protocol', 'pop3') == 'imap':
+            return IMAPClient(
+                account['imap_server'],
+                account['imap_port'],
+                account['email'],
+                account['password'],
+                account.get('use_ssl', True),
+                attachment_dir=attachment_dir
+            )
+        return POP3Client(
+            account['pop3_server'],
+            account['pop3_port'],
+            account['email'],
+            account['password'],
+            account.get('use_ssl', True),
+            attachment_dir=attachment_dir
+        )
+
+    def _on_protocol_change(self, event=None):
+        account = self.config_manager.get_current_account()
+        protocol = self.protocol_var.get().lower()
+        if not account:
+            self.protocol_var.set('POP3')
+            return
+        if protocol == 'imap' and not account.get('imap_server'):
+            messagebox.showerror("错误", "当前账号未配置IMAP服务器，请在账号管理中填写")
+            self.protocol_var.set(account.get('receive_protocol', 'pop3').upper())
+            return
+        if protocol == 'pop3' and not account.get('pop3_server'):
+            messagebox.showerror("错误", "当前账号未配置POP3服务器，请在账号管理中填写")
+            self.protocol_var.set(account.get('receive_protocol', 'pop3').upper())
+            return
+        self._stop_idle()
+        self.config_manager.update_account(account['name'], {'receive_protocol': protocol})
+        self._update_idle_state()
+
+    def _update_idle_state(self):
+        # 只有IMAP协议支持IDLE推送
+        if self.protocol_var.get() == 'IMAP':
+            self.idle_check.config(state=tk.NORMAL)
+        else:
+            self.idle_var.set(False)
+            self.idle_check.config(state=tk.DISABLED)
+
+    def _toggle_idle(self):
+        if self.idle_var.get():
+            self._start_idle()
+        else:
+            self._stop_idle()
+
+    def _start_idle(self):
+        account = self.config_manager.get_current_account()
+        if not account or account.get('receive_protocol') != 'imap':
+            self.idle_var.set(False)
+            return
+        self._stop_idle()
+
+        def idle_task(cancel_token):
+            # 等待服务器推送，有新邮件时触发一次接收
+            while not cancel_token.is_set():
+                imap_client = self._create_receive_client(account)
+                try:
+                    with imap_client:
+                        while not cancel_token.is_set():
+                            responses = imap_client.idle(timeout=25 * 60, cancel_token=cancel_token)
+                            if any(r.endswith(b'EXISTS') for r in responses):
+                                self.task_manager.post(self._receive_emails)
+                except Exception as e:
+                    error_msg = str(e)
+                    self.task_manager.post(lambda: self.status_bar.config(text=f"IDLE推送中断: {error_msg}"))
+                    # 稍后重连；服务器熔断期间等到冷却期结束
+                    cancel_token.wait(max(30, imap_client.health.retry_in()))
+
+        # IDLE会一直运行，使用单独的线程，不占用线程池
+        task = self.task_manager.submit(
+            account['name'], 'idle', idle_task, description="IMAP新邮件推送", long_running=True
+        )
+        if task is None:
+            self.idle_var.set(False)
+            self.status_bar.config(text="上一次的推送任务仍在停止中，请稍后再试")
+            return
+        self.idle_account = account['name']
+        self.status_bar.config(text="已开启新邮件推送")
+
+    def _stop_idle(self):
+        if self.idle_account:
+            self.task_manager.cancel(self.idle_account, 'idle')
+            self.idle_account = None
+
+    def _update_task_label(self):
+        self.task_label.config(text=f"后台任务: {len(self.task_manager.list_tasks())}")
+
+    def _show_task_list(self):
+        TaskListWindow(self.root, self.task_manager)
+
+    def _export_metrics(self):
+        # 导出各服务器的SMTP/POP3/IMAP阶段耗时统计
+        path = filedialog.asksaveasfilename(
+            title="导出性能统计",
+            defaultextension=".prom",
+            filetypes=[("Prometheus文本", "*.prom"), ("JSON", "*.json")]
+        )
+        if not path:
+            return
+        try:
+            get_default_metrics().export(path)
+            self.status_bar.config(text=f"性能统计已导出到 {path}")
+        except Exception as e:
+            messagebox.showerror("错误", f"导出性能统计失败:\n{str(e)}")
     
     def _send_email(self):
         # 获取当前账号
@@ -181,8 +441,8 @@ class EmailClientGUI:
             messagebox.showerror("错误", "请先在设置中配置邮件账号")
             return
         # 获取表单数据
-        to_addrs = [addr.strip() for addr in self.to_entry.get().split(',') if addr.strip()]
-        cc_addrs = [addr.strip() for addr in self.cc_entry.get().split(',') if addr.strip()]
+        to_addrs = split_addresses(self.to_entry.get())
+        cc_addrs = split_addresses(self.cc_entry.get())
         subject = self.subject_entry.get()
         body = self.body_text.get("1.0", tk.END).strip()
         # 验证输入
@@ -198,24 +458,23 @@ class EmailClientGUI:
             messagebox.showerror("错误", "请输入邮件正文")
             return
         
-        # 在新线程中发送邮件，避免阻塞UI
-        self.status_bar.config(text="正在发送邮件...")
-        self.root.update()
-
-        def send_task():
-            try:
+        # 在后台任务中发送邮件，避免阻塞UI
+        def send_task(cancel_token):
+            with profile_run('send'), span('send', account=account['name']):
                 # 创建SMTP客户端
                 smtp_client = SMTPClient(
                     account['smtp_server'],
                     account['smtp_port'],
                     account['email'],
                     account['password'],
-                    account.get('use_ssl', True)
+                    account.get('use_ssl', True),
+                    max_recipients=account.get('max_recipients')
                 )
-                # 准备编码函数（如果启用了自定义编码）
+                # 准备编码函数（收件人登记了编码表或启用了自定义编码时）
                 encoder_func = None
-                if self.encoder:
-                    encoder_func = lambda text: self.encoder.encode(text)
+                encoder = self.encoder_registry.encoder_for_recipients(to_addrs + cc_addrs)
+                if encoder:
+                    encoder_func = encoder.encode
                 # 发送邮件
                 with smtp_client:
                     smtp_client.send_email(
@@ -223,22 +482,45 @@ class EmailClientGUI:
                         subject,
                         body,
                         cc_addrs=cc_addrs if cc_addrs else None,
-                        encoder_func=encoder_func
+                        encoder_func=encoder_func,
+                        cancel_token=cancel_token
                     )
-                # 更新UI
-                self.root.after(0, lambda: self._on_send_success())
-            except Exception as e:
-                error_msg = str(e)
-                self.root.after(0, lambda: self._on_send_error(error_msg))
-        thread = threading.Thread(target=send_task, daemon=True)
-        thread.start()
-    
-    def _on_send_success(self):
+                return smtp_client.last_refused
+
+        task = self.task_manager.submit(
+            account['name'], 'send', send_task,
+            on_success=self._on_send_success,
+            on_error=self._on_send_error,
+            on_cancel=lambda: self.status_bar.config(text="已取消发送"),
+            description="发送邮件"
+        )
+        if task is None:
+            self.status_bar.config(text="上一封邮件仍在发送中，请稍候")
+            return
+        self.status_bar.config(text="正在发送邮件...")
+    
+    def _dump_trace(self, name: str):
+        # 性能分析开启时，把本次运行的追踪写入Chrome trace文件
+        if is_profiling_enabled():
+            try:
+                get_tracer().dump(name)
+            except OSError as e:
+                print(f"保存追踪文件失败: {str(e)}")
+
+    def _on_send_success(self, refused=None):
+        self._dump_trace('send')
         self.status_bar.config(text="邮件发送成功")
-        messagebox.showinfo("成功", "邮件发送成功")
+        if refused:
+            # 部分收件人被服务器拒绝
+            lines = [f"{addr}: {code} {resp.decode('utf-8', errors='replace') if isinstance(resp, bytes) else resp}"
+                     for addr, (code, resp) in refused.items()]
+            messagebox.showwarning("部分发送成功", "以下收件人未能发送:\n" + "\n".join(lines))
+        else:
+            messagebox.showinfo("成功", "邮件发送成功")
         self._clear_send_form()
     
     def _on_send_error(self, error_msg: str):
+        self._dump_trace('send')
         self.status_bar.config(text="邮件发送失败")
         messagebox.showerror("错误", f"发送邮件失败:\n{error_msg}")
     
@@ -248,91 +530,312 @@ class EmailClientGUI:
         self.subject_entry.delete(0, tk.END)
         self.body_text.delete("1.0", tk.END)
     
-    def _receive_emails(self):
+    def _receive_emails(self, snapshot=None):
+        # snapshot不为None时只与服务器核对快照，下载快照中没有的邮件
         # 获取当前账号
         account = self.config_manager.get_current_account()
         if not account:
             messagebox.showerror("错误", "请先在设置中配置邮件账号")
             return
-        # 在新线程中接收邮件
-        self.status_bar.config(text="正在接收邮件...")
-        self.root.update()
+        # 在后台任务中接收邮件，解析好的邮件逐封放入队列，由界面分批取出显示
+        receive_queue = queue.Queue()
         
-        def receive_task():
-            try:
-                # 创建POP3客户端
-                pop3_client = POP3Client(
-                    account['pop3_server'],
-                    account['pop3_port'],
-                    account['email'],
-                    account['password'],
-                    account.get('use_ssl', True)
-                )
-                # 准备解码函数（如果启用了自定义编码）
-                decoder_func = None
-                if self.encoder:
-                    decoder_func = lambda text: self.encoder.decode(text)
+        def sync_task(cancel_token):
+            with profile_run('receive'), span('sync', account=account['name']):
+                # 创建收信客户端（POP3或IMAP）
+                receive_client = self._create_receive_client(account)
+                # 准备解码函数（按发件人选择编码表，见encoder_registry.py）
+                decoder_func = self.encoder_registry.decoder()
+                # 重复邮件在获取邮件头后即跳过，不下载正文
+                header_filter = None
+                if self.config_manager.get_setting('dedup', True):
+                    header_filter = self.deduplicator.header_filter(account['name'])
+                # 收信规则：只涉及邮件头的规则在下载正文前匹配
+                rule_filter = None
+                ruleset = RuleSet(self.config_manager.get_setting('rules', []), account['name'])
+                if len(ruleset):
+                    rule_filter = RuleFilter(ruleset)
                 # 接收邮件
                 max_emails = self.config_manager.get_setting('max_emails', 50)
-                with pop3_client:
-                    emails = pop3_client.list_emails(
-                        count=max_emails,
-                        decoder_func=decoder_func
-                    )
-                # 更新UI
-                self.root.after(0, lambda: self._on_receive_success(emails))
-            except Exception as e:
-                error_msg = str(e)
-                self.root.after(0, lambda: self._on_receive_error(error_msg))
-        thread = threading.Thread(target=receive_task, daemon=True)
-        thread.start()
-    
-    def _on_receive_success(self, emails):
-        self.status_bar.config(text=f"成功接收 {len(emails)} 封邮件")
-        self.emails_data = emails
-        # 更新邮件列表
-        self.email_listbox.delete(0, tk.END)
-        for email in emails:
-            subject = email.get('subject', '(无主题)')
-            from_addr = email.get('from', '(未知发件人)')
-            # 截断长标题
-            if len(subject) > 40:
-                subject = subject[:40] + "..."
-            self.email_listbox.insert(tk.END, f"{subject} - {from_addr}")
+                # 每封邮件下载后写入检查点，连接中断时重新连接并从断点继续
+                checkpoint = self.mail_store.checkpoint(account['name'])
+                with receive_client:
+                    if snapshot is not None:
+                        emails = resumable_sync(
+                            receive_client, checkpoint, snapshot, max_emails,
+                            decoder_func=decoder_func,
+                            cancel_token=cancel_token,
+                            header_filter=chain_header_filters(header_filter, rule_filter)
+                        )
+                        if rule_filter is not None:
+                            emails = [email for email in emails if rule_filter.apply(email)]
+                        receive_queue.put(('replace', emails))
+                    else:
+                        emails = []
+                        receive_queue.put(('total', min(max_emails, receive_client.get_email_count())))
+
+                        def on_email(email):
+                            if rule_filter is not None and not rule_filter.apply(email):
+                                return
+                            emails.append(email)
+                            receive_queue.put(('email', email))
+                        resumable_sync(
+                            receive_client, checkpoint, None, max_emails,
+                            decoder_func=decoder_func,
+                            cancel_token=cancel_token,
+                            header_filter=chain_header_filters(header_filter, rule_filter),
+                            on_email=on_email
+                        )
+                    uidvalidity = getattr(receive_client, 'mailbox_state', {}).get('uidvalidity')
+                    if rule_filter is not None and not cancel_token.is_set():
+                        rule_filter.delete_matched(receive_client)
+                # 完整结束时更新快照，供下次启动时显示；快照保存后检查点不再需要
+                checkpoint.close()
+                if not cancel_token.is_set():
+                    if self.mail_store.save_snapshot(account['name'], emails, receive_client.PROTOCOL, uidvalidity):
+                        checkpoint.clear()
+                # 会话索引只需加入新邮件
+                thread_index = self.mail_store.thread_index(account['name'])
+                thread_index.add_emails(emails)
+                thread_index.save()
+                if header_filter is not None:
+                    self.deduplicator.save()
+                    receive_queue.put(('skipped', header_filter.skipped))
+
+        def receive_task(cancel_token):
+            # 接收期间暂停正文预取，避免两个连接争用POP3邮箱锁
+            prefetcher = self.prefetcher
+            if prefetcher is not None:
+                prefetcher.pause()
+            try:
+                return sync_task(cancel_token)
+            finally:
+                if prefetcher is not None:
+                    prefetcher.resume()
+
+        # 结束消息也经过队列，保证在所有邮件之后处理
+        task = self.task_manager.submit(
+            account['name'], 'receive', receive_task,
+            on_success=lambda result: receive_queue.put(('done', None)),
+            on_error=lambda error_msg: receive_queue.put(('error', error_msg)),
+            on_cancel=lambda: receive_queue.put(('cancelled', None)),
+            description="接收邮件"
+        )
+        if task is None:
+            self.status_bar.config(text="正在接收邮件，请勿重复操作")
+            return
+        self.receive_account = account['name']
+        self.receive_queue = receive_queue
+        self.receive_total = 0
+        self.receive_reconciling = snapshot is not None
+        self.receive_skipped = 0
+        if snapshot is not None:
+            self.status_bar.config(text=f"已显示缓存的 {len(snapshot['emails'])} 封邮件，正在与服务器同步...")
+        else:
+            self.status_bar.config(text="正在接收邮件...")
+            self.emails_data = []
+            self.email_list.clear()
+            self.email_detail.clear()
+            self.email_count_label.config(text="邮件数: 0")
+        self.cancel_receive_button.config(state=tk.NORMAL)
+        self.root.after(self.RECEIVE_PUMP_INTERVAL, self._pump_receive_queue, receive_queue)
+
+    def _pump_receive_queue(self, receive_queue):
+        # 已被新的接收取代
+        if receive_queue is not self.receive_queue:
+            return
+        batch = []
+        finished = None
+        while len(batch) < self.RECEIVE_BATCH_SIZE:
+            try:
+                kind, payload = receive_queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'email':
+                batch.append(payload)
+            elif kind == 'replace':
+                # 快照核对完成，整体替换列表
+                with span('render', count=len(payload)):
+                    self.emails_data = payload
+                    self.email_list.set_items(payload)
+                    self.email_count_label.config(text=f"邮件数: {len(self.emails_data)}")
+                    self._update_folders()
+            elif kind == 'total':
+                self.receive_total = payload
+            elif kind == 'skipped':
+                self.receive_skipped = payload
+            else:
+                finished = (kind, payload)
+                break
+        if batch:
+            with span('render', count=len(batch)):
+                self.emails_data.extend(batch)
+                self.email_list.append_items(batch)
+                self.email_count_label.config(text=f"邮件数: {len(self.emails_data)}")
+        if finished is None:
+            if self.receive_total:
+                self.status_bar.config(
+                    text=f"正在接收邮件... {len(self.emails_data)}/{self.receive_total}"
+                )
+            self.root.after(self.RECEIVE_PUMP_INTERVAL, self._pump_receive_queue, receive_queue)
+            return
+        self.receive_queue = None
+        self.receive_account = None
+        self.cancel_receive_button.config(state=tk.DISABLED)
+        kind, payload = finished
+        self._dump_trace('receive')
+        reconciling, self.receive_reconciling = self.receive_reconciling, False
+        if kind == 'done':
+            self._on_receive_success()
+        elif kind == 'cancelled':
+            self.status_bar.config(text=f"已取消接收，共接收 {len(self.emails_data)} 封邮件")
+        elif reconciling:
+            # 启动时的后台同步失败不弹窗，继续显示缓存的邮件
+            self.status_bar.config(text=f"同步失败，显示的是缓存的邮件: {payload}")
+        else:
+            self._on_receive_error(payload)
+
+    def _cancel_receive(self):
+        if self.receive_account:
+            self.task_manager.cancel(self.receive_account, 'receive')
+            self.cancel_receive_button.config(state=tk.DISABLED)
+            self.status_bar.config(text="正在取消接收...")
+    
+    def _toggle_thread_view(self):
+        if self.thread_view_var.get():
+            self._apply_thread_view()
+        else:
+            self.email_list.set_items(self.emails_data)
+
+    def _apply_thread_view(self):
+        account = self.config_manager.get_current_account()
+        if not account or not self.thread_view_var.get():
+            return
+        with span('thread', count=len(self.emails_data)):
+            thread_index = self.mail_store.thread_index(account['name'])
+            # 列表中的邮件都已在索引中时这里不做任何事
+            thread_index.add_emails(self.emails_data)
+            order, depths = thread_index.arrange(self.emails_data)
+            self.email_list.show_threads(order, depths)
+
+    def _update_folders(self):
+        folders = sorted(folder for folder in self.email_list.index.count_by('folder') if folder)
+        self.folder_combo.config(values=[self.FOLDER_ALL, self.FOLDER_INBOX] + folders)
+        if self.folder_var.get() not in (self.FOLDER_ALL, self.FOLDER_INBOX) + tuple(folders):
+            self.folder_var.set(self.FOLDER_ALL)
+        self._apply_folder_filter()
+
+    def _apply_folder_filter(self):
+        folder = self.folder_var.get()
+        if folder == self.FOLDER_ALL:
+            self.email_list.set_filter()
+        elif folder == self.FOLDER_INBOX:
+            self.email_list.set_filter(folder='')
+        else:
+            self.email_list.set_filter(folder=folder)
+        self._apply_thread_view()
+
+    def _on_receive_success(self):
+        self._update_folders()
+        message = f"成功接收 {len(self.emails_data)} 封邮件"
+        if self.receive_skipped:
+            message += f"，跳过 {self.receive_skipped} 封重复邮件"
+        self.status_bar.config(text=message)
         # 更新邮件数量
-        self.email_count_label.config(text=f"邮件数: {len(emails)}")
+        self.email_count_label.config(text=f"邮件数: {len(self.emails_data)}")
 
     def _on_receive_error(self, error_msg: str):
         self.status_bar.config(text="接收邮件失败")
         messagebox.showerror("错误", f"接收邮件失败:\n{error_msg}")
     
-    def _on_email_select(self, event):
-        selection = self.email_listbox.curselection()
-        if not selection:
+    def _on_email_select(self, index: int):
+        if index >= len(self.emails_data):
             return
-        
-        index = selection[0]
-        if index < len(self.emails_data):
-            email = self.emails_data[index]
-            # 显示邮件详情
-            self.email_detail_text.config(state=tk.NORMAL)
-            self.email_detail_text.delete("1.0", tk.END)
-            detail = f"发件人: {email.get('from', '(未知)')}\n"
-            detail += f"收件人: {email.get('to', '(未知)')}\n"
-            detail += f"主题: {email.get('subject', '(无主题)')}\n"
-            detail += f"日期: {email.get('date', '(未知)')}\n"
-            detail += "-" * 80 + "\n\n"
-            detail += email.get('body', '(无内容)')
-            self.email_detail_text.insert("1.0", detail)
-            self.email_detail_text.config(state=tk.DISABLED)
+        email = self.emails_data[index]
+        self.email_list.mark_read(index)
+        shown = email
+        self.selected_key = None
+        prefetcher = self._get_prefetcher()
+        if prefetcher is not None and email.get('uid') is not None:
+            self.selected_key = (prefetcher.name, email['uid'])
+            if needs_body(email):
+                cached = self.body_cache.get(self.selected_key)
+                if cached is not None:
+                    shown = cached
+                else:
+                    prefetcher.fetch_now(self.selected_key, email)
+                    self.status_bar.config(text="正在下载邮件正文...")
+            self._schedule_prefetch(prefetcher)
+        # 显示邮件详情
+        self.email_detail.show_message(shown)
+
+    def _get_prefetcher(self) -> Optional[BodyPrefetcher]:
+        # 每个账号一个预取器，切换账号时关闭旧的
+        account = self.config_manager.get_current_account()
+        if not account:
+            return None
+        if self.prefetcher is not None and self.prefetcher.name == account['name']:
+            return self.prefetcher
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+        self.prefetcher = BodyPrefetcher(
+            account['name'],
+            lambda: self._create_receive_client(account),
+            self.body_cache,
+            decoder_func=self.encoder_registry.decoder(),
+            on_ready=lambda key, record: self.task_manager.post(self._on_body_ready, key, record)
+        )
+        return self.prefetcher
+
+    def _schedule_prefetch(self, prefetcher: BodyPrefetcher):
+        # 相邻的邮件优先，其次是列表顶部的未读邮件；选中位置由列表记录
+        order = self.email_list.view_order()
+        position = self.email_list.get_selected_position()
+        if position is None:
+            return
+        positions = neighbor_positions(position, len(order), prefetcher.RADIUS)
+        positions += [p for p in range(min(len(order), self.PREFETCH_UNREAD_SCAN))
+                      if not self.emails_data[order[p]].get('read')]
+        candidates = []
+        for p in positions:
+            email = self.emails_data[order[p]]
+            if email.get('uid') is not None:
+                candidates.append(((prefetcher.name, email['uid']), email))
+        prefetcher.schedule(candidates)
+
+    def _on_body_ready(self, key, record):
+        # 正在查看的邮件下载完成时刷新详情
+        if key == self.selected_key:
+            self.email_detail.show_message(record)
+            self.status_bar.config(text="邮件正文已下载")
     
+    def _save_attachment(self, attachment):
+        if not attachment.exists():
+            messagebox.showerror("错误", "附件文件不存在，请重新接收邮件")
+            return
+        path = filedialog.asksaveasfilename(
+            title="保存附件",
+            initialfile=attachment.get('filename') or attachment['sha256']
+        )
+        if not path:
+            return
+        try:
+            attachment.save_as(path)
+            self.status_bar.config(text=f"附件已保存到 {path}")
+        except Exception as e:
+            messagebox.showerror("错误", f"保存附件失败:\n{str(e)}")
+
     def _show_account_manager(self):
         AccountManagerWindow(self.root, self.config_manager, self._load_current_account)
     
+    def _show_rules(self):
+        RulesWindow(self.root, self.config_manager)
+
     def _show_advanced_settings(self):
         AdvancedSettingsWindow(self.root, self.config_manager, self._update_encoder)
     
     def _update_encoder(self):
+        set_profiling_enabled(self.config_manager.get_setting('profiling', False))
         use_custom = self.config_manager.get_setting('use_custom_encoder', False)
         shared_secret = self.config_manager.get_setting('shared_secret', '')
         
@@ -343,6 +846,79 @@ class EmailClientGUI:
         else:
             self.encoder = None
         '''
+        self.encoder_registry.default = self.encoder
+
+class TaskListWindow:
+
+    REFRESH_INTERVAL = 500
+
+    def __init__(self, parent, task_manager: TaskManager):
+        self.task_manager = task_manager
+        
+        # 创建窗口
+        self.window = tk.Toplevel(parent)
+        self.window.title("后台任务")
+        self.window.geometry("500x300")
+        self.window.transient(parent)
+        
+        self._create_interface()
+        self._refresh()
+    
+    def _create_interface(self):
+        columns = (('account', '账号', 120), ('description', '任务', 160),
+                   ('status', '状态', 80), ('elapsed', '耗时', 80))
+        self.task_tree = ttk.Treeview(
+            self.window,
+            columns=[name for name, _, _ in columns],
+            show='headings',
+            selectmode='browse'
+        )
+        for name, title, width in columns:
+            self.task_tree.heading(name, text=title)
+            self.task_tree.column(name, width=width)
+        self.task_tree.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        
+        button_frame = tk.Frame(self.window)
+        button_frame.pack(pady=5)
+        tk.Button(
+            button_frame,
+            text="取消任务",
+            command=self._cancel_selected,
+            width=10
+        ).pack(side=tk.LEFT, padx=5)
+        tk.Button(
+            button_frame,
+            text="关闭",
+            command=self.window.destroy,
+            width=10
+        ).pack(side=tk.LEFT, padx=5)
+    
+    def _refresh(self):
+        if not self.window.winfo_exists():
+            return
+        selected = self.task_tree.selection()
+        self.task_tree.delete(*self.task_tree.get_children())
+        for task in self.task_manager.list_tasks():
+            iid = f"{task['account']}\x00{task['operation']}"
+            self.task_tree.insert('', tk.END, iid=iid, values=(
+                task['account'],
+                task['description'],
+                task['status'],
+                f"{task['elapsed']:.0f}秒"
+            ))
+        selected = [iid for iid in selected if self.task_tree.exists(iid)]
+        if selected:
+            self.task_tree.selection_set(selected)
+        self.window.after(self.REFRESH_INTERVAL, self._refresh)
+    
+    def _cancel_selected(self):
+        selection = self.task_tree.selection()
+        if not selection:
+            messagebox.showwarning("警告", "请先选择要取消的任务", parent=self.window)
+            return
+        account, operation = selection[0].split('\x00', 1)
+        self.task_manager.cancel(account, operation)
+
 
 class AccountManagerWindow:
     
@@ -436,10 +1012,31 @@ class AccountManagerWindow:
         self.pop3_port_entry = tk.Entry(form_frame, width=30)
         self.pop3_port_entry.grid(row=5, column=1, pady=5)
         
+        # IMAP服务器
+        tk.Label(form_frame, text="IMAP服务器:").grid(row=6, column=0, sticky=tk.W, pady=5)
+        self.imap_server_entry = tk.Entry(form_frame, width=30)
+        self.imap_server_entry.grid(row=6, column=1, pady=5)
+        
+        # IMAP端口
+        tk.Label(form_frame, text="IMAP端口:").grid(row=7, column=0, sticky=tk.W, pady=5)
+        self.imap_port_entry = tk.Entry(form_frame, width=30)
+        self.imap_port_entry.grid(row=7, column=1, pady=5)
+        
+        # 收信协议
+        tk.Label(form_frame, text="收信协议:").grid(row=8, column=0, sticky=tk.W, pady=5)
+        self.protocol_var = tk.StringVar(value='POP3')
+        ttk.Combobox(
+            form_frame,
+            textvariable=self.protocol_var,
+            values=['POP3', 'IMAP'],
+            state='readonly',
+            width=27
+        ).grid(row=8, column=1, pady=5)
+        
         # 密码/授权码
-        tk.Label(form_frame, text="密码/授权码:").grid(row=6, column=0, sticky=tk.W, pady=5)
+        tk.Label(form_frame, text="密码/授权码:").grid(row=9, column=0, sticky=tk.W, pady=5)
         self.password_entry = tk.Entry(form_frame, width=30, show="*")
-        self.password_entry.grid(row=6, column=1, pady=5)
+        self.password_entry.grid(row=9, column=1, pady=5)
         
         # SSL选项
         self.use_ssl_var = tk.BooleanVar(value=True)
@@ -447,11 +1044,11 @@ class AccountManagerWindow:
             form_frame,
             text="使用SSL/TLS",
             variable=self.use_ssl_var
-        ).grid(row=7, column=1, sticky=tk.W, pady=5)
+        ).grid(row=10, column=1, sticky=tk.W, pady=5)
         
         # 按钮
         button_frame2 = tk.Frame(form_frame)
-        button_frame2.grid(row=8, column=1, pady=10)
+        button_frame2.grid(row=11, column=1, pady=10)
         
         tk.Button(
             button_frame2,
@@ -471,10 +1068,11 @@ class AccountManagerWindow:
     
     def _load_accounts(self):
         self.account_listbox.delete(0, tk.END)
-        accounts = self.config_manager.list_accounts()
+        # 记下列表中的账号顺序，选择时直接按下标取名字
+        self.account_names = self.config_manager.list_accounts()
         current = self.config_manager.config['current_account']
         
-        for account_name in accounts:
+        for account_name in self.account_names:
             display_name = account_name
             if account_name == current:
                 display_name += " (当前)"
@@ -486,9 +1084,8 @@ class AccountManagerWindow:
             return
 
         index = selection[0]
-        accounts = self.config_manager.list_accounts()
-        if index < len(accounts):
-            account = self.config_manager.get_account(accounts[index])
+        if index < len(self.account_names):
+            account = self.config_manager.get_account(self.account_names[index])
             if account:
                 self._fill_form(account)
     
@@ -498,8 +1095,11 @@ class AccountManagerWindow:
         self.email_entry.insert(0, account['email'])
         self.smtp_server_entry.insert(0, account['smtp_server'])
         self.smtp_port_entry.insert(0, str(account['smtp_port']))
-        self.pop3_server_entry.insert(0, account['pop3_server'])
-        self.pop3_port_entry.insert(0, str(account['pop3_port']))
+        self.pop3_server_entry.insert(0, account.get('pop3_server', ''))
+        self.pop3_port_entry.insert(0, str(account.get('pop3_port', '')))
+        self.imap_server_entry.insert(0, account.get('imap_server', ''))
+        self.imap_port_entry.insert(0, str(account.get('imap_port', '')))
+        self.protocol_var.set(account.get('receive_protocol', 'pop3').upper())
         self.password_entry.insert(0, account['password'])
         self.use_ssl_var.set(account.get('use_ssl', True))
     
@@ -510,6 +1110,9 @@ class AccountManagerWindow:
         self.smtp_port_entry.delete(0, tk.END)
         self.pop3_server_entry.delete(0, tk.END)
         self.pop3_port_entry.delete(0, tk.END)
+        self.imap_server_entry.delete(0, tk.END)
+        self.imap_port_entry.delete(0, tk.END)
+        self.protocol_var.set('POP3')
         self.password_entry.delete(0, tk.END)
         self.use_ssl_var.set(True)
 
@@ -523,15 +1126,23 @@ class AccountManagerWindow:
         smtp_port = self.smtp_port_entry.get().strip()
         pop3_server = self.pop3_server_entry.get().strip()
         pop3_port = self.pop3_port_entry.get().strip()
+        imap_server = self.imap_server_entry.get().strip()
+        imap_port = self.imap_port_entry.get().strip()
+        receive_protocol = self.protocol_var.get().lower()
         password = self.password_entry.get().strip()
         
-        # 验证输入
-        if not all([name, email, smtp_server, smtp_port, pop3_server, pop3_port, password]):
+        # 验证输入（收信服务器只要求所选协议的字段）
+        if receive_protocol == 'imap':
+            receive_fields = [imap_server, imap_port]
+        else:
+            receive_fields = [pop3_server, pop3_port]
+        if not all([name, email, smtp_server, smtp_port, password] + receive_fields):
             messagebox.showerror("错误", "请填写所有必填字段")
             return
         try:
             smtp_port = int(smtp_port)
-            pop3_port = int(pop3_port)
+            pop3_port = int(pop3_port) if pop3_port else ''
+            imap_port = int(imap_port) if imap_port else ''
         except ValueError:
             messagebox.showerror("错误", "端口必须是数字")
             return
@@ -544,21 +1155,27 @@ class AccountManagerWindow:
             'smtp_port': smtp_port,
             'pop3_server': pop3_server,
             'pop3_port': pop3_port,
+            'imap_server': imap_server,
+            'imap_port': imap_port,
+            'receive_protocol': receive_protocol,
             'password': password,
             'use_ssl': self.use_ssl_var.get()
         }
         
         if existing_account:
             # 更新账号
-            self.config_manager.update_account(name, account)
-            messagebox.showinfo("成功", "账号更新成功")
+            if not self.config_manager.update_account(name, account):
+                messagebox.showerror("错误", "账号更新失败")
+                return
+            if _flush_config(self.config_manager, self.window):
+                messagebox.showinfo("成功", "账号更新成功")
         else:
             # 添加新账号
-            if self.config_manager.add_account(account):
-                messagebox.showinfo("成功", "账号添加成功")
-            else:
+            if not self.config_manager.add_account(account):
                 messagebox.showerror("错误", "账号添加失败")
                 return
+            if _flush_config(self.config_manager, self.window):
+                messagebox.showinfo("成功", "账号添加成功")
         
         self._load_accounts()
         if self.callback:
@@ -571,12 +1188,12 @@ class AccountManagerWindow:
             return
         
         index = selection[0]
-        accounts = self.config_manager.list_accounts()
-        if index < len(accounts):
-            account_name = accounts[index]
+        if index < len(self.account_names):
+            account_name = self.account_names[index]
             
             if messagebox.askyesno("确认", f"确定要删除账号 '{account_name}' 吗？"):
-                self.config_manager.remove_account(account_name)
+                if self.config_manager.remove_account(account_name):
+                    _flush_config(self.config_manager, self.window)
                 self._load_accounts()
                 self._clear_form()
                 if self.callback:
@@ -589,15 +1206,161 @@ class AccountManagerWindow:
             return
         
         index = selection[0]
-        accounts = self.config_manager.list_accounts()
-        if index < len(accounts):
-            account_name = accounts[index]
-            self.config_manager.set_current_account(account_name)
+        if index < len(self.account_names):
+            account_name = self.account_names[index]
+            if self.config_manager.set_current_account(account_name):
+                _flush_config(self.config_manager, self.window)
             self._load_accounts()
             if self.callback:
                 self.callback()
 
 
+class RulesWindow:
+
+    COLUMNS = (('name', '名称', 90), ('field', '字段', 60), ('match', '匹配', 50),
+               ('pattern', '内容', 130), ('action', '动作', 90), ('value', '标签/文件夹', 90),
+               ('account', '账号', 80))
+
+    def __init__(self, parent, config_manager: ConfigManager):
+        self.config_manager = config_manager
+        self.rules = [dict(rule) for rule in config_manager.get_setting('rules', [])]
+        
+        # 创建窗口
+        self.window = tk.Toplevel(parent)
+        self.window.title("收信规则")
+        self.window.geometry("700x420")
+        self.window.transient(parent)
+        self.window.grab_set()
+        
+        self._create_interface()
+        self._refresh()
+    
+    def _create_interface(self):
+        self.rule_tree = ttk.Treeview(
+            self.window,
+            columns=[name for name, _, _ in self.COLUMNS],
+            show='headings',
+            selectmode='browse'
+        )
+        for name, title, width in self.COLUMNS:
+            self.rule_tree.heading(name, text=title)
+            self.rule_tree.column(name, width=width)
+        self.rule_tree.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        # 新规则
+        form_frame = tk.LabelFrame(self.window, text="新规则", padx=10, pady=5)
+        form_frame.pack(fill=tk.X, padx=5, pady=5)
+        tk.Label(form_frame, text="名称:").grid(row=0, column=0, sticky=tk.W)
+        self.name_entry = tk.Entry(form_frame, width=15)
+        self.name_entry.grid(row=0, column=1, sticky=tk.W, padx=5)
+        tk.Label(form_frame, text="当").grid(row=0, column=2, sticky=tk.W)
+        self.field_var = tk.StringVar(value=FIELD_NAMES['subject'])
+        ttk.Combobox(
+            form_frame, textvariable=self.field_var, state='readonly', width=6,
+            values=[FIELD_NAMES[field] for field in FIELDS]
+        ).grid(row=0, column=3, padx=5)
+        self.match_var = tk.StringVar(value=MATCH_NAMES['contains'])
+        ttk.Combobox(
+            form_frame, textvariable=self.match_var, state='readonly', width=5,
+            values=[MATCH_NAMES[match] for match in MATCH_TYPES]
+        ).grid(row=0, column=4, padx=5)
+        self.pattern_entry = tk.Entry(form_frame, width=20)
+        self.pattern_entry.grid(row=0, column=5, sticky=tk.W, padx=5)
+        tk.Label(form_frame, text="时").grid(row=1, column=0, sticky=tk.W, pady=5)
+        self.action_var = tk.StringVar(value=ACTION_NAMES['tag'])
+        ttk.Combobox(
+            form_frame, textvariable=self.action_var, state='readonly', width=12,
+            values=[ACTION_NAMES[action] for action in ACTIONS]
+        ).grid(row=1, column=1, sticky=tk.W, padx=5)
+        tk.Label(form_frame, text="标签/文件夹:").grid(row=1, column=2, columnspan=2, sticky=tk.E)
+        self.value_entry = tk.Entry(form_frame, width=12)
+        self.value_entry.grid(row=1, column=4, sticky=tk.W, padx=5)
+        tk.Label(form_frame, text="仅账号（可选）:").grid(row=2, column=0, columnspan=2, sticky=tk.W)
+        self.account_var = tk.StringVar(value='')
+        ttk.Combobox(
+            form_frame, textvariable=self.account_var, state='readonly', width=12,
+            values=[''] + self.config_manager.list_accounts()
+        ).grid(row=2, column=2, columnspan=2, sticky=tk.W, padx=5)
+        # 按钮
+        button_frame = tk.Frame(self.window)
+        button_frame.pack(pady=5)
+        tk.Button(button_frame, text="添加", command=self._add_rule, width=10).pack(side=tk.LEFT, padx=5)
+        tk.Button(button_frame, text="删除", command=self._remove_rule, width=10).pack(side=tk.LEFT, padx=5)
+        tk.Button(
+            button_frame,
+            text="保存",
+            command=self._save_rules,
+            width=10,
+            bg="#4CAF50",
+            fg="white"
+        ).pack(side=tk.LEFT, padx=5)
+        tk.Button(button_frame, text="取消", command=self.window.destroy, width=10).pack(side=tk.LEFT, padx=5)
+    
+    @staticmethod
+    def _lookup(names: dict, display: str) -> str:
+        for key, name in names.items():
+            if name == display:
+                return key
+        return display
+    
+    def _refresh(self):
+        self.rule_tree.delete(*self.rule_tree.get_children())
+        for i, rule in enumerate(self.rules):
+            self.rule_tree.insert('', tk.END, iid=str(i), values=(
+                rule.get('name', ''),
+                FIELD_NAMES.get(rule.get('field'), rule.get('field', '')),
+                MATCH_NAMES.get(rule.get('match', 'contains'), rule.get('match', '')),
+                rule.get('pattern', ''),
+                ACTION_NAMES.get(rule.get('action'), rule.get('action', '')),
+                rule.get('value', ''),
+                rule.get('account', '') or '全部'
+            ))
+    
+    def _add_rule(self):
+        rule = {
+            'name': self.name_entry.get().strip(),
+            'field': self._lookup(FIELD_NAMES, self.field_var.get()),
+            'match': self._lookup(MATCH_NAMES, self.match_var.get()),
+            'pattern': self.pattern_entry.get().strip(),
+            'action': self._lookup(ACTION_NAMES, self.action_var.get()),
+            'value': self.value_entry.get().strip(),
+            'account': self.account_var.get(),
+            'enabled': True
+        }
+        if not rule['pattern']:
+            messagebox.showerror("错误", "请输入匹配内容", parent=self.window)
+            return
+        if rule['action'] == 'folder' and not rule['value']:
+            messagebox.showerror("错误", "请输入文件夹名称", parent=self.window)
+            return
+        if rule['field'] == 'body' and rule['action'] == 'skip_body':
+            messagebox.showerror("错误", "正文规则只能在下载正文后匹配，不能设置为不下载正文", parent=self.window)
+            return
+        # 用RuleSet检查正则表达式是否有效
+        if not len(RuleSet([rule])):
+            messagebox.showerror("错误", "无效的正则表达式", parent=self.window)
+            return
+        self.rules.append(rule)
+        self._refresh()
+        self.name_entry.delete(0, tk.END)
+        self.pattern_entry.delete(0, tk.END)
+        self.value_entry.delete(0, tk.END)
+    
+    def _remove_rule(self):
+        selection = self.rule_tree.selection()
+        if not selection:
+            messagebox.showwarning("警告", "请先选择要删除的规则", parent=self.window)
+            return
+        del self.rules[int(selection[0])]
+        self._refresh()
+    
+    def _save_rules(self):
+        self.config_manager.set_setting('rules', self.rules)
+        if not _flush_config(self.config_manager, self.window):
+            return
+        messagebox.showinfo("成功", "规则已保存，将在下次接收邮件时生效", parent=self.window)
+        self.window.destroy()
+
+
 class AdvancedSettingsWindow:
     
     def __init__(self, parent, config_manager: ConfigManager,
@@ -608,7 +1371,7 @@ class AdvancedSettingsWindow:
         # 创建窗口
         self.window = tk.Toplevel(parent)
         self.window.title("高级设置")
-        self.window.geometry("500x400")
+        self.window.geometry("500x470")
         self.window.transient(parent)
         self.window.grab_set()
         
@@ -665,6 +1428,20 @@ class AdvancedSettingsWindow:
         )
         self.max_emails_entry = tk.Entry(other_frame, width=10)
         self.max_emails_entry.grid(row=0, column=1, sticky=tk.W, pady=5)
+        # 性能分析
+        self.profiling_var = tk.BooleanVar()
+        tk.Checkbutton(
+            other_frame,
+            text="启用性能分析（cProfile与追踪文件保存到profiles目录）",
+            variable=self.profiling_var
+        ).grid(row=1, column=0, columnspan=2, sticky=tk.W, pady=5)
+        # 重复邮件检测
+        self.dedup_var = tk.BooleanVar()
+        tk.Checkbutton(
+            other_frame,
+            text="跳过重复邮件（多个账号收到的同一封邮件只显示一次）",
+            variable=self.dedup_var
+        ).grid(row=2, column=0, columnspan=2, sticky=tk.W, pady=5)
         # 按钮
         button_frame = tk.Frame(self.window)
         button_frame.pack(pady=10)
@@ -693,6 +1470,9 @@ class AdvancedSettingsWindow:
         max_emails = self.config_manager.get_setting('max_emails', 50)
         self.max_emails_entry.insert(0, str(max_emails))
         
+        self.profiling_var.set(self.config_manager.get_setting('profiling', False))
+        self.dedup_var.set(self.config_manager.get_setting('dedup', True))
+        
         self._toggle_custom_encoding()
     
     def _toggle_custom_encoding(self):
@@ -719,10 +1499,15 @@ class AdvancedSettingsWindow:
             messagebox.showerror("错误", "最大邮件数必须是1-1000之间的数字")
             return
         
-        # 保存设置
-        self.config_manager.set_setting('use_custom_encoder', use_custom)
-        self.config_manager.set_setting('shared_secret', shared_secret)
-        self.config_manager.set_setting('max_emails', max_emails)
+        # 保存设置（合并为一次写入）
+        with self.config_manager.transaction():
+            self.config_manager.set_setting('use_custom_encoder', use_custom)
+            self.config_manager.set_setting('shared_secret', shared_secret)
+            self.config_manager.set_setting('max_emails', max_emails)
+            self.config_manager.set_setting('profiling', self.profiling_var.get())
+            self.config_manager.set_setting('dedup', self.dedup_var.get())
+        if not _flush_config(self.config_manager, self.window):
+            return
         
         messagebox.showinfo("成功", "设置已保存")
         
@@ -0,0 +1,176 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """服务器熔断期间直接失败，不再尝试连接"""
+
+
+class HostHealth:
+    """单个服务器的连接健康状态（熔断器）与自适应连接超时
+
+    连续FAILURE_THRESHOLD次连接失败后进入open状态，冷却期内的连接直接失败；
+    冷却期过后进入half_open，只放行一个探测连接：成功则恢复closed，失败则重新open
+    并把冷却期加倍。连接超时按RFC 6298计算（平滑耗时 + 4倍偏差），
+    限制在[MIN_TIMEOUT, MAX_TIMEOUT]内，超时失败后加倍。
+    """
+
+    DEFAULT_TIMEOUT = 30.0
+    MIN_TIMEOUT = 5.0
+    MAX_TIMEOUT = 30.0
+    FAILURE_THRESHOLD = 3
+    COOLDOWN = 30.0
+    MAX_COOLDOWN = 300.0
+
+    def __init__(self, name: str, clock=time.monotonic):
+        self.name = name
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self.failures = 0
+        self.cooldown = self.COOLDOWN
+        self.opened_at = 0.0
+        self._probing = False
+        # RFC 6298的平滑往返时间与偏差
+        self.srtt: Optional[float] = None
+        self.rttvar: Optional[float] = None
+        self._timeout = self.DEFAULT_TIMEOUT
+        self.last_error = ''
+
+    def retry_in(self) -> float:
+        with self._lock:
+            if self.state != OPEN:
+                return 0.0
+            return max(0.0, self.opened_at + self.cooldown - self._clock())
+
+    def before_connect(self) -> float:
+        """连接前调用：熔断时抛出CircuitOpenError，否则返回本次连接使用的超时（秒）"""
+        with self._lock:
+            if self.state == OPEN:
+                remaining = self.opened_at + self.cooldown - self._clock()
+                if remaining > 0:
+                    raise CircuitOpenError(
+                        f"服务器 {self.name} 暂时不可用（连续{self.failures}次连接失败: {self.last_error}），"
+                        f"{remaining:.0f}秒后重试"
+                    )
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    raise CircuitOpenError(f"服务器 {self.name} 正在探测是否恢复，请稍后重试")
+                self._probing = True
+            return self._timeout
+
+    def record_success(self, seconds: float):
+        with self._lock:
+            if self.srtt is None:
+                self.srtt = seconds
+                self.rttvar = seconds / 2
+            else:
+                self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - seconds)
+                self.srtt = 0.875 * self.srtt + 0.125 * seconds
+            self._timeout = min(max(self.srtt + 4 * self.rttvar, self.MIN_TIMEOUT), self.MAX_TIMEOUT)
+            self.state = CLOSED
+            self.failures = 0
+            self.cooldown = self.COOLDOWN
+            self._probing = False
+
+    def record_failure(self, error: Exception, timed_out: bool = False):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error)
+            if timed_out:
+                # 可能只是这次比平时慢，下次给更长的时间
+                self._timeout = min(self._timeout * 2, self.MAX_TIMEOUT)
+            if self.state == HALF_OPEN:
+                self.cooldown = min(self.cooldown * 2, self.MAX_COOLDOWN)
+                self._open()
+            elif self.failures >= self.FAILURE_THRESHOLD:
+                self._open()
+            self._probing = False
+
+    def abandon_connect(self):
+        """连接尝试被中断（KeyboardInterrupt等），结果未知：不计成功也不计失败，只释放探测名额"""
+        with self._lock:
+            self._probing = False
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = self._clock()
+
+    def reset(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self.cooldown = self.COOLDOWN
+            self._probing = False
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                'state': self.state,
+                'failures': self.failures,
+                'timeout': self._timeout,
+                'srtt': self.srtt,
+                'cooldown': self.cooldown,
+                'last_error': self.last_error
+            }
+
+
+class HealthRegistry:
+    """按(协议, 服务器)保存HostHealth，同一服务器的所有客户端共享"""
+
+    def __init__(self, clock=time.monotonic):
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._hosts: Dict[Tuple[str, str], HostHealth] = {}
+
+    def get(self, protocol: str, server: str) -> HostHealth:
+        key = (protocol, server)
+        with self._lock:
+            health = self._hosts.get(key)
+            if health is None:
+                health = self._hosts[key] = HostHealth(f"{protocol}://{server}", self._clock)
+            return health
+
+    def snapshot(self) -> Dict[str, Dict]:
+        with self._lock:
+            hosts = list(self._hosts.values())
+        return {health.name: health.to_dict() for health in hosts}
+
+
+@contextmanager
+def guarded_connect(health: HostHealth):
+    """包住建立连接的部分：熔断时直接失败，否则记录连接耗时或失败
+
+        with guarded_connect(health) as timeout:
+            self.connection = poplib.POP3(host, port, timeout=timeout)
+    """
+    timeout = health.before_connect()
+    start = time.perf_counter()
+    try:
+        yield timeout
+    except (OSError, EOFError) as e:
+        # 网络层面的失败（拒绝连接、超时、TLS握手失败、连接被关闭）
+        health.record_failure(e, timed_out=isinstance(e, TimeoutError))
+        raise
+    except Exception:
+        # 服务器有响应但协议出错，不算不可用
+        health.record_success(time.perf_counter() - start)
+        raise
+    except BaseException:
+        health.abandon_connect()
+        raise
+    health.record_success(time.perf_counter() - start)
+
+
+_default_health = HealthRegistry()
+
+
+def get_default_health() -> HealthRegistry:
+    return _default_health
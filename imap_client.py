@@ -0,0 +1,450 @@
+import imaplib
+import io
+import re
+import select
+import ssl
+import time
+from email.message import Message
+from email.parser import HeaderParser
+from typing import List, Dict, Optional, Tuple, Iterator
+
+from attachments import AttachmentExtractor
+from pop3_client import POP3Client, HEADERS_ONLY
+from health import get_default_health, guarded_connect
+from metrics import get_default_metrics
+from profiling import span
+
+# FETCH响应中的数据项
+_UID_RE = re.compile(rb'UID (\d+)')
+_SIZE_RE = re.compile(rb'RFC822\.SIZE (\d+)')
+_FLAGS_RE = re.compile(rb'FLAGS \(([^)]*)\)')
+# 未标记响应，如 b'* 5 EXISTS' 或 b'* OK still here'
+_UNTAGGED_RE = re.compile(rb'\* (?:(\d+) )?([A-Z-]+)(?: (.*))?$')
+
+
+class IMAPClient:
+    PROTOCOL = 'imap'
+    # 连接建立后的读写超时（秒）；建立连接本身的超时见health.py
+    IO_TIMEOUT = 30
+
+    # 复用POP3Client的邮件解析逻辑，保证两种协议返回的邮件格式一致
+    _decode_str = POP3Client._decode_str
+    _parse_email = POP3Client._parse_email
+    _parse_headers_only = POP3Client._parse_headers_only
+
+    def __init__(self, imap_server: str, imap_port: int, username: str, password: str, use_ssl: bool = True, mailbox: str = 'INBOX', metrics=None,
+                 attachment_dir: Optional[str] = None, health=None):
+        self.imap_server = imap_server
+        self.imap_port = imap_port
+        self.username = username
+        self.password = password
+        self.use_ssl = use_ssl
+        self.mailbox = mailbox
+        self.connection = None
+        # 当前选中邮箱的状态（UIDVALIDITY / UIDNEXT / HIGHESTMODSEQ）
+        self.mailbox_state = {}
+        # IDLE期间自行管理的读缓冲
+        self._idle_buffer = b''
+        # 各阶段耗时统计（见metrics.py）
+        self.metrics = metrics if metrics is not None else get_default_metrics()
+        self.server_label = f"{imap_server}:{imap_port}"
+        # 设置后附件在接收时直接解码保存到该目录（见POP3Client）
+        self.attachment_dir = attachment_dir
+        # 按服务器共享的连接健康状态（熔断与自适应连接超时）
+        self.health = (health if health is not None else get_default_health()).get(self.PROTOCOL, self.server_label)
+
+    def _timer(self, phase: str):
+        return self.metrics.timer(self.PROTOCOL, self.server_label, phase)
+
+    def connect(self) -> bool:
+        try:
+            if self.use_ssl:
+                # 使用SSL连接
+                context = ssl.create_default_context()
+                with guarded_connect(self.health) as timeout, self._timer('connect'):
+                    self.connection = imaplib.IMAP4_SSL(
+                        self.imap_server,
+                        self.imap_port,
+                        ssl_context=context,
+                        timeout=timeout
+                    )
+            else:
+                # 使用普通连接
+                with guarded_connect(self.health) as timeout, self._timer('connect'):
+                    self.connection = imaplib.IMAP4(
+                        self.imap_server,
+                        self.imap_port,
+                        timeout=timeout
+                    )
+            # 连接已建立，恢复常规的读写超时
+            self.connection.sock.settimeout(self.IO_TIMEOUT)
+            # 登录认证
+            with self._timer('auth'):
+                self.connection.login(self.username, self.password)
+            with self._timer('select'):
+                self.select_mailbox(self.mailbox)
+            return True
+        except Exception as e:
+            raise Exception(f"连接IMAP服务器失败: {str(e)}")
+
+    def disconnect(self):
+        if self.connection:
+            try:
+                self.connection.logout()
+            except:
+                pass
+            self.connection = None
+            self.mailbox_state = {}
+
+    def supports(self, capability: str) -> bool:
+        if not self.connection:
+            self.connect()
+        return capability.upper() in self.connection.capabilities
+
+    def select_mailbox(self, mailbox: str = 'INBOX') -> Dict:
+        typ, data = self.connection.select(mailbox)
+        if typ != 'OK':
+            raise Exception(f"选择邮箱 {mailbox} 失败: {data}")
+        self.mailbox = mailbox
+        state = {'exists': int(data[0]) if data and data[0] else 0}
+        # 支持CONDSTORE的服务器会在SELECT响应中给出HIGHESTMODSEQ
+        for code in ('UIDVALIDITY', 'UIDNEXT', 'HIGHESTMODSEQ'):
+            typ, values = self.connection.response(code)
+            if values and values[0] is not None:
+                state[code.lower()] = int(values[0])
+        self.mailbox_state = state
+        return state
+
+    def get_email_count(self) -> int:
+        try:
+            if not self.connection:
+                self.connect()
+            typ, data = self.connection.uid('SEARCH', None, 'ALL')
+            if typ != 'OK':
+                raise Exception(data)
+            return len(data[0].split()) if data and data[0] else 0
+        except Exception as e:
+            raise Exception(f"获取邮件数量失败: {str(e)}")
+
+    def search_uids(self, criteria: str = 'ALL') -> List[int]:
+        typ, data = self.connection.uid('SEARCH', None, criteria)
+        if typ != 'OK':
+            raise Exception(f"搜索邮件失败: {data}")
+        if not data or not data[0]:
+            return []
+        return sorted(int(uid) for uid in data[0].split())
+
+    def list_uids(self) -> List[Tuple[int, int]]:
+        # 与POP3Client.list_uids一致的形式；IMAP中序号即UID
+        try:
+            if not self.connection:
+                self.connect()
+            return [(uid, uid) for uid in self.search_uids('ALL')]
+        except Exception as e:
+            raise Exception(f"获取邮件标识失败: {str(e)}")
+
+    @staticmethod
+    def _uid_set(uids: List[int]) -> str:
+        return ','.join(str(uid) for uid in uids)
+
+    @staticmethod
+    def _iter_fetch_items(data) -> List[Tuple[bytes, Optional[bytes]]]:
+        # imaplib的FETCH结果中，带literal的条目是(头部, 内容)元组，其余为bytes
+        items = []
+        for item in data:
+            if isinstance(item, tuple):
+                items.append((item[0], item[1]))
+            elif isinstance(item, bytes) and item not in (b')', b''):
+                items.append((item, None))
+        return items
+
+    def fetch_headers(self, uids: List[int]) -> Dict[int, Dict]:
+        # 只获取邮件头和大小，不下载正文
+        if not uids:
+            return {}
+        try:
+            if not self.connection:
+                self.connect()
+            with self._timer('fetch_headers'):
+                typ, data = self.connection.uid(
+                    'FETCH', self._uid_set(uids), '(UID RFC822.SIZE BODY.PEEK[HEADER])'
+                )
+            if typ != 'OK':
+                raise Exception(data)
+            headers = {}
+            for meta, literal in self._iter_fetch_items(data):
+                uid_match = _UID_RE.search(meta)
+                if not uid_match or literal is None:
+                    continue
+                size_match = _SIZE_RE.search(meta)
+                headers[int(uid_match.group(1))] = {
+                    'header': literal,
+                    'size': int(size_match.group(1)) if size_match else 0
+                }
+            return headers
+        except Exception as e:
+            raise Exception(f"获取邮件头失败: {str(e)}")
+
+    def get_header(self, uid: int) -> Message:
+        headers = self.fetch_headers([uid])
+        if uid not in headers:
+            raise Exception(f"邮件 {uid} 不存在")
+        return self._parse_header(headers[uid]['header'])
+
+    def get_email_headers(self, uid: int) -> Dict:
+        headers = self.fetch_headers([uid])
+        if uid not in headers:
+            raise Exception(f"邮件 {uid} 不存在")
+        email_info = self._parse_headers_only(headers[uid]['header'])
+        email_info['index'] = uid
+        email_info['uid'] = uid
+        email_info['size'] = headers[uid]['size']
+        return email_info
+
+    @staticmethod
+    def _parse_header(header: bytes) -> Message:
+        return HeaderParser().parsestr(header.decode('utf-8', errors='ignore'))
+
+    def fetch_body(self, uid: int) -> bytes:
+        # 获取完整邮件（使用PEEK，不改变已读状态）
+        try:
+            if not self.connection:
+                self.connect()
+            with self._timer('fetch_body'):
+                typ, data = self.connection.uid('FETCH', str(uid), '(UID BODY.PEEK[])')
+            if typ != 'OK':
+                raise Exception(data)
+            for meta, literal in self._iter_fetch_items(data):
+                if literal is not None:
+                    self.metrics.add_bytes(self.PROTOCOL, self.server_label, 'received', len(literal))
+                    return literal
+            raise Exception(f"邮件 {uid} 不存在")
+        except Exception as e:
+            raise Exception(f"获取邮件正文失败: {str(e)}")
+
+    def _parse_with_attachments(self, email_data: bytes, decoder_func=None) -> Dict:
+        # imaplib一次读入整个literal，这里至少避免附件解码后的完整副本留在内存中
+        attachments = []
+        if self.attachment_dir:
+            extractor = AttachmentExtractor(self.attachment_dir)
+            try:
+                for line in io.BytesIO(email_data):
+                    extractor.feed(line)
+            except Exception:
+                extractor.abort()
+                raise
+            email_data = extractor.close()
+            attachments = extractor.attachments
+        email_info = self._parse_email(email_data, decoder_func)
+        if attachments:
+            email_info['attachments'] = attachments
+        return email_info
+
+    def get_email(self, uid: int, decoder_func=None) -> Dict:
+        # 获取并解析单封邮件
+        email_data = self.fetch_body(uid)
+        email_info = self._parse_with_attachments(email_data, decoder_func)
+        email_info['index'] = uid
+        email_info['uid'] = uid
+        email_info['size'] = len(email_data)
+        return email_info
+
+    def iter_emails(self, count: Optional[int] = None, decoder_func=None, cancel_token=None,
+                    header_filter=None) -> Iterator[Dict]:
+        # 先批量获取邮件头（大小），再逐封获取正文并交给调用者
+        # header_filter(邮件头, uid)返回False的邮件不下载正文（如重复邮件）
+        try:
+            if not self.connection:
+                self.connect()
+            uids = self.search_uids('ALL')
+            if count is not None:
+                uids = uids[-count:] if count > 0 else []
+            # 从最新的邮件开始获取
+            uids.reverse()
+            headers = self.fetch_headers(uids)
+        except Exception as e:
+            raise Exception(f"获取邮件列表失败: {str(e)}")
+        for uid in uids:
+            if cancel_token is not None and cancel_token.is_set():
+                return
+            try:
+                decision = True
+                if header_filter is not None and uid in headers:
+                    decision = header_filter(self._parse_header(headers[uid]['header']), uid)
+                    if not decision:
+                        continue
+                if decision == HEADERS_ONLY:
+                    email_data = headers[uid]['header']
+                    email_info = self._parse_headers_only(email_data)
+                else:
+                    with span('fetch', uid=uid):
+                        email_data = self.fetch_body(uid)
+                    with self._timer('parse'), span('parse', uid=uid):
+                        email_info = self._parse_with_attachments(email_data, decoder_func)
+                email_info['index'] = uid
+                email_info['uid'] = uid
+                email_info['size'] = headers.get(uid, {}).get('size', len(email_data))
+            except Exception as e:
+                print(f"解析邮件 {uid} 失败: {str(e)}")
+                continue
+            yield email_info
+
+    def list_emails(self, count: Optional[int] = None, decoder_func=None, cancel_token=None,
+                    header_filter=None) -> List[Dict]:
+        return list(self.iter_emails(count, decoder_func, cancel_token, header_filter))
+
+    def sync_changes(self, sync_state: Optional[Dict] = None) -> Tuple[List[int], Dict[int, List[str]], Dict]:
+        """增量同步：返回(新邮件UID, 标志变化的邮件, 新的同步状态)
+
+        sync_state为上次返回的状态。服务器支持CONDSTORE时只取
+        MODSEQ大于上次记录值的标志变化，否则只能通过UID范围发现新邮件。
+        UIDVALIDITY变化时之前的UID全部失效，需要全量同步。
+        """
+        try:
+            if not self.connection:
+                self.connect()
+            state = self.select_mailbox(self.mailbox)
+            sync_state = sync_state or {}
+            uidvalidity = state.get('uidvalidity')
+            if sync_state.get('uidvalidity') != uidvalidity:
+                sync_state = {}
+
+            last_uid = sync_state.get('last_uid', 0)
+            new_uids = [uid for uid in self.search_uids(f'UID {last_uid + 1}:*') if uid > last_uid]
+
+            changed = {}
+            last_modseq = sync_state.get('highestmodseq')
+            if last_modseq and 'highestmodseq' in state and self.supports('CONDSTORE'):
+                if state['highestmodseq'] > last_modseq:
+                    typ, data = self.connection.uid(
+                        'FETCH', f'1:{last_uid or "*"}', f'(UID FLAGS) (CHANGEDSINCE {last_modseq})'
+                    )
+                    if typ == 'OK':
+                        for meta, _ in self._iter_fetch_items(data):
+                            uid_match = _UID_RE.search(meta)
+                            flags_match = _FLAGS_RE.search(meta)
+                            if uid_match:
+                                flags = flags_match.group(1).decode('ascii', errors='ignore').split() if flags_match else []
+                                changed[int(uid_match.group(1))] = flags
+
+            new_state = {
+                'uidvalidity': uidvalidity,
+                'last_uid': max([last_uid] + new_uids),
+                'highestmodseq': state.get('highestmodseq')
+            }
+            return new_uids, changed, new_state
+        except Exception as e:
+            raise Exception(f"增量同步失败: {str(e)}")
+
+    def _read_idle_line(self, wait: float) -> Optional[bytes]:
+        # IDLE期间直接在socket上读取，以便按间隔检查超时和取消
+        sock = self.connection.sock
+        while b'\n' not in self._idle_buffer:
+            pending = sock.pending() if hasattr(sock, 'pending') else 0
+            if not pending:
+                readable, _, _ = select.select([sock], [], [], wait)
+                if not readable:
+                    return None
+            chunk = sock.recv(4096)
+            if not chunk:
+                raise Exception("服务器关闭了连接")
+            self._idle_buffer += chunk
+        line, self._idle_buffer = self._idle_buffer.split(b'\n', 1)
+        return line + b'\n'
+
+    def _drain_file_buffer(self):
+        # imaplib的文件对象可能已缓冲了紧跟在continuation之后的数据
+        sock = self.connection.sock
+        timeout = sock.gettimeout()
+        sock.settimeout(0.0)
+        try:
+            data = self.connection.file.read1(65536)
+            if data:
+                self._idle_buffer += data
+        except (BlockingIOError, ssl.SSLWantReadError):
+            pass
+        finally:
+            sock.settimeout(timeout)
+
+    def idle(self, timeout: float = 600, cancel_token=None, poll_interval: float = 1.0) -> List[bytes]:
+        """进入IDLE等待服务器推送，返回收到的未标记响应（如 b'* 5 EXISTS'）
+
+        收到EXISTS/EXPUNGE、超时或cancel_token被设置时结束IDLE。
+        RFC 2177建议客户端至少每29分钟重新发起一次IDLE。
+        """
+        if not self.connection:
+            self.connect()
+        if not self.supports('IDLE'):
+            raise Exception("服务器不支持IDLE")
+        conn = self.connection
+        tag = conn._new_tag()
+        conn.send(tag + b' IDLE\r\n')
+        line = conn.readline()
+        if not line.startswith(b'+'):
+            raise Exception(f"进入IDLE失败: {line.decode('utf-8', errors='ignore').strip()}")
+
+        self._idle_buffer = b''
+        self._drain_file_buffer()
+        responses = []
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if cancel_token is not None and cancel_token.is_set():
+                break
+            line = self._read_idle_line(min(poll_interval, max(deadline - time.monotonic(), 0)))
+            if line is None:
+                continue
+            line = line.rstrip(b'\r\n')
+            if line.startswith(b'*'):
+                responses.append(line)
+                if line.endswith(b'EXISTS') or line.endswith(b'EXPUNGE'):
+                    break
+
+        # 结束IDLE并读取标记响应
+        conn.send(b'DONE\r\n')
+        while True:
+            line = self._read_idle_line(30)
+            if line is None:
+                raise Exception("等待IDLE结束响应超时")
+            line = line.rstrip(b'\r\n')
+            if line.startswith(tag):
+                break
+            if line.startswith(b'*'):
+                responses.append(line)
+        # 与标记响应一起到达的未标记响应（如EXISTS/EXPUNGE）不能丢弃：
+        # 读完剩余的行，交回imaplib的常规响应记录，并一并返回
+        while self._idle_buffer:
+            line = self._read_idle_line(30)
+            if line is None:
+                raise Exception("读取IDLE结束后的响应超时")
+            line = line.rstrip(b'\r\n')
+            if line.startswith(b'*'):
+                responses.append(line)
+                self._push_untagged(line)
+        return responses
+
+    def _push_untagged(self, line: bytes):
+        # 按imaplib的方式记录未标记响应，之后可用connection.response()取得
+        match = _UNTAGGED_RE.match(line)
+        if not match:
+            return
+        number, typ, data = match.groups()
+        if number is not None:
+            data = number + b' ' + data if data else number
+        self.connection._append_untagged(typ.decode('ascii'), data or b'')
+
+    def delete_email(self, uid: int) -> bool:
+        try:
+            if not self.connection:
+                self.connect()
+            self.connection.uid('STORE', str(uid), '+FLAGS', '(\\Deleted)')
+            self.connection.expunge()
+            return True
+        except Exception as e:
+            raise Exception(f"删除邮件失败: {str(e)}")
+
+    def __enter__(self):
+        self.connect()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.disconnect()
@@ -0,0 +1,410 @@
+import hashlib
+import json
+import mmap
+import os
+import re
+import threading
+import time
+from email.parser import BytesHeaderParser
+from email.utils import parseaddr
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from metadata_index import email_timestamp, parse_date
+
+# mboxrd中正文里以"From "开头的行写入时加了">"
+_ESCAPED_FROM_RE = re.compile(rb'^>(>*From )', re.MULTILINE)
+_FROM_LINE_RE = re.compile(rb'^(>*From )', re.MULTILINE)
+
+# 索引中每封邮件保存的字段（不含正文）
+RECORD_FIELDS = ('uid', 'from', 'to', 'subject', 'date', 'timestamp', 'size', 'preview', 'body_length',
+                 'message_id', 'in_reply_to', 'references', 'folder', 'sha256', 'offset', 'length')
+PREVIEW_LENGTH = 500
+
+
+def scan_mbox(mm) -> Iterator[Tuple[int, int]]:
+    """在mbox（mmap或bytes）中查找邮件边界，返回每封邮件原文的(偏移, 长度)，不复制数据
+
+    每封邮件以行首的"From "开始；分隔行本身不属于邮件，邮件末尾用于分隔的空行也去掉。
+    """
+    size = len(mm)
+    start = 0 if mm[:5] == b'From ' else mm.find(b'\nFrom ')
+    if start < 0:
+        return
+    if start:
+        start += 1
+    while start < size:
+        body = mm.find(b'\n', start)
+        if body < 0:
+            return
+        body += 1
+        next_from = mm.find(b'\nFrom ', body - 1)
+        end = size if next_from < 0 else next_from + 1
+        # 去掉邮件后面分隔用的空行
+        if mm[end - 2:end] == b'\n\n':
+            end -= 1
+        elif mm[end - 4:end] == b'\r\n\r\n':
+            end -= 2
+        yield body, max(end - body, 0)
+        if next_from < 0:
+            return
+        start = next_from + 1
+
+
+def iter_eml_files(directory: str) -> Iterator[str]:
+    # 目录（含子目录）中的.eml文件，按路径排序
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith('.eml'):
+                yield os.path.join(root, name)
+
+
+def unescape_mbox(data: bytes) -> bytes:
+    if b'>From ' not in data:
+        return data
+    return _ESCAPED_FROM_RE.sub(rb'\1', data)
+
+
+_parser = None
+
+
+def parse_message(data: bytes) -> Dict:
+    """解析一封邮件的原文，返回索引记录（正文只保留开头）"""
+    global _parser
+    if _parser is None:
+        # 与接收邮件时的解析方式相同
+        from pop3_client import POP3Client
+        _parser = POP3Client('', 0, '', '', use_ssl=False)
+    email = _parser._parse_email(data)
+    body = email.pop('body') or ''
+    email['preview'] = body[:PREVIEW_LENGTH]
+    email['body_length'] = len(body)
+    email['size'] = len(data)
+    email['sha256'] = hashlib.sha256(data).hexdigest()
+    email_timestamp(email)
+    return email
+
+
+def _parse_batch(task) -> Tuple[str, List[Optional[Dict]]]:
+    """工作进程：自行打开源文件，读取并解析一批邮件；无法解析的为None
+
+    task为(mbox路径, [(偏移, 长度)])，或(.eml路径, None)表示整个文件是一封邮件。
+    """
+    path, spans = task
+    records = []
+    with open(path, 'rb') as f:
+        if spans is None:
+            data = f.read()
+            sources = [(0, len(data), data)]
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                sources = [(offset, length, unescape_mbox(mm[offset:offset + length])) for offset, length in spans]
+    for offset, length, data in sources:
+        try:
+            record = parse_message(data)
+            record['source_offset'] = offset
+            record['source_length'] = length
+            records.append(record)
+        except Exception as e:
+            print(f"解析 {path} 偏移 {offset} 处的邮件失败: {str(e)}")
+            records.append(None)
+    return path, records
+
+
+class LocalArchive:
+    """账号目录下的本地邮件存档：导入的邮件原文依次追加到messages.dat，
+    索引（邮件头、正文开头、在数据文件中的位置）追加到index.jsonl
+
+    相同内容（按SHA-256）的邮件只保存一份。先写原文再写索引，
+    中途退出时数据文件末尾多出的部分不会被索引引用。
+    """
+
+    DATA_FILE = 'messages.dat'
+    INDEX_FILE = 'index.jsonl'
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.data_path = os.path.join(directory, self.DATA_FILE)
+        self.index_path = os.path.join(directory, self.INDEX_FILE)
+        self._lock = threading.Lock()
+        self.records: List[Dict] = []
+        self._hashes = set()
+        self._data = None
+        self._index = None
+        if os.path.exists(self.index_path):
+            self._load()
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, sha256: str) -> bool:
+        return sha256 in self._hashes
+
+    def _load(self):
+        data_size = os.path.getsize(self.data_path) if os.path.exists(self.data_path) else 0
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                fields = None
+                for line in f:
+                    try:
+                        row = json.loads(line)
+                    except ValueError:
+                        # 写到一半的最后一行
+                        continue
+                    if fields is None:
+                        fields = row['fields']
+                        continue
+                    record = {field: value for field, value in zip(fields, row) if value is not None}
+                    if record['offset'] + record['length'] > data_size:
+                        continue
+                    self.records.append(record)
+                    self._hashes.add(record['sha256'])
+        except Exception as e:
+            print(f"加载本地存档失败: {str(e)}")
+
+    def _open(self):
+        if self._data is None:
+            os.makedirs(self.directory, exist_ok=True)
+            new_index = not os.path.exists(self.index_path) or os.path.getsize(self.index_path) == 0
+            self._data = open(self.data_path, 'ab')
+            self._index = open(self.index_path, 'a', encoding='utf-8')
+            if new_index:
+                self._index.write(json.dumps({'fields': list(RECORD_FIELDS)}) + '\n')
+
+    def add(self, record: Dict, data) -> bool:
+        """保存一封邮件（data为bytes或memoryview）；已存在时返回False"""
+        with self._lock:
+            if record['sha256'] in self._hashes:
+                return False
+            self._open()
+            self._data.seek(0, os.SEEK_END)
+            offset = self._data.tell()
+            self._data.write(data)
+            record = dict(record, offset=offset, length=len(data), uid=f"local-{record['sha256'][:16]}")
+            self._index.write(json.dumps([record.get(field) for field in RECORD_FIELDS],
+                                         ensure_ascii=False, separators=(',', ':')) + '\n')
+            self.records.append(record)
+            self._hashes.add(record['sha256'])
+            return True
+
+    def flush(self):
+        # 数据先于索引落盘
+        with self._lock:
+            if self._data is not None:
+                self._data.flush()
+                os.fsync(self._data.fileno())
+                self._index.flush()
+                os.fsync(self._index.fileno())
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            if self._data is not None:
+                self._data.close()
+                self._index.close()
+                self._data = self._index = None
+
+    def read(self, record: Dict) -> bytes:
+        with open(self.data_path, 'rb') as f:
+            f.seek(record['offset'])
+            return f.read(record['length'])
+
+    def iter_messages(self, folder: Optional[str] = None) -> Iterator[Tuple[Dict, bytes]]:
+        # 按导入顺序逐封读取原文，同时只有一封在内存中
+        self.flush()
+        with open(self.data_path, 'rb') as f:
+            for record in self.records:
+                if folder is not None and record.get('folder') != folder:
+                    continue
+                f.seek(record['offset'])
+                yield record, f.read(record['length'])
+
+
+class ImportResult:
+
+    def __init__(self):
+        self.imported = 0
+        self.duplicates = 0
+        self.failed = 0
+        self.bytes = 0
+
+
+# 每个任务交给工作进程的邮件数和字节数上限
+BATCH_MESSAGES = 256
+BATCH_BYTES = 8 * 1024 * 1024
+
+
+def _mbox_tasks(path: str, mm) -> Iterator[Tuple[str, List[Tuple[int, int]]]]:
+    spans = []
+    size = 0
+    for span in scan_mbox(mm):
+        spans.append(span)
+        size += span[1]
+        if len(spans) >= BATCH_MESSAGES or size >= BATCH_BYTES:
+            yield path, spans
+            spans, size = [], 0
+    if spans:
+        yield path, spans
+
+
+def import_mail(archive: LocalArchive, paths: Iterable[str], folder: Optional[str] = None,
+                workers: Optional[int] = None, cancel_token=None,
+                on_progress: Optional[Callable[[ImportResult], None]] = None) -> ImportResult:
+    """把mbox文件、.eml文件或包含.eml的目录导入本地存档
+
+    mbox用mmap打开，主进程只查找邮件边界，解析交给workers个工作进程（各自映射文件，按批读取），
+    结果按原顺序写入存档，原文直接从映射中写出。内存占用取决于批的大小，与文件大小无关。
+    folder为空时mbox以文件名（不含扩展名）作为文件夹，.eml以所在目录名作为文件夹。
+    """
+    workers = workers or os.cpu_count() or 1
+    result = ImportResult()
+    pool = None
+    if workers > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(workers)
+    try:
+        for path in paths:
+            if cancel_token is not None and cancel_token.is_set():
+                break
+            if os.path.isdir(path):
+                tasks = ((file, None) for file in iter_eml_files(path))
+                _import_tasks(archive, tasks, folder or os.path.basename(os.path.normpath(path)), None,
+                              pool, result, cancel_token, on_progress)
+            elif path.lower().endswith('.eml'):
+                _import_tasks(archive, [(path, None)], folder or os.path.basename(os.path.dirname(path)), None,
+                              pool, result, cancel_token, on_progress)
+            else:
+                with open(path, 'rb') as f:
+                    if os.fstat(f.fileno()).st_size == 0:
+                        continue
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                        _import_tasks(archive, _mbox_tasks(path, mm),
+                                      folder or os.path.splitext(os.path.basename(path))[0], mm,
+                                      pool, result, cancel_token, on_progress)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        archive.flush()
+    return result
+
+
+def _import_tasks(archive: LocalArchive, tasks, folder: str, mm, pool, result: ImportResult,
+                  cancel_token, on_progress):
+    # mm为mbox的映射，.eml时为None
+    batches = pool.imap(_parse_batch, tasks) if pool is not None else map(_parse_batch, tasks)
+    for path, records in batches:
+        for record in records:
+            if record is None:
+                result.failed += 1
+                continue
+            if record['sha256'] in archive:
+                result.duplicates += 1
+                continue
+            offset = record.pop('source_offset')
+            length = record.pop('source_length')
+            record['folder'] = folder
+            if mm is None:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            elif length != record['size']:
+                # 含有转义的"From "行，需要还原
+                data = unescape_mbox(mm[offset:offset + length])
+            else:
+                data = memoryview(mm)[offset:offset + length]
+            try:
+                if archive.add(record, data):
+                    result.imported += 1
+                    result.bytes += record['size']
+                else:
+                    result.duplicates += 1
+            finally:
+                if isinstance(data, memoryview):
+                    data.release()
+        if on_progress is not None:
+            on_progress(result)
+        if cancel_token is not None and cancel_token.is_set():
+            break
+
+
+class MboxWriter:
+    """流式写出mboxrd格式：每封邮件前加"From "分隔行，正文中以(>*)From 开头的行前加">"，换行统一为LF"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'wb')
+        self.count = 0
+
+    def write(self, data: bytes, sender: str = '', timestamp: Optional[float] = None):
+        data = _FROM_LINE_RE.sub(rb'>\1', data.replace(b'\r\n', b'\n'))
+        if not data.endswith(b'\n'):
+            data += b'\n'
+        date = time.asctime(time.gmtime(timestamp or time.time()))
+        self._file.write(f"From {sender or 'MAILER-DAEMON'} {date}\n".encode('ascii', errors='replace'))
+        self._file.write(data)
+        self._file.write(b'\n')
+        self.count += 1
+
+    def close(self):
+        self._file.close()
+
+
+class EmlWriter:
+    """每封邮件原样写成目录中的一个.eml文件"""
+
+    def __init__(self, directory: str):
+        self.path = directory
+        os.makedirs(directory, exist_ok=True)
+        self.count = 0
+
+    def write(self, data: bytes, sender: str = '', timestamp: Optional[float] = None):
+        self.count += 1
+        with open(os.path.join(self.path, f'{self.count:06d}.eml'), 'wb') as f:
+            f.write(data)
+
+    def close(self):
+        pass
+
+
+def open_writer(path: str, fmt: str = 'mbox'):
+    if fmt == 'mbox':
+        return MboxWriter(path)
+    if fmt == 'eml':
+        return EmlWriter(path)
+    raise ValueError(f"不支持的导出格式: {fmt}")
+
+
+def _envelope(data: bytes) -> Tuple[str, float]:
+    # mbox分隔行需要的发件人地址和日期
+    headers = BytesHeaderParser().parsebytes(data)
+    return parseaddr(headers.get('From', ''))[1], parse_date(headers.get('Date', ''))
+
+
+def export_archive(archive: LocalArchive, writer, folder: Optional[str] = None, cancel_token=None) -> int:
+    """把本地存档中的邮件（可只导出某个文件夹）逐封写出，返回导出的邮件数"""
+    count = 0
+    for record, data in archive.iter_messages(folder):
+        if cancel_token is not None and cancel_token.is_set():
+            break
+        writer.write(data, parseaddr(record.get('from') or '')[1], record.get('timestamp'))
+        count += 1
+    return count
+
+
+def export_server(receive_client, writer, count: Optional[int] = None, cancel_token=None) -> int:
+    """从服务器逐封下载邮件原文并写出（从旧到新），返回导出的邮件数"""
+    uids = receive_client.list_uids()
+    if count is not None:
+        uids = uids[-count:] if count > 0 else []
+    exported = 0
+    for index, uid in uids:
+        if cancel_token is not None and cancel_token.is_set():
+            break
+        try:
+            data = receive_client.fetch_body(index)
+        except Exception as e:
+            print(f"导出邮件 {uid} 失败: {str(e)}")
+            continue
+        writer.write(data, *_envelope(data))
+        exported += 1
+    return exported
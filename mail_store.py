@@ -0,0 +1,291 @@
+import imaplib
+import json
+import os
+import poplib
+import re
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+from attachments import Attachment, AttachmentWriteError
+from encoder_registry import EncoderRegistry
+from mail_archive import LocalArchive
+from pop3_client import HEADERS_ONLY
+from sync_checkpoint import SyncCheckpoint
+from thread_index import ThreadIndex
+
+
+class MailStore:
+    """按账号保存在本地的邮件数据，每个账号一个目录（data_dir/<账号名>/）
+
+    目前保存收件箱快照：最近一次列表的邮件头、UID和正文开头，
+    启动时直接显示，再在后台与服务器核对；会话索引（见thread_index.py）；
+    以及从mbox/.eml导入的邮件存档（见mail_archive.py）。
+    """
+
+    DEFAULT_DATA_DIR = 'mail_data'
+    SNAPSHOT_FILE = 'snapshot.json'
+    SNAPSHOT_VERSION = 2
+    THREADS_FILE = 'threads.jsonl'
+    CHECKPOINT_FILE = 'sync.jsonl'
+    ATTACHMENTS_DIR = 'attachments'
+    ARCHIVE_DIR = 'archive'
+    # 按联系人登记的编码表，所有账号共用，保存在data_dir下
+    ENCODERS_FILE = 'encoders.json'
+    # 快照中保存的正文长度（字符）
+    PREVIEW_LENGTH = 500
+    # 快照按列保存，每封邮件一行，避免重复写字段名
+    SNAPSHOT_FIELDS = ('index', 'uid', 'from', 'to', 'subject', 'date', 'size', 'preview', 'body_length',
+                       'message_id', 'in_reply_to', 'references', 'tags', 'folder', 'body_skipped',
+                       'attachments', 'read', 'timestamp')
+
+    def __init__(self, data_dir: Optional[str] = None):
+        self.data_dir = data_dir or self.DEFAULT_DATA_DIR
+        # 账号名 -> 已加载的会话索引，之后每次同步只需加入新邮件
+        self._thread_indexes: Dict[str, ThreadIndex] = {}
+        self._lock = threading.Lock()
+
+    def account_dir(self, account_name: str, create: bool = False) -> str:
+        safe_name = re.sub(r'[\\/:*?"<>|\s]', '_', account_name).strip('.') or '_'
+        path = os.path.join(self.data_dir, safe_name)
+        if create:
+            os.makedirs(path, exist_ok=True)
+        return path
+
+    @staticmethod
+    def _write_atomic(path: str, data: str):
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def save_snapshot(self, account_name: str, emails: List[Dict], protocol: str,
+                      uidvalidity: Optional[int] = None) -> bool:
+        try:
+            rows = []
+            for email in emails:
+                body = email.get('body') or ''
+                if email.get('partial'):
+                    # 来自快照的邮件，正文本身就是预览
+                    preview, body_length = body, email.get('body_length', len(body))
+                else:
+                    preview, body_length = body[:self.PREVIEW_LENGTH], len(body)
+                record = dict(email, preview=preview, body_length=body_length)
+                rows.append([record.get(field) for field in self.SNAPSHOT_FIELDS])
+            snapshot = {
+                'version': self.SNAPSHOT_VERSION,
+                'protocol': protocol,
+                'uidvalidity': uidvalidity,
+                'saved_at': time.time(),
+                'fields': list(self.SNAPSHOT_FIELDS),
+                'rows': rows
+            }
+            path = os.path.join(self.account_dir(account_name, create=True), self.SNAPSHOT_FILE)
+            self._write_atomic(path, json.dumps(snapshot, ensure_ascii=False, separators=(',', ':')))
+            return True
+        except Exception as e:
+            print(f"保存邮件快照失败: {str(e)}")
+            return False
+
+    def load_snapshot(self, account_name: str) -> Optional[Dict]:
+        """读取快照，返回{'protocol', 'uidvalidity', 'saved_at', 'emails'}，没有快照时返回None
+
+        快照中的邮件正文只有开头部分，这类邮件带有partial=True。
+        """
+        path = os.path.join(self.account_dir(account_name), self.SNAPSHOT_FILE)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            if snapshot.get('version') != self.SNAPSHOT_VERSION:
+                return None
+            fields = snapshot['fields']
+            emails = []
+            for row in snapshot['rows']:
+                email = {field: value for field, value in zip(fields, row) if value is not None}
+                email['body'] = email.pop('preview', '') or ''
+                email['partial'] = email.get('body_length', 0) > len(email['body'])
+                if 'attachments' in email:
+                    email['attachments'] = [Attachment(item) for item in email['attachments']]
+                emails.append(email)
+            return {
+                'protocol': snapshot.get('protocol'),
+                'uidvalidity': snapshot.get('uidvalidity'),
+                'saved_at': snapshot.get('saved_at'),
+                'emails': emails
+            }
+        except Exception as e:
+            print(f"加载邮件快照失败: {str(e)}")
+            return None
+
+    def attachment_dir(self, account_name: str) -> str:
+        # 附件按内容哈希命名，同一账号内相同的附件只保存一份
+        return os.path.join(self.account_dir(account_name), self.ATTACHMENTS_DIR)
+
+    def thread_index(self, account_name: str) -> ThreadIndex:
+        with self._lock:
+            index = self._thread_indexes.get(account_name)
+            if index is None:
+                path = os.path.join(self.account_dir(account_name), self.THREADS_FILE)
+                index = self._thread_indexes[account_name] = ThreadIndex(path)
+            return index
+
+    def checkpoint(self, account_name: str) -> SyncCheckpoint:
+        # 接收过程中的检查点，上次同步中断时从这里继续
+        return SyncCheckpoint(os.path.join(self.account_dir(account_name), self.CHECKPOINT_FILE))
+
+    def archive(self, account_name: str) -> LocalArchive:
+        # 从mbox/.eml导入的邮件（见mail_archive.py）
+        return LocalArchive(os.path.join(self.account_dir(account_name), self.ARCHIVE_DIR))
+
+    def encoder_registry(self) -> EncoderRegistry:
+        return EncoderRegistry(os.path.join(self.data_dir, self.ENCODERS_FILE))
+
+    def remove_snapshot(self, account_name: str):
+        path = os.path.join(self.account_dir(account_name), self.SNAPSHOT_FILE)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def _fetch_message(receive_client, index, uid, decoder_func=None, header_filter=None) -> Optional[Dict]:
+    # 下载一封邮件；被header_filter跳过时返回None
+    decision = True
+    if header_filter is not None:
+        decision = header_filter(receive_client.get_header(index), uid)
+        if not decision:
+            return None
+    if decision == HEADERS_ONLY:
+        email = receive_client.get_email_headers(index)
+    else:
+        email = receive_client.get_email(index, decoder_func)
+    email['uid'] = uid
+    return email
+
+
+# 同一封邮件在重新连接后仍然失败的次数上限，超过后本次同步跳过它
+MAX_MESSAGE_FAILURES = 2
+
+
+class _ConnectionLost(Exception):
+    """同步过程中连接中断，重新连接后从断点继续"""
+
+
+def _is_connection_error(error: BaseException) -> bool:
+    # 客户端把底层异常包装成Exception(...)，沿异常链找到原始异常再判断
+    while error is not None:
+        if isinstance(error, AttachmentWriteError):
+            # 附件写入本地失败（如磁盘已满）也是OSError，但与连接无关
+            return False
+        if isinstance(error, poplib.error_proto):
+            # 服务器返回-ERR（参数为响应行bytes）时连接仍然正常
+            return not (error.args and isinstance(error.args[0], bytes))
+        if isinstance(error, (OSError, EOFError, imaplib.IMAP4.abort)):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def _list_uids(receive_client) -> Optional[List]:
+    # POP3的UIDL是可选命令，服务器不支持时返回None；连接错误照常抛出
+    try:
+        return receive_client.list_uids()
+    except Exception as e:
+        if _is_connection_error(e):
+            raise _ConnectionLost(str(e)) from e
+        return None
+
+
+def resumable_sync(receive_client, checkpoint: SyncCheckpoint, snapshot: Optional[Dict] = None,
+                   count: Optional[int] = None, decoder_func=None, cancel_token=None, header_filter=None,
+                   on_email=None, max_retries: int = 3, retry_delay: float = 1.0) -> List[Dict]:
+    """可断点续传的接收：每下载一封邮件就写入检查点，连接中断后重新连接并从断点继续
+
+    快照（可选）和检查点中已有的邮件都不再下载。只有连接错误才重新连接，
+    邮件本身的问题（解析失败、附件无法保存等）只跳过该邮件。连续max_retries次重连都没有进展时
+    抛出异常，已下载的邮件仍保留在检查点中，下次同步时继续。on_email(email)在每封邮件可用时
+    调用一次（包括检查点中恢复的邮件，快照中的邮件除外）。返回的列表按从新到旧排列。
+    服务器不支持UIDL时没有UID可记录，退化为不使用快照和检查点的普通接收。
+    """
+    cached = {}
+    reported = set()
+    failures: Dict[object, int] = {}
+    stalled = 0
+    uids = []
+    while True:
+        try:
+            if stalled:
+                try:
+                    receive_client.disconnect()
+                    receive_client.connect()
+                except Exception as e:
+                    raise _ConnectionLost(str(e)) from e
+            uids = _list_uids(receive_client)
+            if uids is None:
+                break
+            if count is not None:
+                uids = uids[-count:] if count > 0 else []
+            uids.reverse()
+            validity = getattr(receive_client, 'mailbox_state', {}).get('uidvalidity')
+            if (snapshot and snapshot.get('protocol') == receive_client.PROTOCOL
+                    and snapshot.get('uidvalidity') == validity):
+                cached = {email['uid']: email for email in snapshot['emails'] if email.get('uid') is not None}
+            checkpoint.begin(receive_client.PROTOCOL, validity)
+            for index, uid in uids:
+                if uid in cached or failures.get(uid, 0) >= MAX_MESSAGE_FAILURES:
+                    continue
+                if uid in checkpoint:
+                    email = checkpoint.get(uid)
+                else:
+                    if cancel_token is not None and cancel_token.is_set():
+                        break
+                    try:
+                        email = _fetch_message(receive_client, index, uid, decoder_func, header_filter)
+                    except Exception as e:
+                        if not _is_connection_error(e):
+                            # 重新连接也无济于事，本次同步跳过，下次同步时再试
+                            print(f"获取邮件 {index} 失败: {str(e)}")
+                            failures[uid] = MAX_MESSAGE_FAILURES
+                            continue
+                        failures[uid] = failures.get(uid, 0) + 1
+                        raise _ConnectionLost(str(e)) from e
+                    checkpoint.commit(uid, email)
+                    stalled = 0
+                if email is not None and on_email is not None and uid not in reported:
+                    reported.add(uid)
+                    on_email(dict(email, index=index))
+            break
+        except _ConnectionLost as e:
+            stalled += 1
+            if stalled > max_retries:
+                raise Exception(f"同步中断（已重试{max_retries}次，已接收的邮件会在下次同步时保留）: {str(e)}")
+            print(f"接收中断，{retry_delay * stalled:.0f}秒后重新连接: {str(e)}")
+            if cancel_token is not None:
+                if cancel_token.wait(retry_delay * stalled):
+                    break
+            else:
+                time.sleep(retry_delay * stalled)
+
+    emails = []
+    if uids is None:
+        for email in receive_client.iter_emails(count, decoder_func, cancel_token, header_filter):
+            emails.append(email)
+            if on_email is not None:
+                on_email(email)
+        return emails
+    for index, uid in uids:
+        email = cached.get(uid)
+        if email is None:
+            email = checkpoint.get(uid)
+        if email is not None:
+            emails.append(dict(email, index=index))
+    return emails
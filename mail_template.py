@@ -0,0 +1,110 @@
+import base64
+import string
+from typing import Callable, Dict, List, Optional, Tuple
+
+from mime_cache import EncodedPartCache, get_default_part_cache, message_as_string
+
+
+def _encode_header(value: str) -> str:
+    # 与compat32策略下msg.as_string()的结果相同：非ASCII内容整体编码为一个RFC 2047编码字
+    if value.isascii():
+        return value
+    return '=?utf-8?b?' + base64.b64encode(value.encode('utf-8')).decode('ascii') + '?='
+
+
+class _Slots:
+    """预先拆分好的文本：固定片段与{字段}交替"""
+
+    def __init__(self, text: str):
+        self.pieces: List[Tuple[str, Optional[str]]] = []
+        for literal, field, spec, conversion in string.Formatter().parse(text or ''):
+            if field is not None and (spec or conversion or not field.isidentifier()):
+                raise ValueError(f"不支持的模板字段: {{{field}}}")
+            self.pieces.append((literal, field))
+        self.fields = [field for _, field in self.pieces if field is not None]
+        # 没有字段时直接返回固定文本
+        self.static = ''.join(literal for literal, _ in self.pieces) if not self.fields else None
+
+    def fill(self, values: Dict[str, str]) -> str:
+        if self.static is not None:
+            return self.static
+        parts = []
+        for literal, field in self.pieces:
+            parts.append(literal)
+            if field is not None:
+                parts.append(values[field])
+        return ''.join(parts)
+
+
+class MessageTemplate:
+    """预编译的群发邮件模板
+
+    主题和正文中的{字段}是替换位置。编译时生成邮件的固定部分（分隔符、各部分邮件头、
+    已编码的附件），每封邮件只需填入字段、编码主题和正文，再与固定部分拼接，
+    输出与SMTPClient.build_message相同。slot_encoders为字段指定EmailEncoder，
+    该字段的值先编码再填入；encoder_func与send_email相同，作用于填好的整个正文。
+    """
+
+    def __init__(self, from_addr: str, subject: str, body: str, attachments: Optional[List[str]] = None,
+                 slot_encoders: Optional[Dict] = None, encoder_func: Optional[Callable[[str], str]] = None,
+                 part_cache: Optional[EncodedPartCache] = None):
+        from email.generator import Generator
+        self.subject = _Slots(subject)
+        self.body = _Slots(body)
+        self.fields = sorted(set(self.subject.fields) | set(self.body.fields))
+        self.slot_encoders = dict(slot_encoders or {})
+        unknown = [field for field in self.slot_encoders if field not in self.fields]
+        if unknown:
+            raise ValueError(f"模板中没有字段: {', '.join(unknown)}")
+        self.encoder_func = encoder_func
+
+        # 正文和附件都是Base64编码，分隔符不会与内容冲突
+        boundary = Generator._make_boundary()
+        self._head = (f'Content-Type: multipart/mixed; boundary="{boundary}"\n'
+                      f'MIME-Version: 1.0\n'
+                      f'From: {_encode_header(from_addr)}\n')
+        self._body_head = (f'\n--{boundary}\n'
+                           'Content-Type: text/plain; charset="utf-8"\n'
+                           'MIME-Version: 1.0\n'
+                           'Content-Transfer-Encoding: base64\n\n')
+        tail = []
+        if attachments:
+            part_cache = part_cache if part_cache is not None else get_default_part_cache()
+            for path in attachments:
+                tail.append(f'\n--{boundary}\n')
+                tail.append(message_as_string(part_cache.part(path)))
+        tail.append(f'\n--{boundary}--\n')
+        self._tail = ''.join(tail)
+        # 正文没有字段且不需要整体编码时，编码结果也是固定的
+        self._static_body = None
+        if self.body.static is not None and encoder_func is None:
+            self._static_body = base64.encodebytes(self.body.static.encode('utf-8')).decode('ascii')
+        self._static_subject = _encode_header(self.subject.static) if self.subject.static is not None else None
+
+    def _values(self, values: Dict) -> Dict[str, str]:
+        filled = {}
+        for field in self.fields:
+            if field not in values or values[field] is None:
+                raise Exception(f"模板字段 {field} 没有对应的值")
+            value = str(values[field])
+            encoder = self.slot_encoders.get(field)
+            if encoder is not None:
+                value = encoder.encode(value)
+            filled[field] = value
+        return filled
+
+    def render(self, to_addrs: List[str], values: Optional[Dict] = None, cc_addrs: Optional[List[str]] = None) -> str:
+        filled = self._values(values or {}) if self.fields else {}
+        subject = self._static_subject
+        if subject is None:
+            subject = _encode_header(self.subject.fill(filled))
+        body = self._static_body
+        if body is None:
+            text = self.body.fill(filled)
+            if self.encoder_func:
+                text = self.encoder_func(text)
+            body = base64.encodebytes(text.encode('utf-8')).decode('ascii')
+        headers = [self._head, 'To: ', _encode_header(', '.join(to_addrs)), '\nSubject: ', subject, '\n']
+        if cc_addrs:
+            headers += ['Cc: ', _encode_header(', '.join(cc_addrs)), '\n']
+        return ''.join(headers) + self._body_head + body + self._tail
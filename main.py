@@ -1,14 +1,22 @@
 #!/usr/bin/env python3
 
 import sys
-from gui import run_gui
 
 
 def main():
+    # 带参数时走命令行，不导入tkinter
+    if len(sys.argv) > 1:
+        # 打包后的程序中，导入邮件使用的工作进程也从这里启动
+        import multiprocessing
+        multiprocessing.freeze_support()
+        from cli import main as cli_main
+        sys.exit(cli_main(sys.argv[1:]))
+
     print("正在启动图形界面...")
     print()
 
     try:
+        from gui import run_gui
         run_gui()
     except KeyboardInterrupt:
         print("\n程序已退出")
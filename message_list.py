@@ -0,0 +1,293 @@
+from bisect import bisect_right
+import tkinter as tk
+from tkinter import ttk
+from typing import List, Dict, Optional, Callable
+
+from metadata_index import MetadataIndex, READ
+
+
+class VirtualMessageList(tk.Frame):
+    """虚拟化的邮件列表
+
+    Treeview中只保留可见的几行，滚动时改写这些行的内容，
+    真正的数据保存在items列表中（即邮件索引），因此十万封邮件
+    也不会在Tk中创建十万个条目。排序和筛选使用入库时建立的列式索引（MetadataIndex）。
+    """
+
+    COLUMNS = (
+        ('subject', '主题', 360),
+        ('from', '发件人', 220),
+        ('date', '日期', 170),
+        ('size', '大小', 70),
+    )
+    ROW_HEIGHT = 20
+
+    def __init__(self, parent, on_select: Optional[Callable[[int], None]] = None, **kwargs):
+        super().__init__(parent, **kwargs)
+        self.on_select = on_select
+        # 邮件数据，以及按当前排序方式排列的数据下标
+        self.items: List[Dict] = []
+        self._order: List[int] = []
+        # 排序键和筛选字段的列式索引，在数据加入时一次性计算
+        self.index = MetadataIndex()
+        self._sort_column = None
+        self._sort_reverse = False
+        # 会话视图下每个数据下标的缩进层级
+        self._depths: Dict[int, int] = {}
+        # 显示条件（MetadataIndex.mask的参数，如只显示某个文件夹）及其掩码，None表示全部显示
+        self._criteria: Dict = {}
+        self._mask: Optional[bytearray] = None
+        # 视图状态
+        self._offset = 0
+        self._visible_rows = 0
+        # 选中的数据下标及其在_order中的位置（方向键移动时不必查找）
+        self._selected = None
+        self._selected_position = None
+
+        style = ttk.Style(self)
+        style.configure('MessageList.Treeview', rowheight=self.ROW_HEIGHT)
+        self.tree = ttk.Treeview(
+            self,
+            columns=[name for name, _, _ in self.COLUMNS],
+            show='headings',
+            selectmode='none',
+            style='MessageList.Treeview'
+        )
+        for name, title, width in self.COLUMNS:
+            self.tree.heading(name, text=title, command=lambda c=name: self.sort_by(c))
+            self.tree.column(name, width=width, anchor=tk.E if name == 'size' else tk.W)
+        self.tree.tag_configure('selected', background='#cce8ff')
+        self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+        self.tree.bind('<Configure>', self._on_configure)
+        self.tree.bind('<Button-1>', self._on_click)
+        self.tree.bind('<MouseWheel>', self._on_mousewheel)
+        self.tree.bind('<Button-4>', lambda e: self.scroll(-3))
+        self.tree.bind('<Button-5>', lambda e: self.scroll(3))
+        self.tree.bind('<Up>', lambda e: self._move_selection(-1))
+        self.tree.bind('<Down>', lambda e: self._move_selection(1))
+        self.tree.bind('<Prior>', lambda e: self._move_selection(-max(self._visible_rows - 1, 1)))
+        self.tree.bind('<Next>', lambda e: self._move_selection(max(self._visible_rows - 1, 1)))
+        self.tree.bind('<Home>', lambda e: self._move_selection(-len(self._order)))
+        self.tree.bind('<End>', lambda e: self._move_selection(len(self._order)))
+
+    # ---------- 数据 ----------
+
+    def set_items(self, items: List[Dict]):
+        self.items = list(items)
+        self.index = MetadataIndex(self.items)
+        self._update_mask()
+        self._offset = 0
+        self._selected = None
+        self._depths = {}
+        self._set_order(self._sorted_order())
+        self._refresh()
+
+    def append_items(self, items: List[Dict]):
+        if not items:
+            return
+        start = len(self.items)
+        self.items.extend(items)
+        self.index.append(items)
+        if self._criteria:
+            self._mask.extend(self.index.mask(start=start, **self._criteria))
+        rows = self.index.select(self._mask, range(start, len(self.items)))
+        if self._sort_column:
+            # 只对新邮件排序并合并到当前顺序中，选中行的位置随之后移
+            self._order, positions = self.index.merge_rows(self._order, rows, self._sort_column, self._sort_reverse)
+            if self._selected_position is not None:
+                self._selected_position += bisect_right(positions, self._selected_position)
+        else:
+            self._order.extend(rows)
+        self._refresh()
+
+    def clear(self):
+        self.set_items([])
+
+    def set_filter(self, **criteria):
+        # 只显示满足条件的邮件（参数同MetadataIndex.mask），不给参数表示全部显示；退出会话视图
+        self._criteria = {name: value for name, value in criteria.items() if value is not None}
+        self._update_mask()
+        self._depths = {}
+        self._offset = 0
+        self._set_order(self._sorted_order())
+        self._refresh()
+
+    def _update_mask(self):
+        mask = self.index.mask(**self._criteria) if self._criteria else None
+        self._mask = bytearray(mask) if mask is not None else None
+
+    def _sorted_order(self) -> List[int]:
+        if self._sort_column:
+            rows = self.index.sorted_rows(self._sort_column, self._sort_reverse)
+        else:
+            rows = range(len(self.items))
+        return self.index.select(self._mask, rows)
+
+    def _set_order(self, order: List[int]):
+        # 重新排列后更新选中行的位置；选中的邮件不再显示时取消选中
+        self._order = order
+        self._selected_position = None
+        if self._selected is not None:
+            try:
+                self._selected_position = order.index(self._selected)
+            except ValueError:
+                self._selected = None
+
+    def mark_read(self, data_index: int):
+        self.items[data_index]['read'] = True
+        self.index.set_flag(data_index, READ)
+
+    def __len__(self):
+        return len(self.items)
+
+    def get_selected_index(self) -> Optional[int]:
+        return self._selected
+
+    def get_selected_position(self) -> Optional[int]:
+        # 选中邮件在view_order()中的位置
+        return self._selected_position
+
+    def view_order(self) -> List[int]:
+        # 当前显示顺序（排序、筛选、会话视图之后）的数据下标
+        return self._order
+
+    # ---------- 排序 ----------
+
+    def show_threads(self, order: List[int], depths: Dict[int, int]):
+        # 会话视图：按给定顺序显示，主题按层级缩进；点击列标题排序时退出
+        self._set_order(self.index.select(self._mask, order))
+        self._depths = depths
+        self._sort_column = None
+        self._update_headings()
+        self._refresh()
+
+    def sort_by(self, column: str):
+        self._depths = {}
+        if self._sort_column == column:
+            self._sort_reverse = not self._sort_reverse
+        else:
+            self._sort_column = column
+            # 日期和大小默认降序（最新、最大的在前）
+            self._sort_reverse = column in ('date', 'size')
+        self._set_order(self._sorted_order())
+        self._update_headings()
+        self._refresh()
+
+    def _update_headings(self):
+        for name, title, _ in self.COLUMNS:
+            if name == self._sort_column:
+                title += ' ▼' if self._sort_reverse else ' ▲'
+            self.tree.heading(name, text=title)
+
+    # ---------- 视图 ----------
+
+    def _format_row(self, item: Dict, depth: int = 0):
+        size = int(item.get('size') or 0)
+        if size >= 1024 * 1024:
+            size_text = f"{size / (1024 * 1024):.1f}M"
+        elif size >= 1024:
+            size_text = f"{size / 1024:.0f}K"
+        else:
+            size_text = str(size)
+        subject = item.get('subject') or '(无主题)'
+        if depth:
+            subject = '    ' * (depth - 1) + '└ ' + subject
+        return (
+            subject,
+            item.get('from') or '(未知发件人)',
+            item.get('date') or '',
+            size_text
+        )
+
+    def _max_offset(self) -> int:
+        return max(len(self._order) - self._visible_rows, 0)
+
+    def _refresh(self):
+        # 行池大小跟随可见行数
+        rows = self.tree.get_children()
+        wanted = min(self._visible_rows, len(self._order))
+        if len(rows) > wanted:
+            self.tree.delete(*rows[wanted:])
+            rows = rows[:wanted]
+        for i in range(len(rows), wanted):
+            self.tree.insert('', tk.END, iid=f'row{i}')
+        rows = self.tree.get_children()
+
+        self._offset = min(max(self._offset, 0), self._max_offset())
+        for i, iid in enumerate(rows):
+            data_index = self._order[self._offset + i]
+            tags = ('selected',) if data_index == self._selected else ()
+            values = self._format_row(self.items[data_index], self._depths.get(data_index, 0))
+            self.tree.item(iid, values=values, tags=tags)
+
+        total = len(self._order)
+        if total:
+            first = self._offset / total
+            last = min((self._offset + self._visible_rows) / total, 1.0)
+        else:
+            first, last = 0.0, 1.0
+        self.scrollbar.set(first, last)
+
+    def scroll(self, delta: int):
+        self._offset = min(max(self._offset + delta, 0), self._max_offset())
+        self._refresh()
+
+    def _on_scrollbar(self, *args):
+        if args[0] == 'moveto':
+            self._offset = int(float(args[1]) * len(self._order))
+            self._offset = min(max(self._offset, 0), self._max_offset())
+            self._refresh()
+        elif args[0] == 'scroll':
+            amount = int(args[1])
+            if args[2] == 'pages':
+                amount *= max(self._visible_rows - 1, 1)
+            self.scroll(amount)
+
+    def _on_mousewheel(self, event):
+        self.scroll(-3 if event.delta > 0 else 3)
+
+    def _on_configure(self, event):
+        # 减去表头高度后计算可见行数
+        visible = max((event.height - self.ROW_HEIGHT - 4) // self.ROW_HEIGHT, 1)
+        if visible != self._visible_rows:
+            self._visible_rows = visible
+            self._refresh()
+
+    def _on_click(self, event):
+        if self.tree.identify_region(event.x, event.y) == 'heading':
+            return
+        self.tree.focus_set()
+        iid = self.tree.identify_row(event.y)
+        if not iid:
+            return
+        position = self._offset + self.tree.index(iid)
+        if position < len(self._order):
+            self._select(position)
+        return 'break'
+
+    def _move_selection(self, delta: int):
+        if not self._order:
+            return 'break'
+        if self._selected_position is None:
+            position = 0
+        else:
+            position = self._selected_position + delta
+        position = min(max(position, 0), len(self._order) - 1)
+        # 保证选中行可见
+        if position < self._offset:
+            self._offset = position
+        elif position >= self._offset + self._visible_rows:
+            self._offset = position - self._visible_rows + 1
+        self._select(position)
+        return 'break'
+
+    def _select(self, position: int):
+        data_index = self._selected = self._order[position]
+        self._selected_position = position
+        self._refresh()
+        if self.on_select:
+            self.on_select(data_index)
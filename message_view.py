@@ -0,0 +1,183 @@
+import tkinter as tk
+from tkinter import scrolledtext
+from collections import OrderedDict
+from typing import Callable, Dict, Optional
+
+
+class MessageDetailView(tk.Frame):
+    """分块渲染的邮件详情
+
+    先插入邮件头和第一屏正文，其余正文在空闲回调中分块追加，
+    超过LOAD_LIMIT的部分需点击"加载更多"才继续渲染，避免大邮件阻塞界面。
+    最近查看的CACHE_SIZE封邮件各自保留渲染好的文本控件（连同滚动位置），
+    切换回来时只需换上对应的控件，不必重新插入文本；未渲染完的从中断处继续。
+    """
+
+    FIRST_CHUNK = 8 * 1024
+    CHUNK_SIZE = 64 * 1024
+    LOAD_LIMIT = 1024 * 1024
+    CACHE_SIZE = 16
+
+    def __init__(self, parent, on_attachment: Optional[Callable[[Dict], None]] = None, **kwargs):
+        super().__init__(parent)
+        self.on_attachment = on_attachment
+        self._text_options = kwargs
+        # 没有选中邮件时显示的空白控件
+        self._blank = self._create_text()
+        self.text = self._blank
+        self.text.pack(fill=tk.BOTH, expand=True)
+        # 邮件对象id -> 渲染状态（含该邮件的文本控件）
+        self._cache: 'OrderedDict[int, Dict]' = OrderedDict()
+        self._state = None
+        # 每次切换邮件递增，用于丢弃过期的空闲回调
+        self._generation = 0
+
+    def _create_text(self) -> scrolledtext.ScrolledText:
+        text = scrolledtext.ScrolledText(self, state=tk.DISABLED, **self._text_options)
+        text.tag_configure('load_more', foreground='#2196F3', underline=True)
+        text.tag_bind('load_more', '<Button-1>', self._on_load_more)
+        text.tag_bind('load_more', '<Enter>', lambda e: text.config(cursor='hand2'))
+        text.tag_bind('load_more', '<Leave>', lambda e: text.config(cursor=''))
+        text.tag_configure('attachment', foreground='#2196F3', underline=True)
+        text.tag_bind('attachment', '<Button-1>', self._on_attachment_click)
+        text.tag_bind('attachment', '<Enter>', lambda e: text.config(cursor='hand2'))
+        text.tag_bind('attachment', '<Leave>', lambda e: text.config(cursor=''))
+        return text
+
+    def _switch_to(self, text: scrolledtext.ScrolledText):
+        if text is not self.text:
+            self.text.pack_forget()
+            text.pack(fill=tk.BOTH, expand=True)
+            self.text = text
+
+    @staticmethod
+    def _format_header(email: Dict) -> str:
+        return (
+            f"发件人: {email.get('from', '(未知)')}\n"
+            f"收件人: {email.get('to', '(未知)')}\n"
+            f"主题: {email.get('subject', '(无主题)')}\n"
+            f"日期: {email.get('date', '(未知)')}\n"
+            + (f"标签: {', '.join(email['tags'])}\n" if email.get('tags') else '')
+            + (f"文件夹: {email['folder']}\n" if email.get('folder') else '')
+            + "-" * 80 + "\n\n"
+        )
+
+    @staticmethod
+    def _format_body(email: Dict) -> str:
+        if email.get('body_skipped'):
+            return "[收信规则设置为不下载此邮件的正文]"
+        body = email.get('body', '(无内容)') or ''
+        if email.get('partial'):
+            # 来自本地快照，只有正文开头
+            body += "\n\n[本地缓存只保存了正文开头，点击\"接收邮件\"获取完整内容]"
+        return body
+
+    def _get_state(self, email: Dict) -> Dict:
+        key = id(email)
+        state = self._cache.get(key)
+        # 缓存中保存邮件对象本身，id相同但对象不同时视为未命中
+        if state is None or state['email'] is not email:
+            if state is not None:
+                self._discard(state)
+            state = {
+                'email': email,
+                'body': self._format_body(email),
+                'limit': self.LOAD_LIMIT,
+                # 已插入控件的正文长度，None表示还没有渲染
+                'rendered': None,
+                'text': self._create_text()
+            }
+            self._cache[key] = state
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.CACHE_SIZE:
+            self._discard(self._cache.popitem(last=False)[1])
+        return state
+
+    @staticmethod
+    def _discard(state: Dict):
+        # ScrolledText的外层是frame，销毁frame才会连同滚动条一起销毁
+        state['text'].frame.destroy()
+
+    def show_message(self, email: Dict):
+        self._generation += 1
+        state = self._get_state(email)
+        self._state = state
+        self._switch_to(state['text'])
+        if state['rendered'] is None:
+            self.text.config(state=tk.NORMAL)
+            self.text.insert(tk.END, self._format_header(email))
+            self._insert_attachments(email)
+            self.text.insert(tk.END, state['body'][:self.FIRST_CHUNK])
+            self.text.config(state=tk.DISABLED)
+            state['rendered'] = min(len(state['body']), self.FIRST_CHUNK)
+        # 已渲染完的邮件直接显示；上次切走时未渲染完的继续
+        self._continue_render(self._generation, state['rendered'])
+
+    @staticmethod
+    def _format_size(size: int) -> str:
+        if size >= 1024 * 1024:
+            return f"{size / (1024 * 1024):.1f}MB"
+        if size >= 1024:
+            return f"{size / 1024:.0f}KB"
+        return f"{size}B"
+
+    def _insert_attachments(self, email: Dict):
+        # 每个附件一行，点击后交给on_attachment处理（如另存为）
+        attachments = email.get('attachments') or []
+        if not attachments:
+            return
+        self.text.insert(tk.END, "附件:\n")
+        for i, attachment in enumerate(attachments):
+            label = f"  {attachment.get('filename') or '(未命名)'} ({self._format_size(attachment.get('size', 0))})"
+            self.text.insert(tk.END, label, ('attachment', f'attachment-{i}'))
+            self.text.insert(tk.END, "\n")
+        self.text.insert(tk.END, "\n")
+
+    def _on_attachment_click(self, event):
+        state = self._state
+        if state is None or not self.on_attachment:
+            return
+        for tag in self.text.tag_names(f'@{event.x},{event.y}'):
+            if tag.startswith('attachment-'):
+                self.on_attachment(state['email']['attachments'][int(tag.split('-', 1)[1])])
+                return
+
+    def clear(self):
+        self._generation += 1
+        self._state = None
+        self._switch_to(self._blank)
+
+    def _continue_render(self, generation: int, offset: int):
+        state = self._state
+        if generation != self._generation or state is None:
+            return
+        body = state['body']
+        end = min(len(body), state['limit'])
+        if offset < end:
+            chunk_end = min(offset + self.CHUNK_SIZE, end)
+            self.text.config(state=tk.NORMAL)
+            self.text.insert(tk.END, body[offset:chunk_end])
+            self.text.config(state=tk.DISABLED)
+            state['rendered'] = chunk_end
+            self.after_idle(self._continue_render, generation, chunk_end)
+            return
+        if end < len(body) and not self.text.tag_ranges('load_more'):
+            # 剩余部分较多，插入"加载更多"分界
+            remaining = len(body) - end
+            self.text.config(state=tk.NORMAL)
+            self.text.insert(tk.END, f"\n\n[加载更多... 剩余 {remaining} 个字符]", 'load_more')
+            self.text.config(state=tk.DISABLED)
+
+    def _on_load_more(self, event=None):
+        state = self._state
+        if state is None:
+            return
+        offset = state['limit']
+        state['limit'] += self.LOAD_LIMIT
+        self.text.config(state=tk.NORMAL)
+        ranges = self.text.tag_ranges('load_more')
+        if ranges:
+            self.text.delete(ranges[0], ranges[-1])
+        self.text.config(state=tk.DISABLED)
+        self._generation += 1
+        self._continue_render(self._generation, offset)
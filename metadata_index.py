@@ -0,0 +1,354 @@
+import calendar
+import operator
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, deque
+from email.utils import mktime_tz, parseaddr, parsedate_tz
+from itertools import compress, repeat
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# flags列的位
+READ = 1
+PARTIAL = 2
+HAS_ATTACHMENTS = 4
+BODY_SKIPPED = 8
+
+
+# 最常见的RFC 2822日期格式，如 "Mon, 19 Oct 2026 08:30:00 +0800"
+_DATE_RE = re.compile(r'\s*(?:[A-Za-z]{3},\s*)?(\d{1,2})\s+([A-Za-z]{3})\s+(\d{4})\s+'
+                      r'(\d{1,2}):(\d{2})(?::(\d{2}))?\s+([+-])(\d{2})(\d{2})')
+_MONTHS = {name: i for i, name in enumerate(
+    ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'), 1)}
+
+
+def parse_date(date_str: str) -> float:
+    """邮件头Date转为时间戳，无法解析时为0"""
+    match = _DATE_RE.match(date_str)
+    if match:
+        day, month, year, hour, minute, second, sign, tz_hour, tz_minute = match.groups()
+        month = _MONTHS.get(month.lower())
+        if month:
+            offset = (int(tz_hour) * 60 + int(tz_minute)) * 60
+            timestamp = calendar.timegm((int(year), month, int(day), int(hour), int(minute), int(second or 0)))
+            return float(timestamp - offset if sign == '+' else timestamp + offset)
+    # 其他格式（过时的时区名、两位年份等）交给标准库
+    try:
+        parsed = parsedate_tz(date_str)
+        return float(mktime_tz(parsed)) if parsed else 0.0
+    except Exception:
+        return 0.0
+
+
+def email_timestamp(email: Dict) -> float:
+    # 时间戳在入库时解析一次并保存在记录中（随快照保存），之后不再解析Date
+    timestamp = email.get('timestamp')
+    if timestamp is None:
+        timestamp = email['timestamp'] = parse_date(email.get('date') or '')
+    return timestamp
+
+
+def email_flags(email: Dict) -> int:
+    flags = 0
+    if email.get('read'):
+        flags |= READ
+    if email.get('partial'):
+        flags |= PARTIAL
+    if email.get('attachments'):
+        flags |= HAS_ATTACHMENTS
+    if email.get('body_skipped'):
+        flags |= BODY_SKIPPED
+    return flags
+
+
+def _merge_into(order, positions: List[int], rows: List[int]):
+    # 按非递减的位置把rows插入order（list或array），切片拼接，不逐个移动元素
+    merged = order[:0]
+    previous = 0
+    for position, row in zip(positions, rows):
+        merged += order[previous:position]
+        merged.append(row)
+        previous = position
+    merged += order[previous:]
+    return merged
+
+
+class _SortKeys:
+    """按排列读取排序键的只读序列，供bisect二分查找；reverse时从末尾读，使键升序"""
+
+    def __init__(self, order, key, reverse: bool = False):
+        self.order = order
+        self.key = key
+        self.reverse = reverse
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, i: int):
+        return self.key(self.order[~i if self.reverse else i])
+
+
+class _Interner:
+    """字符串与整数ID的对照表"""
+
+    def __init__(self):
+        self.ids: Dict[str, int] = {}
+        self.values: List[str] = []
+
+    def intern(self, value: str) -> int:
+        id_ = self.ids.get(value)
+        if id_ is None:
+            id_ = self.ids[value] = len(self.values)
+            self.values.append(value)
+        return id_
+
+    def __len__(self):
+        return len(self.values)
+
+
+class MetadataIndex:
+    """邮件元数据的列式索引
+
+    每个字段一列（array），第i行对应列表中的第i封邮件：时间戳、大小、发件人ID、
+    文件夹ID和标志位。发件人（按地址，不区分大小写）和文件夹都转为整数ID，
+    并为每个ID保存所在行的列表。筛选先生成0/1掩码（bytes），多个条件按位与后
+    用itertools.compress取出下标；分组用Counter直接统计ID列。这些都在C层面
+    逐元素处理，不经过邮件字典。
+    每列的排序结果（下标排列）在第一次使用时计算并缓存；追加数据时只对新行排序，
+    再二分查找插入位置合并到原有排列中。
+    """
+
+    def __init__(self, items: Optional[Iterable[Dict]] = None):
+        self.date = array('d')
+        self.size = array('q')
+        self.sender = array('l')
+        self.folder = array('l')
+        self.flags = bytearray()
+        # 主题不适合转为ID，保留小写后的文本作为排序键
+        self.subject: List[str] = []
+        self.senders = _Interner()
+        # 每个发件人第一次出现时的From（小写），按发件人排序时使用
+        self._sender_keys: List[str] = []
+        # From原文 -> 发件人ID，同一发件人只解析一次地址
+        self._from_ids: Dict[str, int] = {}
+        self.folders = _Interner()
+        self.folders.intern('')
+        # 发件人ID/文件夹ID -> 所在的行（升序）
+        self._sender_rows: List[array] = []
+        self._folder_rows: List[array] = [array('l')]
+        # 列名 -> 升序排列的行下标
+        self._sorted: Dict[str, array] = {}
+        # 按日期排好的行对应的时间戳（升序），日期范围和按天统计时二分查找
+        self._sorted_dates: Optional[array] = None
+        if items is not None:
+            self.append(items)
+
+    def __len__(self):
+        return len(self.flags)
+
+    # ---------- 写入 ----------
+
+    def append(self, items: Iterable[Dict]):
+        start = len(self)
+        row = start
+        self._sorted_dates = None
+        senders, folders, from_ids = self.senders, self.folders, self._from_ids
+        for item in items:
+            from_text = item.get('from') or ''
+            sender_id = from_ids.get(from_text)
+            if sender_id is None:
+                address = (parseaddr(from_text)[1] or from_text).lower()
+                sender_id = from_ids[from_text] = senders.intern(address)
+                if sender_id == len(self._sender_keys):
+                    self._sender_keys.append(from_text.lower())
+                    self._sender_rows.append(array('l'))
+            folder_id = folders.intern(item.get('folder') or '')
+            if folder_id == len(self._folder_rows):
+                self._folder_rows.append(array('l'))
+            self.date.append(email_timestamp(item))
+            self.size.append(int(item.get('size') or 0))
+            self.sender.append(sender_id)
+            self.folder.append(folder_id)
+            self.flags.append(email_flags(item))
+            self.subject.append((item.get('subject') or '').lower())
+            self._sender_rows[sender_id].append(row)
+            self._folder_rows[folder_id].append(row)
+            row += 1
+        if start and len(self) > start:
+            for column, order in self._sorted.items():
+                self._sorted[column] = self.merge_rows(order, range(start, len(self)), column)[0]
+        elif not start:
+            self._sorted = {}
+
+    def set_flag(self, row: int, flag: int, on: bool = True):
+        if on:
+            self.flags[row] |= flag
+        else:
+            self.flags[row] &= ~flag & 0xFF
+
+    # ---------- 排序 ----------
+
+    def _key_column(self, column: str):
+        # 转为列表：排序时取键不必每次把数组元素装箱
+        if column == 'date':
+            return self.date.tolist()
+        if column == 'size':
+            return self.size.tolist()
+        if column == 'subject':
+            return self.subject
+        if column == 'from':
+            # 发件人表很小：先给每个发件人排名，再把ID列映射为名次
+            ranks = array('l', bytes(len(self.senders) * array('l').itemsize))
+            for rank, sender_id in enumerate(sorted(range(len(self.senders)), key=self._sender_keys.__getitem__)):
+                ranks[sender_id] = rank
+            return array('l', map(ranks.__getitem__, self.sender))
+        raise ValueError(f"不支持按 {column} 排序")
+
+    def sort_key(self, column: str):
+        # 单行的排序键，与_key_column的顺序一致
+        if column == 'date':
+            return self.date.__getitem__
+        if column == 'size':
+            return self.size.__getitem__
+        if column == 'subject':
+            return self.subject.__getitem__
+        if column == 'from':
+            sender, keys = self.sender, self._sender_keys
+            return lambda row: keys[sender[row]]
+        raise ValueError(f"不支持按 {column} 排序")
+
+    def merge_rows(self, order, rows: Iterable[int], column: str, reverse: bool = False) -> Tuple[object, List[int]]:
+        """把新行rows（行号都大于order中的行）按column合并到已排好的order中
+
+        order按column升序（reverse时降序），同键的行按行号排列（降序时相反）。
+        返回(合并后的排列, 各新行插入order时的位置)，位置非递减。
+        """
+        key = self.sort_key(column)
+        rows = sorted(rows, key=key)
+        keys = _SortKeys(order, key, reverse)
+        positions = [bisect_right(keys, key(row)) for row in rows]
+        if reverse:
+            positions = [len(order) - position for position in reversed(positions)]
+            rows.reverse()
+        return _merge_into(order, positions, rows), positions
+
+    def sorted_rows(self, column: str, reverse: bool = False) -> array:
+        order = self._sorted.get(column)
+        if order is None:
+            order = self._sorted[column] = array('l', sorted(range(len(self)), key=self._key_column(column).__getitem__))
+        if reverse:
+            # 直接反转缓存的排列，不必重新排序
+            return order[::-1]
+        return order
+
+    def sorted_dates(self) -> array:
+        dates = self._sorted_dates
+        if dates is None:
+            dates = self._sorted_dates = array('d', map(self.date.__getitem__, self.sorted_rows('date')))
+        return dates
+
+    # ---------- 筛选 ----------
+
+    def mask(self, start: int = 0, folder: Optional[str] = None, sender: Optional[str] = None,
+             flags_set: int = 0, flags_clear: int = 0,
+             since: Optional[float] = None, until: Optional[float] = None) -> Optional[bytes]:
+        """第start行起满足全部条件的行为1，其余为0；没有条件时返回None（全部满足）
+
+        folder为''表示不在任何文件夹（收件箱）；sender为发件人地址；
+        flags_set中的位都要有，flags_clear中的位都不能有；since/until为时间戳范围[since, until)。
+        """
+        count = len(self) - start
+        masks = []
+        if folder is not None:
+            masks.append(self._id_mask(self._folder_rows, self.folders.ids.get(folder), start))
+        if sender is not None:
+            masks.append(self._id_mask(self._sender_rows, self.senders.ids.get(sender.lower()), start))
+        if flags_set or flags_clear:
+            table = bytes(int(value & flags_set == flags_set and not value & flags_clear) for value in range(256))
+            masks.append(bytes(self.flags[start:].translate(table)))
+        if since is not None or until is not None:
+            masks.append(self._date_mask(since, until, start))
+        if not masks:
+            return None
+        if len(masks) == 1:
+            return masks[0]
+        # 把掩码当作大整数按位与
+        combined = int.from_bytes(masks[0], 'little')
+        for mask in masks[1:]:
+            combined &= int.from_bytes(mask, 'little')
+        return combined.to_bytes(count, 'little')
+
+    def _scatter(self, rows, start: int) -> bytes:
+        # rows（升序）中不小于start的行置1
+        mask = bytearray(len(self) - start)
+        first = bisect_left(rows, start)
+        deque(map(mask.__setitem__, map(operator.sub, rows[first:], repeat(start)), repeat(1)), maxlen=0)
+        return bytes(mask)
+
+    def _id_mask(self, rows_by_id: List[array], id_: Optional[int], start: int) -> bytes:
+        if id_ is None:
+            return bytes(len(self) - start)
+        return self._scatter(rows_by_id[id_], start)
+
+    def _date_mask(self, since: Optional[float], until: Optional[float], start: int) -> bytes:
+        if start:
+            # 新追加的少量行直接逐个比较
+            dates = self.date[start:]
+            low = bytes(map(operator.le, repeat(since), dates)) if since is not None else None
+            high = bytes(map(operator.gt, repeat(until), dates)) if until is not None else None
+            if low is None or high is None:
+                return low if high is None else high
+            return (int.from_bytes(low, 'little') & int.from_bytes(high, 'little')).to_bytes(len(dates), 'little')
+        # 在按日期排好的行中二分查找范围，再把范围内的行置1
+        order = self.sorted_rows('date')
+        dates = self.sorted_dates()
+        first = bisect_left(dates, since) if since is not None else 0
+        last = bisect_left(dates, until) if until is not None else len(order)
+        return self._scatter(sorted(order[first:last]), 0)
+
+    @staticmethod
+    def select(mask: Optional[bytes], rows: Iterable[int]) -> List[int]:
+        """取出rows中掩码（覆盖全部行）为1的行下标，保持rows的顺序（如排序结果）"""
+        if mask is None:
+            return list(rows)
+        if rows == range(len(mask)):
+            if mask.count(1) * 64 < len(mask):
+                # 结果很少时用find跳过连续的0
+                selected = []
+                position = mask.find(1)
+                while position >= 0:
+                    selected.append(position)
+                    position = mask.find(1, position + 1)
+                return selected
+            return list(compress(rows, mask))
+        return list(compress(rows, map(mask.__getitem__, rows)))
+
+    # ---------- 分组 ----------
+
+    def count_by(self, column: str, mask: Optional[bytes] = None) -> Dict[str, int]:
+        """按发件人（sender）或文件夹（folder）统计邮件数"""
+        if column == 'sender':
+            ids, names = self.sender, self.senders.values
+        elif column == 'folder':
+            ids, names = self.folder, self.folders.values
+        else:
+            raise ValueError(f"不支持按 {column} 分组")
+        counts = Counter(ids if mask is None else compress(ids, mask))
+        return {names[id_]: count for id_, count in counts.items()}
+
+    def count_by_day(self, mask: Optional[bytes] = None, utc_offset: int = 0) -> Dict[int, int]:
+        """按日期统计邮件数，键为当天0点（utc_offset时区）的时间戳"""
+        if mask is None and len(self):
+            # 按日期排好的行中每天是连续的一段，逐天二分查找边界
+            dates = self.sorted_dates()
+            counts = {}
+            position = 0
+            while position < len(dates):
+                day = int((dates[position] + utc_offset) // 86400) * 86400 - utc_offset
+                end = bisect_left(dates, day + 86400, lo=position)
+                counts[day] = end - position
+                position = end
+            return counts
+        dates = compress(self.date, mask) if mask is not None else self.date
+        days = map(operator.floordiv, map(operator.add, dates, repeat(utc_offset)), repeat(86400))
+        return {int(day) * 86400 - utc_offset: count for day, count in Counter(days).items()}
@@ -0,0 +1,209 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Tuple
+
+# 延迟直方图的桶上界（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # 每个桶的计数（非累计），最后一个为+Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        result = []
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def to_dict(self) -> Dict:
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'buckets': {('+Inf' if bound == float('inf') else repr(bound)): total
+                        for bound, total in self.cumulative()}
+        }
+
+
+class MetricsRegistry:
+    """SMTP/POP3/IMAP各阶段的耗时、流量与错误统计
+
+    客户端通过metrics参数接收任何实现了timer/observe/add_bytes/record_error的对象，
+    未指定时使用模块级的默认实例。统计结果可导出为Prometheus文本格式或JSON。
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        # (protocol, server, phase) -> Histogram
+        self._histograms: Dict[Tuple[str, str, str], Histogram] = {}
+        # (protocol, server, direction) -> 字节数
+        self._bytes: Dict[Tuple[str, str, str], int] = {}
+        # (protocol, server, phase) -> 错误次数
+        self._errors: Dict[Tuple[str, str, str], int] = {}
+
+    def observe(self, protocol: str, server: str, phase: str, seconds: float):
+        key = (protocol, server, phase)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def add_bytes(self, protocol: str, server: str, direction: str, count: int):
+        key = (protocol, server, direction)
+        with self._lock:
+            self._bytes[key] = self._bytes.get(key, 0) + count
+
+    def record_error(self, protocol: str, server: str, phase: str):
+        key = (protocol, server, phase)
+        with self._lock:
+            self._errors[key] = self._errors.get(key, 0) + 1
+
+    @contextmanager
+    def timer(self, protocol: str, server: str, phase: str):
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.record_error(protocol, server, phase)
+            raise
+        finally:
+            self.observe(protocol, server, phase, time.perf_counter() - start)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._bytes.clear()
+            self._errors.clear()
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            return {
+                'timestamp': time.time(),
+                'latency': [
+                    dict(protocol=p, server=s, phase=ph, **h.to_dict())
+                    for (p, s, ph), h in sorted(self._histograms.items())
+                ],
+                'bytes': [
+                    {'protocol': p, 'server': s, 'direction': d, 'bytes': n}
+                    for (p, s, d), n in sorted(self._bytes.items())
+                ],
+                'errors': [
+                    {'protocol': p, 'server': s, 'phase': ph, 'count': n}
+                    for (p, s, ph), n in sorted(self._errors.items())
+                ]
+            }
+
+    @staticmethod
+    def _labels(**labels) -> str:
+        parts = []
+        for name, value in labels.items():
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            parts.append(f'{name}="{value}"')
+        return '{' + ','.join(parts) + '}'
+
+    def to_prometheus(self) -> str:
+        lines = [
+            '# HELP email_phase_seconds Latency of mail protocol phases.',
+            '# TYPE email_phase_seconds histogram'
+        ]
+        with self._lock:
+            for (protocol, server, phase), histogram in sorted(self._histograms.items()):
+                for bound, total in histogram.cumulative():
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    labels = self._labels(protocol=protocol, server=server, phase=phase, le=le)
+                    lines.append(f'email_phase_seconds_bucket{labels} {total}')
+                labels = self._labels(protocol=protocol, server=server, phase=phase)
+                lines.append(f'email_phase_seconds_sum{labels} {histogram.sum}')
+                lines.append(f'email_phase_seconds_count{labels} {histogram.count}')
+
+            lines.append('# HELP email_bytes_total Bytes transferred per server.')
+            lines.append('# TYPE email_bytes_total counter')
+            for (protocol, server, direction), count in sorted(self._bytes.items()):
+                labels = self._labels(protocol=protocol, server=server, direction=direction)
+                lines.append(f'email_bytes_total{labels} {count}')
+
+            lines.append('# HELP email_errors_total Failed protocol phases per server.')
+            lines.append('# TYPE email_errors_total counter')
+            for (protocol, server, phase), count in sorted(self._errors.items()):
+                labels = self._labels(protocol=protocol, server=server, phase=phase)
+                lines.append(f'email_errors_total{labels} {count}')
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _write_atomic(path: str, data: str):
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(prefix='.metrics.', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def write_prometheus(self, path: str):
+        # 原子写入，便于node_exporter的textfile收集器读取
+        self._write_atomic(path, self.to_prometheus())
+
+    def write_json(self, path: str):
+        self._write_atomic(path, json.dumps(self.snapshot(), ensure_ascii=False, indent=2))
+
+    def export(self, path: str):
+        # 按扩展名选择格式：.json为JSON快照，其余为Prometheus文本
+        if path.lower().endswith('.json'):
+            self.write_json(path)
+        else:
+            self.write_prometheus(path)
+
+
+class NullMetrics:
+    """不做任何统计的实现，用于关闭统计"""
+
+    @contextmanager
+    def timer(self, protocol: str, server: str, phase: str):
+        yield
+
+    def observe(self, protocol: str, server: str, phase: str, seconds: float):
+        pass
+
+    def add_bytes(self, protocol: str, server: str, direction: str, count: int):
+        pass
+
+    def record_error(self, protocol: str, server: str, phase: str):
+        pass
+
+
+_default_metrics = MetricsRegistry()
+
+
+def get_default_metrics():
+    return _default_metrics
+
+
+def set_default_metrics(metrics) -> None:
+    global _default_metrics
+    _default_metrics = metrics
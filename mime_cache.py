@@ -0,0 +1,152 @@
+import base64
+import hashlib
+import io
+import mimetypes
+import os
+import threading
+from collections import OrderedDict
+from email.generator import Generator
+from email.mime.base import MIMEBase
+from typing import Dict, Optional, Tuple
+
+
+class EncodedPartCache:
+    """已Base64编码的附件内容缓存，群发时同一附件只读取和编码一次
+
+    内容按(SHA-256, 大小)寻址，相同内容的不同文件共用一份编码结果；
+    文件路径按(大小, mtime)记住上次的哈希，文件未变化时不必重新读取。
+    编码结果按最近使用顺序淘汰，总大小不超过max_bytes。
+    """
+
+    DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+    # 记住哈希的路径数量上限
+    MAX_PATHS = 4096
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # 路径 -> (大小, mtime_ns, sha256)
+        self._paths: 'OrderedDict[str, Tuple[int, int, str]]' = OrderedDict()
+        # (sha256, 大小) -> 编码后的文本
+        self._parts: 'OrderedDict[Tuple[str, int], str]' = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._parts)
+
+    def _lookup(self, path: str, st) -> Optional[str]:
+        known = self._paths.get(path)
+        if known is None or known[:2] != (st.st_size, st.st_mtime_ns):
+            return None
+        key = (known[2], known[0])
+        encoded = self._parts.get(key)
+        if encoded is not None:
+            self._paths.move_to_end(path)
+            self._parts.move_to_end(key)
+        return encoded
+
+    def _remember_path(self, path: str, st, sha256: str):
+        self._paths[path] = (st.st_size, st.st_mtime_ns, sha256)
+        self._paths.move_to_end(path)
+        while len(self._paths) > self.MAX_PATHS:
+            self._paths.popitem(last=False)
+
+    def _store(self, key: Tuple[str, int], encoded: str):
+        if len(encoded) > self.max_bytes:
+            # 超过上限的附件不缓存
+            return
+        self._parts[key] = encoded
+        self.size += len(encoded)
+        while self.size > self.max_bytes:
+            _, evicted = self._parts.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    def encoded(self, path: str) -> str:
+        """返回文件内容的Base64编码（每行76个字符，以换行结尾）"""
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        with self._lock:
+            encoded = self._lookup(path, st)
+            if encoded is not None:
+                self.hits += 1
+                return encoded
+        with open(path, 'rb') as f:
+            data = f.read()
+        sha256 = hashlib.sha256(data).hexdigest()
+        key = (sha256, len(data))
+        with self._lock:
+            self._remember_path(path, st, sha256)
+            encoded = self._parts.get(key)
+            if encoded is not None:
+                # 内容相同的另一个文件
+                self._parts.move_to_end(key)
+                self.hits += 1
+                return encoded
+            self.misses += 1
+        encoded = base64.encodebytes(data).decode('ascii')
+        with self._lock:
+            if key not in self._parts:
+                self._store(key, encoded)
+        return encoded
+
+    def part(self, path: str, filename: Optional[str] = None, content_type: Optional[str] = None) -> MIMEBase:
+        # 每封邮件新建MIME部分（邮件头很小），编码后的内容共用
+        if not content_type:
+            content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        maintype, _, subtype = content_type.partition('/')
+        part = MIMEBase(maintype, subtype or 'octet-stream')
+        part.set_payload(self.encoded(path))
+        part['Content-Transfer-Encoding'] = 'base64'
+        part.add_header('Content-Disposition', 'attachment', filename=filename or os.path.basename(path))
+        part.pre_encoded = True
+        return part
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'entries': len(self._parts),
+                'bytes': self.size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+    def clear(self):
+        with self._lock:
+            self._paths.clear()
+            self._parts.clear()
+            self.size = 0
+
+
+class _PreEncodedGenerator(Generator):
+    # 已编码的部分直接写出，不再逐行处理
+    def _handle_text(self, msg):
+        if getattr(msg, 'pre_encoded', False):
+            self._fp.write(msg.get_payload())
+            return
+        super()._handle_text(msg)
+
+    _writeBody = _handle_text
+
+
+def message_as_string(msg) -> str:
+    """与msg.as_string()输出相同，但已编码的附件部分整块写出"""
+    if msg.is_multipart() and msg.get_boundary() is None and all(
+            (part.get('Content-Transfer-Encoding') or '').lower() == 'base64' for part in msg.get_payload()):
+        # Base64内容中不会出现"="开头的分隔线，直接生成分隔符，省去在整封邮件中查找冲突
+        msg.set_boundary(Generator._make_boundary())
+    fp = io.StringIO()
+    _PreEncodedGenerator(fp, mangle_from_=False, maxheaderlen=0).flatten(msg)
+    return fp.getvalue()
+
+
+_default_cache = EncodedPartCache()
+
+
+def get_default_part_cache() -> EncodedPartCache:
+    return _default_cache
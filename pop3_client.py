@@ -1,41 +1,74 @@
 import poplib
-from email.parser import Parser
+from email.parser import Parser, HeaderParser
+from email.message import Message
 from email.header import decode_header
 from email.utils import parseaddr
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Optional, Iterator, Tuple
+import re
 import ssl
 
+from attachments import AttachmentExtractor
+from health import get_default_health, guarded_connect
+from metrics import get_default_metrics
+from profiling import span
+
+# 邮件头中的Message-ID，如 <abc@example.com>
+_MSGID_RE = re.compile(r'<[^<>\s]+>')
+
+# header_filter的返回值之一：只保留邮件头，不下载正文
+HEADERS_ONLY = 'headers'
+
+
 class POP3Client:
+    PROTOCOL = 'pop3'
+    # 连接建立后的读写超时（秒）；建立连接本身的超时见health.py
+    IO_TIMEOUT = 30
     
-    def __init__(self, pop3_server: str, pop3_port: int, username: str, password: str, use_ssl: bool = True):
+    def __init__(self, pop3_server: str, pop3_port: int, username: str, password: str, use_ssl: bool = True, metrics=None,
+                 attachment_dir: Optional[str] = None, health=None):
         self.pop3_server = pop3_server
         self.pop3_port = pop3_port
         self.username = username
         self.password = password
         self.use_ssl = use_ssl
         self.connection = None
+        # 各阶段耗时统计（见metrics.py）
+        self.metrics = metrics if metrics is not None else get_default_metrics()
+        self.server_label = f"{pop3_server}:{pop3_port}"
+        # 设置后附件在接收时直接解码保存到该目录，邮件记录中只保留文件句柄
+        self.attachment_dir = attachment_dir
+        # 按服务器共享的连接健康状态（熔断与自适应连接超时）
+        self.health = (health if health is not None else get_default_health()).get(self.PROTOCOL, self.server_label)
+    
+    def _timer(self, phase: str):
+        return self.metrics.timer(self.PROTOCOL, self.server_label, phase)
     
     def connect(self) -> bool:
         try:
             if self.use_ssl:
                 # 使用SSL连接
                 context = ssl.create_default_context()
-                self.connection = poplib.POP3_SSL(
-                    self.pop3_server,
-                    self.pop3_port,
-                    timeout=30,
-                    context=context
-                )
+                with guarded_connect(self.health) as timeout, self._timer('connect'):
+                    self.connection = poplib.POP3_SSL(
+                        self.pop3_server,
+                        self.pop3_port,
+                        timeout=timeout,
+                        context=context
+                    )
             else:
                 # 使用普通连接
-                self.connection = poplib.POP3(
-                    self.pop3_server,
-                    self.pop3_port,
-                    timeout=30
-                )
+                with guarded_connect(self.health) as timeout, self._timer('connect'):
+                    self.connection = poplib.POP3(
+                        self.pop3_server,
+                        self.pop3_port,
+                        timeout=timeout
+                    )
+            # 连接已建立，恢复常规的读写超时
+            self.connection.sock.settimeout(self.IO_TIMEOUT)
             # 登录认证
-            self.connection.user(self.username)
-            self.connection.pass_(self.password)
+            with self._timer('auth'):
+                self.connection.user(self.username)
+                self.connection.pass_(self.password)
             return True
         except Exception as e:
             raise Exception(f"连接POP3服务器失败: {str(e)}")
@@ -52,11 +85,35 @@ class POP3Client:
         try:
             if not self.connection: self.connect()
             # stat()返回邮件数量和邮箱大小
-            count, size = self.connection.stat()
+            with self._timer('stat'):
+                count, size = self.connection.stat()
             return count
         except Exception as e:
             raise Exception(f"获取邮件数量失败: {str(e)}")
     
+    def list_uids(self) -> List[Tuple[int, str]]:
+        # UIDL：返回[(邮件序号, 唯一标识)]，按序号从旧到新排列
+        try:
+            if not self.connection:
+                self.connect()
+            with self._timer('uidl'):
+                resp, lines, octets = self.connection.uidl()
+            uids = []
+            for line in lines:
+                parts = line.decode('utf-8', errors='ignore').split()
+                if len(parts) == 2:
+                    uids.append((int(parts[0]), parts[1]))
+            return uids
+        except Exception as e:
+            raise Exception(f"获取邮件标识失败: {str(e)}")
+
+    def _try_uid_map(self) -> Dict[int, str]:
+        # 服务器不支持UIDL时返回空字典
+        try:
+            return dict(self.list_uids())
+        except Exception:
+            return {}
+
     def _decode_str(self, s: str) -> str:
         value, charset = decode_header(s)[0]
         if charset:
@@ -91,6 +148,11 @@ class POP3Client:
         
         # 解析日期
         date = msg.get('Date', '')
+
+        # 会话信息
+        message_id = _MSGID_RE.findall(msg.get('Message-ID', ''))
+        in_reply_to = _MSGID_RE.findall(msg.get('In-Reply-To', ''))
+        references = _MSGID_RE.findall(msg.get('References', ''))
         
         # 获取邮件正文
         body = ''
@@ -112,9 +174,14 @@ class POP3Client:
                 body = msg.get_payload()
 
         # 这是为未来的Base64解码定制预留的接口
+        # 按发件人选择编码表的解码器（见encoder_registry.py）
+        select = getattr(decoder_func, 'for_sender', None)
+        if select is not None:
+            decoder_func = select(from_addr, date)
         if decoder_func and body:
             try:
-                body = decoder_func(body)
+                with self._timer('decode'):
+                    body = decoder_func(body)
             except:
                 pass  # 如果解码失败，保留原文
         
@@ -123,10 +190,144 @@ class POP3Client:
             'to': f"{to_name} <{to_addr}>" if to_name else to_addr,
             'subject': subject,
             'date': date,
-            'body': body
+            'body': body,
+            'message_id': message_id[0] if message_id else '',
+            'in_reply_to': in_reply_to[0] if in_reply_to else '',
+            'references': references
         }
+
+    def _fetch_header(self, index: int) -> bytes:
+        # TOP n 0：只获取邮件头，用于在下载正文前判断是否需要这封邮件
+        try:
+            if not self.connection:
+                self.connect()
+            with self._timer('top'):
+                resp, lines, octets = self.connection.top(index, 0)
+            self.metrics.add_bytes(self.PROTOCOL, self.server_label, 'received', octets)
+            return b'\r\n'.join(lines)
+        except Exception as e:
+            raise Exception(f"获取邮件头失败: {str(e)}")
+
+    def get_header(self, index: int) -> Message:
+        return HeaderParser().parsestr(self._fetch_header(index).decode('utf-8', errors='ignore'))
+
+    def _message_size(self, index: int) -> int:
+        resp = self.connection.list(index)
+        parts = resp.split()
+        return int(parts[2]) if len(parts) > 2 else 0
+
+    def _parse_headers_only(self, header_data: bytes) -> Dict:
+        # 只有邮件头时的邮件记录，正文为空
+        email_info = self._parse_email(header_data)
+        email_info['body'] = ''
+        email_info['body_skipped'] = True
+        return email_info
+
+    def get_email_headers(self, index: int) -> Dict:
+        email_info = self._parse_headers_only(self._fetch_header(index))
+        email_info['index'] = index
+        email_info['size'] = self._message_size(index)
+        return email_info
+
+    def _retr(self, index: int):
+        # 返回(邮件数据, 附件, 字节数)；未设置附件目录时与retr()相同
+        if not self.attachment_dir:
+            resp, lines, octets = self.connection.retr(index)
+            return b'\r\n'.join(lines), [], octets
+        # 逐行读取RETR响应并交给AttachmentExtractor，整封邮件不会同时留在内存中
+        extractor = AttachmentExtractor(self.attachment_dir)
+        try:
+            octets = self._retr_lines(index, extractor.feed)
+            return extractor.close(), extractor.attachments, octets
+        except Exception:
+            extractor.abort()
+            raise
+
+    def _retr_lines(self, index: int, consume: Callable[[bytes], None]) -> int:
+        """逐行读取RETR响应（已去掉点填充，带CRLF）交给consume，返回字节数
+
+        consume出错（如磁盘已满）时仍读完剩余响应直到结束行，会话保持同步后再抛出；
+        读取本身出错时无法确定读到了哪里，关闭连接。poplib的内部方法只在这里使用。
+        """
+        conn = self.connection
+        try:
+            conn._putcmd(f'RETR {index}')
+            conn._getresp()
+        except poplib.error_proto as e:
+            # 服务器返回-ERR（参数为响应行bytes）时会话仍然同步，其他情况（如连接断开）需要关闭
+            if not (e.args and isinstance(e.args[0], bytes)):
+                self._drop_connection()
+            raise
+        except Exception:
+            self._drop_connection()
+            raise
+        octets = 0
+        error = None
+        try:
+            while True:
+                line, length = conn._getline()
+                if line == b'.':
+                    break
+                if line.startswith(b'..'):
+                    length -= 1
+                    line = line[1:]
+                octets += length
+                if error is None:
+                    try:
+                        consume(line + b'\r\n')
+                    except Exception as e:
+                        error = e
+        except Exception:
+            self._drop_connection()
+            raise
+        if error is not None:
+            raise error
+        return octets
+
+    def _drop_connection(self):
+        # 响应读到一半时连接已不可用：直接关闭（不发送QUIT），之后的调用需要重新连接
+        if self.connection:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+    def fetch_body(self, index: int) -> bytes:
+        # 获取完整邮件原文（不解析、不提取附件），用于导出
+        try:
+            if not self.connection:
+                self.connect()
+            with self._timer('retr'):
+                resp, lines, octets = self.connection.retr(index)
+            self.metrics.add_bytes(self.PROTOCOL, self.server_label, 'received', octets)
+            return b'\r\n'.join(lines) + b'\r\n'
+        except Exception as e:
+            raise Exception(f"获取邮件失败: {str(e)}")
+
+    def get_email(self, index: int, decoder_func=None) -> Dict:
+        # 获取并解析单封邮件
+        try:
+            if not self.connection:
+                self.connect()
+            with self._timer('retr'):
+                email_data, attachments, octets = self._retr(index)
+            self.metrics.add_bytes(self.PROTOCOL, self.server_label, 'received', octets)
+            with self._timer('parse'):
+                email_info = self._parse_email(email_data, decoder_func)
+            if attachments:
+                email_info['attachments'] = attachments
+            email_info['index'] = index
+            email_info['size'] = octets
+            return email_info
+        except Exception as e:
+            raise Exception(f"获取邮件失败: {str(e)}")
     
-    def list_emails(self, count: Optional[int] = None, decoder_func=None) -> List[Dict]:
+    def iter_emails(self, count: Optional[int] = None, decoder_func=None, cancel_token=None,
+                    header_filter=None) -> Iterator[Dict]:
+        # 逐封获取并解析邮件，每解析完一封就交给调用者
+        # cancel_token被设置后在下一次RETR之前停止
+        # header_filter(邮件头, uid)返回False的邮件不下载正文（如重复邮件）
         try:
             if not self.connection:
                 self.connect()
@@ -136,24 +337,51 @@ class POP3Client:
                 count = total_count
             else:
                 count = min(count, total_count)
-            emails = []
-            # 从最新的邮件开始获取
-            for i in range(total_count, total_count - count, -1):
-                try:
-                    # 获取邮件内容
-                    resp, lines, octets = self.connection.retr(i)
-                    # 合并邮件内容
-                    email_data = b'\r\n'.join(lines)
-                    # 解析邮件
-                    email_info = self._parse_email(email_data, decoder_func)
-                    email_info['index'] = i
-                    emails.append(email_info)
-                except Exception as e:
-                    print(f"解析邮件 {i} 失败: {str(e)}")
-                    continue
-            return emails
+            # 唯一标识用于与本地快照核对
+            uid_map = self._try_uid_map() if count else {}
         except Exception as e:
             raise Exception(f"获取邮件列表失败: {str(e)}")
+        # 从最新的邮件开始获取
+        for i in range(total_count, total_count - count, -1):
+            if cancel_token is not None and cancel_token.is_set():
+                return
+            try:
+                decision = True
+                if header_filter is not None:
+                    with span('header', index=i):
+                        header_data = self._fetch_header(i)
+                    headers = HeaderParser().parsestr(header_data.decode('utf-8', errors='ignore'))
+                    decision = header_filter(headers, uid_map.get(i, i))
+                    if not decision:
+                        continue
+                if decision == HEADERS_ONLY:
+                    email_info = self._parse_headers_only(header_data)
+                    email_info['size'] = self._message_size(i)
+                else:
+                    # 获取邮件内容
+                    with self._timer('retr'), span('fetch', index=i):
+                        email_data, attachments, octets = self._retr(i)
+                    self.metrics.add_bytes(self.PROTOCOL, self.server_label, 'received', octets)
+                    # 解析邮件
+                    with self._timer('parse'), span('parse', index=i):
+                        email_info = self._parse_email(email_data, decoder_func)
+                    if attachments:
+                        email_info['attachments'] = attachments
+                    email_info['size'] = octets
+                email_info['index'] = i
+                if i in uid_map:
+                    email_info['uid'] = uid_map[i]
+            except Exception as e:
+                if self.connection is None:
+                    # 连接已断开，后面的邮件无法继续获取
+                    raise Exception(f"获取邮件 {i} 时连接中断: {str(e)}")
+                print(f"解析邮件 {i} 失败: {str(e)}")
+                continue
+            yield email_info
+
+    def list_emails(self, count: Optional[int] = None, decoder_func=None, cancel_token=None,
+                    header_filter=None) -> List[Dict]:
+        return list(self.iter_emails(count, decoder_func, cancel_token, header_filter))
     
     def delete_email(self, index: int) -> bool:
         try:
@@ -0,0 +1,235 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+def needs_body(email: Dict) -> bool:
+    # 快照中的邮件只有正文开头，按规则跳过正文的邮件没有正文
+    return bool(email.get('partial') or email.get('body_skipped'))
+
+
+class BodyCache:
+    """完整邮件记录的LRU缓存，键为(账号, UID)，按正文大小限制总量，所有账号共用"""
+
+    DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+    # 每条记录除正文外的估计开销
+    RECORD_OVERHEAD = 512
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._records: 'OrderedDict[Tuple[str, object], Dict]' = OrderedDict()
+        self._sizes: Dict[Tuple[str, object], int] = {}
+        self.size = 0
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return key in self._records
+
+    def get(self, key) -> Optional[Dict]:
+        with self._lock:
+            record = self._records.get(key)
+            if record is not None:
+                self._records.move_to_end(key)
+            return record
+
+    def put(self, key, record: Dict):
+        size = len(record.get('body') or '') + self.RECORD_OVERHEAD
+        with self._lock:
+            if key in self._records:
+                self.size -= self._sizes.pop(key)
+                del self._records[key]
+            if size > self.max_bytes:
+                return
+            self._records[key] = record
+            self._sizes[key] = size
+            self.size += size
+            while self.size > self.max_bytes:
+                old_key, _ = self._records.popitem(last=False)
+                self.size -= self._sizes.pop(old_key)
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+            self._sizes.clear()
+            self.size = 0
+
+
+class BodyPrefetcher:
+    """在后台下载选中邮件附近（以及列表顶部未读）邮件的正文，放入共享的BodyCache
+
+    fetch_now()用于当前选中的邮件，立即下载；schedule()给出按优先级排列的候选，
+    替换之前尚未开始的预取（选中位置跳变时旧的预取自然作废），总大小不超过byte_budget。
+    预取只在选中位置停留IDLE_DELAY秒后开始，连续翻动时不会产生下载。
+    只用一个后台线程和一个连接，空闲KEEPALIVE秒后断开；pause()期间断开连接，
+    避免与正在进行的接收争用POP3邮箱锁。
+    """
+
+    RADIUS = 3
+    BYTE_BUDGET = 2 * 1024 * 1024
+    IDLE_DELAY = 0.3
+    KEEPALIVE = 30.0
+
+    def __init__(self, name: str, client_factory: Callable, cache: BodyCache, decoder_func=None,
+                 on_ready: Optional[Callable[[Tuple, Dict], None]] = None, byte_budget: int = BYTE_BUDGET):
+        self.name = name
+        self.client_factory = client_factory
+        self.cache = cache
+        self.decoder_func = decoder_func
+        self.on_ready = on_ready
+        self.byte_budget = byte_budget
+        self._cond = threading.Condition()
+        self._urgent: Optional[Tuple[Tuple, Dict]] = None
+        self._queue: List[Tuple[Tuple, Dict]] = []
+        self._scheduled_at = 0.0
+        self._paused = False
+        self._closed = False
+        # 后台线程没有连接时设置，pause()等待它
+        self._disconnected = threading.Event()
+        self._disconnected.set()
+        self._client = None
+        self._uid_index: Dict = {}
+        self.fetched = 0
+        self.bytes_fetched = 0
+        self._thread = threading.Thread(target=self._run, name=f'prefetch-{name}', daemon=True)
+        self._thread.start()
+
+    def fetch_now(self, key: Tuple, email: Dict):
+        with self._cond:
+            self._urgent = (key, email)
+            self._cond.notify()
+
+    def schedule(self, candidates: List[Tuple[Tuple, Dict]]):
+        # 候选按优先级排列；已缓存、不需要下载或超出字节预算的跳过
+        queue = []
+        budget = self.byte_budget
+        for key, email in candidates:
+            if not needs_body(email) or key in self.cache:
+                continue
+            size = int(email.get('size') or 0)
+            if size > budget:
+                continue
+            budget -= size
+            queue.append((key, email))
+        with self._cond:
+            self._queue = queue
+            self._scheduled_at = time.monotonic()
+            self._cond.notify()
+
+    def pause(self, timeout: float = 5.0):
+        # 放弃尚未开始的预取并断开连接（等待正在进行的下载结束）
+        with self._cond:
+            self._paused = True
+            self._queue = []
+            self._urgent = None
+            self._cond.notify()
+        self._disconnected.wait(timeout)
+
+    def resume(self):
+        with self._cond:
+            self._paused = False
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._queue = []
+            self._urgent = None
+            self._cond.notify()
+
+    def _next(self) -> Optional[Tuple[Tuple, Dict]]:
+        with self._cond:
+            while True:
+                if self._closed:
+                    return None
+                if not self._paused:
+                    if self._urgent is not None:
+                        item, self._urgent = self._urgent, None
+                        return item
+                    if self._queue:
+                        remaining = self._scheduled_at + self.IDLE_DELAY - time.monotonic()
+                        if remaining <= 0:
+                            return self._queue.pop(0)
+                        self._cond.wait(remaining)
+                        continue
+                if self._client is None or self._paused:
+                    if self._client is not None:
+                        return ('disconnect', None)
+                    self._cond.wait()
+                elif not self._cond.wait(self.KEEPALIVE) and not self._urgent and not self._queue:
+                    return ('disconnect', None)
+
+    def _run(self):
+        while True:
+            item = self._next()
+            if item is None:
+                break
+            key, email = item
+            if key == 'disconnect':
+                self._disconnect()
+                continue
+            if key in self.cache:
+                continue
+            self._fetch(key, email)
+        self._disconnect()
+
+    def _connect(self):
+        if self._client is None:
+            self._disconnected.clear()
+            client = self.client_factory()
+            try:
+                client.connect()
+                # POP3的序号可能因删除而变化，以UID为准
+                self._uid_index = {uid: index for index, uid in client.list_uids()}
+            except Exception:
+                client.disconnect()
+                self._disconnected.set()
+                raise
+            self._client = client
+        return self._client
+
+    def _disconnect(self):
+        if self._client is not None:
+            self._client.disconnect()
+            self._client = None
+            self._uid_index = {}
+        self._disconnected.set()
+
+    def _fetch(self, key: Tuple, email: Dict):
+        uid = email.get('uid')
+        try:
+            client = self._connect()
+            index = self._uid_index.get(uid)
+            if index is None:
+                # 已从服务器删除
+                return
+            record = client.get_email(index, self.decoder_func)
+        except Exception as e:
+            print(f"预取邮件 {uid} 失败: {str(e)}")
+            self._disconnect()
+            return
+        full = dict(email)
+        full.update(record)
+        full['uid'] = uid
+        full['partial'] = False
+        full['body_length'] = len(full.get('body') or '')
+        full.pop('body_skipped', None)
+        self.cache.put(key, full)
+        self.fetched += 1
+        self.bytes_fetched += int(record.get('size') or 0)
+        if self.on_ready is not None:
+            self.on_ready(key, full)
+
+
+def neighbor_positions(position: int, count: int, radius: int) -> List[int]:
+    # 先下一封、再上一封，依次向外
+    positions = []
+    for distance in range(1, radius + 1):
+        for candidate in (position + distance, position - distance):
+            if 0 <= candidate < count:
+                positions.append(candidate)
+    return positions
@@ -0,0 +1,132 @@
+import cProfile
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Optional
+
+# 环境变量：设置为1时开启性能分析与追踪；输出目录默认为profiles
+PROFILE_ENV = 'EMAIL_AGENT_PROFILE'
+PROFILE_DIR_ENV = 'EMAIL_AGENT_PROFILE_DIR'
+DEFAULT_PROFILE_DIR = 'profiles'
+
+_NULL_SPAN = nullcontext()
+
+
+def _env_enabled() -> bool:
+    return os.environ.get(PROFILE_ENV, '').strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def get_profile_dir() -> str:
+    return os.environ.get(PROFILE_DIR_ENV) or DEFAULT_PROFILE_DIR
+
+
+def _output_path(prefix: str, suffix: str) -> str:
+    directory = get_profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    return os.path.join(
+        directory,
+        f"{prefix}-{stamp}-{os.getpid()}-{threading.get_ident()}{suffix}"
+    )
+
+
+class Tracer:
+    """轻量级追踪：记录嵌套的span，导出为Chrome trace格式（chrome://tracing、Perfetto可打开）
+
+    关闭时span()直接返回空上下文，几乎没有开销。
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._events: List[Dict] = []
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def span(self, name: str, category: str = 'email', **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return self._span(name, category, args)
+
+    @contextmanager
+    def _span(self, name: str, category: str, args: Dict):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            event = {
+                'name': name,
+                'cat': category,
+                'ph': 'X',
+                'ts': start * 1e6,
+                'dur': (end - start) * 1e6,
+                'pid': self._pid,
+                'tid': threading.get_ident(),
+                'args': args
+            }
+            with self._lock:
+                self._events.append(event)
+
+    def drain(self) -> List[Dict]:
+        with self._lock:
+            events, self._events = self._events, []
+        return events
+
+    def dump(self, name: str, path: Optional[str] = None) -> Optional[str]:
+        # 写出自上次导出以来记录的所有span，返回文件路径
+        events = self.drain()
+        if not events:
+            return None
+        path = path or _output_path(f"trace-{name}", '.json')
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        return path
+
+
+_tracer = Tracer(enabled=_env_enabled())
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+def span(name: str, category: str = 'email', **args):
+    return _tracer.span(name, category, **args)
+
+
+def set_profiling_enabled(enabled: bool):
+    # 环境变量开启时始终有效，否则由设置项控制
+    _tracer.enabled = enabled or _env_enabled()
+
+
+def is_profiling_enabled() -> bool:
+    return _tracer.enabled
+
+
+@contextmanager
+def profile_run(name: str):
+    """开启性能分析时用cProfile包裹一次运行，结束后写出.pstats文件
+
+    cProfile只统计当前线程，因此应在工作线程内部使用。
+    标准库没有采样分析器，需要时可用py-spy等外部工具附加到进程。
+    """
+    if not _tracer.enabled:
+        yield
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # 同一线程已有分析器在运行
+        yield
+        return
+    try:
+        yield
+    finally:
+        profiler.disable()
+        try:
+            profiler.dump_stats(_output_path(f"profile-{name}", '.pstats'))
+        except OSError as e:
+            print(f"保存性能分析结果失败: {str(e)}")
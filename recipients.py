@@ -0,0 +1,73 @@
+from email.utils import formataddr, getaddresses, parseaddr
+from typing import Dict, List, Optional
+
+# RFC 5321要求服务器每个事务至少接受100个RCPT
+DEFAULT_MAX_RECIPIENTS = 100
+
+
+def split_addresses(text: str) -> List[str]:
+    """拆分输入框中的地址列表（逗号或分号分隔，引号中的逗号不拆分）"""
+    if not text:
+        return []
+    return [formataddr((name, addr)) for name, addr in getaddresses([text.replace(';', ',')]) if addr]
+
+
+def normalize_address(address: str) -> Optional[str]:
+    """取出信封地址：去掉显示名和空白，域名转为小写（国际化域名转为IDNA）；无效时返回None"""
+    _, addr = parseaddr(address or '')
+    addr = addr.strip()
+    local, sep, domain = addr.rpartition('@')
+    if not sep or not local or not domain or any(c.isspace() for c in addr):
+        return None
+    domain = domain.rstrip('.').lower()
+    if not domain.isascii():
+        try:
+            domain = domain.encode('idna').decode('ascii')
+        except UnicodeError:
+            return None
+    return f'{local}@{domain}'
+
+
+class RecipientPlan:
+    """一封邮件的投递计划：去重后的收件人按域名分组，再按每个事务的RCPT上限分批"""
+
+    def __init__(self, batches: List[List[str]], invalid: List[str], duplicates: int):
+        self.batches = batches
+        self.invalid = invalid
+        self.duplicates = duplicates
+
+    @property
+    def recipients(self) -> List[str]:
+        return [addr for batch in self.batches for addr in batch]
+
+    def __len__(self):
+        return sum(len(batch) for batch in self.batches)
+
+
+def plan_recipients(to_addrs: List[str], cc_addrs: Optional[List[str]] = None,
+                    bcc_addrs: Optional[List[str]] = None,
+                    max_recipients: Optional[int] = DEFAULT_MAX_RECIPIENTS) -> RecipientPlan:
+    # 同一地址只投递一次（不区分大小写），保留第一次出现时的写法
+    by_domain: Dict[str, List[str]] = {}
+    seen = set()
+    invalid = []
+    duplicates = 0
+    for address in list(to_addrs or []) + list(cc_addrs or []) + list(bcc_addrs or []):
+        normalized = normalize_address(address)
+        if normalized is None:
+            invalid.append(address)
+            continue
+        key = normalized.lower()
+        if key in seen:
+            duplicates += 1
+            continue
+        seen.add(key)
+        by_domain.setdefault(normalized.rpartition('@')[2], []).append(normalized)
+    # 同一域名的收件人相邻，中继服务器可以合并投递
+    ordered = [addr for addrs in by_domain.values() for addr in addrs]
+    if not max_recipients or max_recipients <= 0:
+        batches = [ordered] if ordered else []
+    else:
+        batches = [ordered[i:i + max_recipients] for i in range(0, len(ordered), max_recipients)]
+    return RecipientPlan(batches, invalid, duplicates)
+
@@ -0,0 +1,261 @@
+import re
+from collections import deque
+from email.header import decode_header, make_header
+from email.message import Message
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from pop3_client import HEADERS_ONLY
+
+# 规则字段、匹配方式和动作
+FIELDS = ('from', 'to', 'subject', 'body')
+HEADER_FIELDS = ('from', 'to', 'subject')
+MATCH_TYPES = ('contains', 'regex')
+ACTIONS = ('tag', 'folder', 'skip_body', 'delete')
+# 界面中显示的名称
+FIELD_NAMES = {'from': '发件人', 'to': '收件人', 'subject': '主题', 'body': '正文'}
+MATCH_NAMES = {'contains': '包含', 'regex': '正则'}
+ACTION_NAMES = {'tag': '添加标签', 'folder': '移到文件夹', 'skip_body': '不下载正文', 'delete': '从服务器删除'}
+
+
+class AhoCorasick:
+    """Aho-Corasick多关键词匹配，扫描一遍文本即可找出所有命中的关键词
+
+    耗时与文本长度和命中数成正比，与关键词数量无关。
+    """
+
+    def __init__(self, keywords: Iterable[Tuple[str, int]] = ()):
+        # 每个节点：子节点表、失败指针、在此结束的关键词对应的值
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._output: List[List[int]] = [[]]
+        for keyword, value in keywords:
+            self.add(keyword, value)
+        self.build()
+
+    def __bool__(self):
+        return len(self._goto) > 1
+
+    def add(self, keyword: str, value: int):
+        node = 0
+        for char in keyword:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = next_node
+        self._output[node].append(value)
+
+    def build(self):
+        # 按广度优先计算失败指针，并把失败链上的输出合并到当前节点
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def search(self, text: str) -> Set[int]:
+        goto, fail, output = self._goto, self._fail, self._output
+        found = set()
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                found.update(output[node])
+        return found
+
+
+class RuleResult:
+    """一封邮件命中的规则合并后的动作"""
+
+    __slots__ = ('tags', 'folder', 'skip_body', 'delete', 'matched')
+
+    def __init__(self):
+        self.tags: Set[str] = set()
+        self.folder: Optional[str] = None
+        self.skip_body = False
+        self.delete = False
+        self.matched: List[str] = []
+
+    def __bool__(self):
+        return bool(self.matched)
+
+    def merge(self, other: 'RuleResult'):
+        self.tags |= other.tags
+        self.folder = self.folder or other.folder
+        self.skip_body = self.skip_body or other.skip_body
+        self.delete = self.delete or other.delete
+        self.matched.extend(other.matched)
+
+
+class RuleSet:
+    """编译后的规则集合
+
+    规则格式（保存在配置的settings.rules中）:
+        {'name': '广告', 'field': 'subject', 'match': 'contains', 'pattern': '促销',
+         'action': 'folder', 'value': '广告', 'account': '', 'enabled': True}
+    同一字段的所有contains规则编译成一个Aho-Corasick自动机（不区分大小写），
+    regex规则预先编译。account为空时对所有账号生效。
+    """
+
+    def __init__(self, rules: List[Dict], account: Optional[str] = None):
+        self.rules: List[Dict] = []
+        self._keywords: Dict[str, AhoCorasick] = {}
+        self._regexes: Dict[str, List[Tuple[re.Pattern, int]]] = {field: [] for field in FIELDS}
+        keywords: Dict[str, List[Tuple[str, int]]] = {field: [] for field in FIELDS}
+        for rule in rules:
+            if not rule.get('enabled', True):
+                continue
+            if account is not None and rule.get('account') and rule['account'] != account:
+                continue
+            field, action, pattern = rule.get('field'), rule.get('action'), rule.get('pattern')
+            if field not in FIELDS or action not in ACTIONS or not pattern:
+                print(f"忽略无效规则: {rule.get('name', pattern)}")
+                continue
+            if field == 'body' and action == 'skip_body':
+                # 正文规则只能在下载正文之后匹配
+                print(f"忽略无效规则: {rule.get('name', pattern)}（正文规则不能跳过正文下载）")
+                continue
+            rule_id = len(self.rules)
+            if rule.get('match', 'contains') == 'regex':
+                try:
+                    self._regexes[field].append((re.compile(pattern, re.IGNORECASE), rule_id))
+                except re.error as e:
+                    print(f"忽略无效规则: {rule.get('name', pattern)}（正则表达式错误: {str(e)}）")
+                    continue
+            else:
+                keywords[field].append((pattern.lower(), rule_id))
+            self.rules.append(rule)
+        for field in FIELDS:
+            automaton = AhoCorasick(keywords[field])
+            if automaton:
+                self._keywords[field] = automaton
+
+    def __len__(self):
+        return len(self.rules)
+
+    def has_rules(self, fields: Iterable[str]) -> bool:
+        return any(field in self._keywords or self._regexes[field] for field in fields)
+
+    def match(self, values: Dict[str, str], fields: Iterable[str] = FIELDS) -> RuleResult:
+        matched = set()
+        for field in fields:
+            text = values.get(field) or ''
+            if not text:
+                continue
+            automaton = self._keywords.get(field)
+            if automaton is not None:
+                matched |= automaton.search(text.lower())
+            for regex, rule_id in self._regexes[field]:
+                if rule_id not in matched and regex.search(text):
+                    matched.add(rule_id)
+        result = RuleResult()
+        for rule_id in sorted(matched):
+            rule = self.rules[rule_id]
+            action = rule['action']
+            if action == 'tag':
+                result.tags.add(rule.get('value') or rule.get('name') or rule['pattern'])
+            elif action == 'folder':
+                # 多条规则指定文件夹时以先定义的为准
+                result.folder = result.folder or rule.get('value') or None
+            elif action == 'skip_body':
+                result.skip_body = True
+            elif action == 'delete':
+                result.delete = True
+            result.matched.append(rule.get('name') or rule['pattern'])
+        return result
+
+
+def _header_text(value) -> str:
+    try:
+        return str(make_header(decode_header(value or '')))
+    except Exception:
+        return str(value or '')
+
+
+class RuleFilter:
+    """在接收过程中应用规则
+
+    作为iter_emails的header_filter使用时，只涉及邮件头的规则在下载正文之前匹配；
+    apply(email)在邮件下载后补充匹配正文规则，并写入tags和folder。
+    命中删除规则的邮件不显示，接收结束后由delete_matched在服务器上删除。
+    """
+
+    def __init__(self, ruleset: RuleSet):
+        self.ruleset = ruleset
+        self._header_results: Dict[object, RuleResult] = {}
+        self.to_delete: List[object] = []
+        self._has_body_rules = ruleset.has_rules(('body',))
+
+    def __call__(self, headers: Message, uid):
+        values = {field: _header_text(headers.get(field.capitalize(), '')) for field in HEADER_FIELDS}
+        result = self.ruleset.match(values, HEADER_FIELDS)
+        if result.delete:
+            self.to_delete.append(uid)
+            return False
+        if result:
+            self._header_results[uid] = result
+        return HEADERS_ONLY if result.skip_body else True
+
+    def apply(self, email: Dict) -> bool:
+        # 返回False表示该邮件命中删除规则，不应显示
+        key = email.get('uid', email.get('index'))
+        result = self._header_results.pop(key, None)
+        if result is None:
+            # 没有经过header_filter（例如快照中已有的邮件），在这里匹配邮件头
+            result = self.ruleset.match(email, HEADER_FIELDS)
+        if self._has_body_rules and email.get('body'):
+            result.merge(self.ruleset.match(email, ('body',)))
+        if result.delete:
+            self.to_delete.append(key)
+            return False
+        if result.tags:
+            email['tags'] = sorted(result.tags)
+        if result.folder:
+            email['folder'] = result.folder
+        return True
+
+    def delete_matched(self, receive_client) -> int:
+        # POP3的标识是UIDL，删除时需换回当前会话中的序号
+        if not self.to_delete:
+            return 0
+        index_by_uid = {uid: index for index, uid in receive_client.list_uids()}
+        deleted = 0
+        for uid in self.to_delete:
+            try:
+                receive_client.delete_email(index_by_uid.get(uid, uid))
+                deleted += 1
+            except Exception as e:
+                print(f"删除邮件 {uid} 失败: {str(e)}")
+        self.to_delete = []
+        return deleted
+
+
+def chain_header_filters(*filters):
+    """组合多个header_filter：任一返回False则跳过，任一返回HEADERS_ONLY则只取邮件头"""
+    filters = [f for f in filters if f is not None]
+    if not filters:
+        return None
+    if len(filters) == 1:
+        return filters[0]
+
+    def header_filter(headers: Message, uid):
+        decision = True
+        for f in filters:
+            result = f(headers, uid)
+            if not result:
+                return False
+            if result == HEADERS_ONLY:
+                decision = HEADERS_ONLY
+        return decision
+    return header_filter
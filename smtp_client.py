@@ -1,41 +1,87 @@
 import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-#from email import encoders
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple
 import ssl
 
+from health import get_default_health, guarded_connect
+from metrics import get_default_metrics
+
+
+class PartialDeliveryError(Exception):
+    """部分收件人已经发送成功后发送中断
+
+    重新发送时只应发给failed中的收件人，否则delivered中的收件人会收到重复的邮件。
+    """
+
+    def __init__(self, delivered: List[str], refused: Dict, failed: List[str], error):
+        self.delivered = delivered
+        self.refused = refused
+        self.failed = failed
+        self.error = error
+        message = (f"已发送给{len(delivered)}个收件人后中断: {error}\n"
+                   f"已发送: {', '.join(delivered)}\n"
+                   f"未发送: {', '.join(failed)}")
+        if refused:
+            message += f"\n被拒绝: {', '.join(refused)}"
+        super().__init__(message)
+
+
 class SMTPClient:
-    def __init__(self, smtp_server: str, smtp_port: int, username: str, password: str, use_ssl: bool = True):
+    PROTOCOL = 'smtp'
+    # 连接建立后的读写超时（秒）；建立连接本身的超时见health.py
+    IO_TIMEOUT = 30
+
+    def __init__(self, smtp_server: str, smtp_port: int, username: str, password: str, use_ssl: bool = True, metrics=None, use_starttls: bool = True, part_cache=None, max_recipients: Optional[int] = None, health=None):
         self.smtp_server = smtp_server
         self.smtp_port = smtp_port
         self.username = username
         self.password = password
         self.use_ssl = use_ssl
+        # 不使用SSL时是否升级为STARTTLS（仅本地中继/测试服务器应关闭）
+        self.use_starttls = use_starttls
         self.connection = None
+        # 各阶段耗时统计（见metrics.py）
+        self.metrics = metrics if metrics is not None else get_default_metrics()
+        self.server_label = f"{smtp_server}:{smtp_port}"
+        # 附件编码缓存（见mime_cache.py），为None时使用全局共享的缓存
+        self.part_cache = part_cache
+        # 每个事务的RCPT数量上限，超出时拆成多个事务（见recipients.py）
+        self.max_recipients = max_recipients
+        # 上一封邮件被拒绝的收件人: 地址 -> (状态码, 响应)
+        self.last_refused: Dict = {}
+        # 按服务器共享的连接健康状态（熔断与自适应连接超时）
+        self.health = (health if health is not None else get_default_health()).get(self.PROTOCOL, self.server_label)
+    
+    def _timer(self, phase: str):
+        return self.metrics.timer(self.PROTOCOL, self.server_label, phase)
     
     def connect(self) -> bool:
         try:
             if self.use_ssl:
                 # 使用SSL连接
                 context = ssl.create_default_context()
-                self.connection = smtplib.SMTP_SSL(
-                    self.smtp_server, 
-                    self.smtp_port, 
-                    context=context,
-                    timeout=30
-                )
+                with guarded_connect(self.health) as timeout, self._timer('connect'):
+                    self.connection = smtplib.SMTP_SSL(
+                        self.smtp_server, 
+                        self.smtp_port, 
+                        context=context,
+                        timeout=timeout
+                    )
             else:
                 # 使用普通连接后STARTTLS
-                self.connection = smtplib.SMTP(
-                    self.smtp_server, 
-                    self.smtp_port,
-                    timeout=30
-                )
-                self.connection.starttls()
+                with guarded_connect(self.health) as timeout, self._timer('connect'):
+                    self.connection = smtplib.SMTP(
+                        self.smtp_server, 
+                        self.smtp_port,
+                        timeout=timeout
+                    )
+            # 连接已建立，恢复常规的读写超时
+            self.connection.sock.settimeout(self.IO_TIMEOUT)
+            if not self.use_ssl and self.use_starttls:
+                with self._timer('tls'):
+                    self.connection.starttls()
             # 登录认证
-            self.connection.login(self.username, self.password)
+            with self._timer('auth'):
+                self.connection.login(self.username, self.password)
             return True
         except Exception as e:
             raise Exception(f"连接SMTP服务器失败: {str(e)}")
@@ -48,39 +94,151 @@ class SMTPClient:
                 pass
             self.connection = None
 
-    def send_email(self, to_addrs: List[str], subject: str, body: str, cc_addrs: Optional[List[str]] = None, bcc_addrs: Optional[List[str]] = None, encoder_func = None) -> bool:
+    def build_message(self, to_addrs: List[str], subject: str, body: str, cc_addrs: Optional[List[str]] = None, encoder_func = None, attachments: Optional[List[str]] = None) -> str:
+        # email.mime较重，只在真正构建邮件时导入
+        from email.mime.text import MIMEText
+        from email.mime.multipart import MIMEMultipart
+        from mime_cache import get_default_part_cache, message_as_string
+        # 创建邮件消息
+        msg = MIMEMultipart()
+        msg['From'] = self.username
+        msg['To'] = ', '.join(to_addrs)
+        msg['Subject'] = subject
+        if cc_addrs:
+            msg['Cc'] = ', '.join(cc_addrs)
+        # 这是为未来的Base64编码定制预留的接口
+        encoded_body = body
+        if encoder_func:
+            encoded_body = encoder_func(body)
+
+        # 添加邮件正文
+        msg.attach(MIMEText(encoded_body, 'plain', 'utf-8'))
+        # 添加附件（同一文件只编码一次，之后直接取缓存）
+        if attachments:
+            part_cache = self.part_cache if self.part_cache is not None else get_default_part_cache()
+            for path in attachments:
+                msg.attach(part_cache.part(path))
+        return message_as_string(msg)
+
+    def send_email(self, to_addrs: List[str], subject: str, body: str, cc_addrs: Optional[List[str]] = None, bcc_addrs: Optional[List[str]] = None, encoder_func = None, cancel_token = None, attachments: Optional[List[str]] = None) -> bool:
+        try:
+            with self._timer('build'):
+                msg_str = self.build_message(to_addrs, subject, body, cc_addrs, encoder_func, attachments)
+            self._deliver(msg_str, to_addrs, cc_addrs, bcc_addrs, cancel_token)
+            return True
+        except PartialDeliveryError:
+            raise
+        except Exception as e:
+            raise Exception(f"发送邮件失败: {str(e)}")
+
+    def compile_template(self, subject: str, body: str, attachments: Optional[List[str]] = None, slot_encoders: Optional[Dict] = None, encoder_func = None):
+        # 群发时先编译模板，之后每封只填入字段（见mail_template.py）
+        from mail_template import MessageTemplate
+        try:
+            return MessageTemplate(self.username, subject, body, attachments, slot_encoders, encoder_func, self.part_cache)
+        except Exception as e:
+            raise Exception(f"编译邮件模板失败: {str(e)}")
+
+    def send_template(self, template, to_addrs: List[str], values: Optional[Dict] = None, cc_addrs: Optional[List[str]] = None, bcc_addrs: Optional[List[str]] = None, cancel_token = None) -> bool:
         try:
-            # 创建邮件消息
-            msg = MIMEMultipart()
-            msg['From'] = self.username
-            msg['To'] = ', '.join(to_addrs)
-            msg['Subject'] = subject
-            if cc_addrs:
-                msg['Cc'] = ', '.join(cc_addrs)
-            # 这是为未来的Base64编码定制预留的接口
-            encoded_body = body
-            if encoder_func:
-                encoded_body = encoder_func(body)
-
-            # 添加邮件正文
-            msg.attach(MIMEText(encoded_body, 'plain', 'utf-8'))
-            # 准备收件人列表
-            all_recipients = to_addrs.copy()
-            if cc_addrs:
-                all_recipients.extend(cc_addrs)
-            if bcc_addrs:
-                all_recipients.extend(bcc_addrs)
-            # 发送邮件
-            if not self.connection:
-                self.connect()
-            self.connection.sendmail(
-                self.username,
-                all_recipients,
-                msg.as_string()
-            )
+            with self._timer('build'):
+                msg_str = template.render(to_addrs, values, cc_addrs)
+            self._deliver(msg_str, to_addrs, cc_addrs, bcc_addrs, cancel_token)
             return True
+        except PartialDeliveryError:
+            raise
         except Exception as e:
             raise Exception(f"发送邮件失败: {str(e)}")
+
+    def _deliver(self, msg_str: str, to_addrs: List[str], cc_addrs: Optional[List[str]], bcc_addrs: Optional[List[str]], cancel_token) -> Dict:
+        from recipients import DEFAULT_MAX_RECIPIENTS, plan_recipients
+        # 收件人去重并按RCPT上限分批，同一个会话中依次发送，合并被拒绝的结果
+        # 已有收件人发送成功后某一批失败（或被取消）时抛出PartialDeliveryError，列出已发送和未发送的收件人
+        plan = plan_recipients(to_addrs, cc_addrs, bcc_addrs, self.max_recipients or DEFAULT_MAX_RECIPIENTS)
+        refused = {addr: (501, '地址格式无效'.encode('utf-8')) for addr in plan.invalid}
+        self.last_refused = refused
+        if not plan.batches:
+            raise smtplib.SMTPRecipientsRefused(refused)
+        batches = list(plan.batches)
+        delivered = []
+        while batches:
+            # 发送邮件（cancel_token被设置时放弃发送）
+            if cancel_token is not None and cancel_token.is_set():
+                if delivered:
+                    raise PartialDeliveryError(delivered, refused, [addr for batch in batches for addr in batch],
+                                               "发送已取消")
+                raise Exception("发送已取消")
+            batch = batches.pop(0)
+            try:
+                if not self.connection:
+                    self.connect()
+                batch_refused, deferred = self._send_transaction(self.username, batch, msg_str)
+            except smtplib.SMTPRecipientsRefused as e:
+                refused.update(e.recipients)
+                continue
+            except Exception as e:
+                if not isinstance(e, smtplib.SMTPResponseException):
+                    # 连接已不可用，下一次发送时重新连接
+                    self._drop_connection()
+                if not delivered:
+                    raise
+                raise PartialDeliveryError(delivered, refused, batch + [addr for rest in batches for addr in rest], e)
+            refused.update(batch_refused)
+            delivered.extend(addr for addr in batch if addr not in batch_refused and addr not in deferred)
+            if deferred:
+                # 服务器的上限比配置的小，剩下的收件人放到下一个事务
+                batches.insert(0, deferred)
+        if not delivered:
+            raise smtplib.SMTPRecipientsRefused(refused)
+        return refused
+
+    def _send_transaction(self, from_addr: str, recipients: List[str], msg_str: str) -> Tuple[Dict, List[str]]:
+        # 与smtplib.sendmail相同的语义，但分别统计MAIL/RCPT和DATA阶段
+        # 返回(被拒绝的收件人, 因452推迟到下一个事务的收件人)；没有收件人被接受时抛出异常
+        conn = self.connection
+        conn.ehlo_or_helo_if_needed()
+        refused = {}
+        deferred = []
+        with self._timer('mail_rcpt'):
+            code, resp = conn.mail(from_addr)
+            if code != 250:
+                self._rset()
+                raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+            accepted = 0
+            for i, recipient in enumerate(recipients):
+                code, resp = conn.rcpt(recipient)
+                if code in (250, 251):
+                    accepted += 1
+                elif code == 452 and accepted:
+                    # 452: 本事务收件人过多（RFC 5321 4.5.3.1.10）
+                    deferred = recipients[i:]
+                    break
+                else:
+                    refused[recipient] = (code, resp)
+            if not accepted:
+                self._rset()
+                raise smtplib.SMTPRecipientsRefused(refused)
+        with self._timer('data'):
+            code, resp = conn.data(msg_str)
+            if code != 250:
+                self._rset()
+                raise smtplib.SMTPDataError(code, resp)
+        self.metrics.add_bytes(self.PROTOCOL, self.server_label, 'sent', len(msg_str))
+        return refused, deferred
+
+    def _drop_connection(self):
+        if self.connection:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+    def _rset(self):
+        try:
+            self.connection.rset()
+        except smtplib.SMTPServerDisconnected:
+            pass
     
     def __enter__(self):
         self.connect()
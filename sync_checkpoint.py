@@ -0,0 +1,103 @@
+import json
+import os
+import threading
+from typing import Dict, Optional
+
+from attachments import Attachment
+
+
+class SyncCheckpoint:
+    """接收过程中的检查点：每收到一封邮件就追加写入日志并fsync
+
+    日志第一行记录协议和UIDVALIDITY，之后每行一封邮件（按UID），
+    被header_filter跳过的邮件也记一行，恢复后不再重复判断。
+    连接中断或程序退出后重新同步时，日志中已有的邮件不再下载。
+    一次同步完整结束、快照保存之后调用clear()。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.protocol: Optional[str] = None
+        self.uidvalidity = None
+        # UID（字符串）-> 邮件记录，跳过的邮件为None
+        self._records: Dict[str, Optional[Dict]] = {}
+        self._file = None
+        if os.path.exists(path):
+            self._load()
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, uid) -> bool:
+        return str(uid) in self._records
+
+    def get(self, uid) -> Optional[Dict]:
+        return self._records.get(str(uid))
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                header = None
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # 写到一半的最后一行
+                        continue
+                    if header is None:
+                        header = record
+                        self.protocol = header.get('protocol')
+                        self.uidvalidity = header.get('uidvalidity')
+                        continue
+                    email = record.get('email')
+                    if email is not None and 'attachments' in email:
+                        email['attachments'] = [Attachment(item) for item in email['attachments']]
+                    self._records[str(record['uid'])] = email
+        except Exception as e:
+            print(f"加载接收检查点失败: {str(e)}")
+            self._records = {}
+
+    def _write(self, record: Dict):
+        if self._file is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=str) + '\n')
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def begin(self, protocol: str, uidvalidity=None):
+        # 协议或UIDVALIDITY变化时之前的记录作废
+        with self._lock:
+            if self._records and (protocol, uidvalidity) == (self.protocol, self.uidvalidity):
+                return
+            self._close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self._records = {}
+            self.protocol, self.uidvalidity = protocol, uidvalidity
+            self._write({'protocol': protocol, 'uidvalidity': uidvalidity})
+
+    def commit(self, uid, email: Optional[Dict]):
+        """记录一封已处理的邮件，email为None表示被跳过"""
+        with self._lock:
+            self._write({'uid': uid, 'email': email})
+            self._records[str(uid)] = email
+
+    def _close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def clear(self):
+        with self._lock:
+            self._close()
+            self._records = {}
+            self.protocol = self.uidvalidity = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
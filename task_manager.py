@@ -0,0 +1,176 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class CancelToken(threading.Event):
+    """取消标志，可直接作为cancel_token传给POP3Client/IMAPClient/SMTPClient"""
+
+    def cancel(self):
+        self.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self.is_set()
+
+    def raise_if_cancelled(self):
+        if self.is_set():
+            raise TaskCancelled("任务已取消")
+
+
+class Task:
+
+    def __init__(self, account: str, operation: str, description: str = ''):
+        self.account = account
+        self.operation = operation
+        self.description = description or operation
+        self.token = CancelToken()
+        self.created_at = time.monotonic()
+        self.started_at = None
+        self.future = None
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        return (self.account, self.operation)
+
+    @property
+    def status(self) -> str:
+        if self.token.is_set():
+            return '取消中'
+        if self.started_at is None:
+            return '排队中'
+        return '运行中'
+
+    def to_dict(self) -> Dict:
+        start = self.started_at if self.started_at is not None else self.created_at
+        return {
+            'account': self.account,
+            'operation': self.operation,
+            'description': self.description,
+            'status': self.status,
+            'elapsed': time.monotonic() - start
+        }
+
+
+class TaskManager:
+    """后台任务管理
+
+    所有后台操作在一个有界线程池中执行；长期运行的任务（如IDLE推送）使用单独的
+    守护线程，不占用线程池。同一(账号, 操作)同时只允许一个任务，重复提交会被忽略。
+    任务函数接收一个CancelToken，回调通过dispatch转交给界面线程执行
+    （GUI中传入root.after）；shutdown()之后不再接受任务，也不再转交回调。
+    """
+
+    def __init__(self, max_workers: int = 4, dispatch: Optional[Callable] = None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='email-task')
+        self.dispatch = dispatch or (lambda func, *args: func(*args))
+        self._tasks: Dict[Tuple[str, str], Task] = {}
+        self._lock = threading.Lock()
+        self._listeners: List[Callable] = []
+        self._closed = False
+
+    def submit(self, account: str, operation: str, func: Callable[[CancelToken], object],
+               on_success: Optional[Callable] = None, on_error: Optional[Callable] = None,
+               on_cancel: Optional[Callable] = None, description: str = '',
+               long_running: bool = False) -> Optional[Task]:
+        task = Task(account, operation, description)
+        with self._lock:
+            if self._closed or task.key in self._tasks:
+                return None
+            self._tasks[task.key] = task
+        submitted = False
+        try:
+            args = (task, func, on_success, on_error, on_cancel)
+            if long_running:
+                threading.Thread(target=self._run, args=args, daemon=True,
+                                 name=f'email-task-{operation}').start()
+            else:
+                task.future = self.executor.submit(self._run, *args)
+            submitted = True
+        finally:
+            if not submitted:
+                # 提交失败（如已关闭的线程池）时释放去重键
+                with self._lock:
+                    self._tasks.pop(task.key, None)
+        self._notify()
+        return task
+
+    def _run(self, task: Task, func, on_success, on_error, on_cancel):
+        task.started_at = time.monotonic()
+        self._notify()
+        try:
+            task.token.raise_if_cancelled()
+            result = func(task.token)
+            if task.token.is_set():
+                callback, args = on_cancel, ()
+            else:
+                callback, args = on_success, (result,)
+        except TaskCancelled:
+            callback, args = on_cancel, ()
+        except Exception as e:
+            if task.token.is_set():
+                callback, args = on_cancel, ()
+            else:
+                callback, args = on_error, (str(e),)
+        finally:
+            with self._lock:
+                self._tasks.pop(task.key, None)
+            self._notify()
+        if callback:
+            self.post(callback, *args)
+
+    def post(self, func: Callable, *args):
+        """把回调交给界面线程执行；shutdown()之后忽略（窗口可能已销毁）"""
+        if self._closed:
+            return
+        try:
+            self.dispatch(func, *args)
+        except Exception:
+            # 与shutdown()竞争时界面可能刚刚销毁
+            if not self._closed:
+                raise
+
+    def is_running(self, account: str, operation: str) -> bool:
+        with self._lock:
+            return (account, operation) in self._tasks
+
+    def cancel(self, account: str, operation: str) -> bool:
+        with self._lock:
+            task = self._tasks.get((account, operation))
+        if task is None:
+            return False
+        task.token.cancel()
+        self._notify()
+        return True
+
+    def cancel_all(self):
+        with self._lock:
+            tasks = list(self._tasks.values())
+        for task in tasks:
+            task.token.cancel()
+        self._notify()
+
+    def list_tasks(self) -> List[Dict]:
+        with self._lock:
+            tasks = list(self._tasks.values())
+        return [task.to_dict() for task in tasks]
+
+    def add_listener(self, listener: Callable[[], None]):
+        # 任务列表变化时调用（通过dispatch在界面线程执行）
+        self._listeners.append(listener)
+
+    def _notify(self):
+        for listener in self._listeners:
+            self.post(listener)
+
+    def shutdown(self, cancel: bool = True):
+        with self._lock:
+            self._closed = True
+        if cancel:
+            self.cancel_all()
+        self.executor.shutdown(wait=False, cancel_futures=True)
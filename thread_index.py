@@ -0,0 +1,220 @@
+import json
+import os
+import re
+import threading
+from typing import Dict, List, Optional, Tuple
+
+# 回复/转发前缀，如 "Re: "、"回复："、"Fwd[2]: "
+_REPLY_PREFIX_RE = re.compile(r'^\s*((re|fw|fwd|aw|回复|答复|转发)\s*(\[\d+\])?\s*[:：]\s*)+', re.IGNORECASE)
+
+
+def normalize_subject(subject: str) -> str:
+    return _REPLY_PREFIX_RE.sub('', subject or '').strip().lower()
+
+
+def is_reply_subject(subject: str) -> bool:
+    return bool(_REPLY_PREFIX_RE.match(subject or ''))
+
+
+class ThreadIndex:
+    """JWZ风格的会话索引（https://www.jwz.org/doc/threading.html）
+
+    每个Message-ID是一个节点，只记录父节点；References中相邻的ID依次连成父子链，
+    没有References的回复按去掉前缀后的主题归到同名会话。加入新邮件只处理它自己的
+    References，不必重建整棵树。新增记录追加写入日志文件，加载时按顺序重放。
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self._lock = threading.Lock()
+        # Message-ID -> 父节点的Message-ID（根节点为None）
+        self._parent: Dict[str, Optional[str]] = {}
+        self._children: Dict[str, set] = {}
+        # 已收到的邮件：Message-ID -> 邮件标识（UID）；只被引用过的节点不在其中
+        self._keys: Dict[str, object] = {}
+        # 规范化主题 -> 该主题第一封邮件的Message-ID
+        self._subject_roots: Dict[str, str] = {}
+        # 尚未写入日志的记录
+        self._pending: List[list] = []
+        if path and os.path.exists(path):
+            self._load()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, message_id: str) -> bool:
+        return message_id in self._keys
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        message_id, references, subject, key = json.loads(line)
+                    except ValueError:
+                        # 写到一半的最后一行
+                        continue
+                    if message_id not in self._keys:
+                        self._apply(message_id, references, subject, key)
+        except Exception as e:
+            print(f"加载会话索引失败: {str(e)}")
+
+    def save(self) -> bool:
+        # 只追加本次新增的记录
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending or not self.path:
+            return True
+        try:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            with open(self.path, 'a', encoding='utf-8') as f:
+                for record in pending:
+                    f.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            return True
+        except Exception as e:
+            print(f"保存会话索引失败: {str(e)}")
+            with self._lock:
+                self._pending = pending + self._pending
+            return False
+
+    def _is_ancestor(self, node: str, of: str) -> bool:
+        while of is not None:
+            if of == node:
+                return True
+            of = self._parent.get(of)
+        return False
+
+    def _set_parent(self, child: str, parent: str):
+        # 会形成环的链接直接忽略
+        if self._is_ancestor(child, parent):
+            return
+        old = self._parent.get(child)
+        if old == parent:
+            return
+        if old is not None:
+            self._children[old].discard(child)
+        self._parent[child] = parent
+        self._children.setdefault(parent, set()).add(child)
+
+    def _apply(self, message_id: str, references: List[str], subject: str, key):
+        self._keys[message_id] = key
+        self._parent.setdefault(message_id, None)
+        references = [ref for ref in references if ref != message_id]
+        for ref in references:
+            self._parent.setdefault(ref, None)
+        # 已有的链接不覆盖（JWZ第1.A步）
+        for parent, child in zip(references, references[1:]):
+            if self._parent[child] is None:
+                self._set_parent(child, parent)
+        if references:
+            # 邮件自己的References最可信，覆盖之前推断的父节点（JWZ第1.C步）
+            self._set_parent(message_id, references[-1])
+            return
+        base = normalize_subject(subject)
+        if not base:
+            return
+        root = self._subject_roots.get(base)
+        if root is None:
+            self._subject_roots[base] = message_id
+        elif is_reply_subject(subject) and self._parent[message_id] is None:
+            self._set_parent(message_id, root)
+
+    def add(self, message_id: str, references: List[str], subject: str = '', key=None) -> bool:
+        # 返回是否为新邮件
+        if not message_id:
+            return False
+        with self._lock:
+            if message_id in self._keys:
+                return False
+            self._apply(message_id, list(references), subject, key)
+            self._pending.append([message_id, list(references), subject, key])
+            return True
+
+    def add_email(self, email: Dict) -> bool:
+        references = list(email.get('references') or [])
+        in_reply_to = email.get('in_reply_to')
+        # References为空或不完整时用In-Reply-To补上直接父节点
+        if in_reply_to and (not references or references[-1] != in_reply_to):
+            if in_reply_to in references:
+                references.remove(in_reply_to)
+            references.append(in_reply_to)
+        return self.add(email.get('message_id'), references, email.get('subject', ''), email.get('uid'))
+
+    def add_emails(self, emails: List[Dict]) -> int:
+        return sum(1 for email in emails if self.add_email(email))
+
+    def root(self, message_id: str) -> str:
+        with self._lock:
+            while self._parent.get(message_id) is not None:
+                message_id = self._parent[message_id]
+            return message_id
+
+    def thread_members(self, message_id: str) -> List[str]:
+        # 与该邮件同一会话、且已收到的所有邮件的Message-ID
+        root = self.root(message_id)
+        with self._lock:
+            members = []
+            stack = [root]
+            while stack:
+                node = stack.pop()
+                if node in self._keys:
+                    members.append(node)
+                stack.extend(self._children.get(node, ()))
+            return members
+
+    def arrange(self, emails: List[Dict]) -> Tuple[List[int], Dict[int, int]]:
+        """按会话排列邮件，返回(下标顺序, 下标 -> 缩进层级)
+
+        emails按从新到旧排列；会话按其中最新一封的位置排序，会话内按从旧到新
+        深度优先展开。父邮件不在列表中时挂到最近的、在列表中的祖先下。
+        """
+        position = {}
+        for i, email in enumerate(emails):
+            message_id = email.get('message_id')
+            if message_id and message_id not in position:
+                position[message_id] = i
+
+        children: Dict[int, List[int]] = {}
+        roots = []
+        with self._lock:
+            for i, email in enumerate(emails):
+                message_id = email.get('message_id')
+                parent = self._parent.get(message_id) if position.get(message_id) == i else None
+                while parent is not None and parent not in position:
+                    parent = self._parent.get(parent)
+                if parent is None:
+                    roots.append(i)
+                else:
+                    children.setdefault(position[parent], []).append(i)
+
+        # 会话中最新邮件的位置
+        newest = {}
+
+        def subtree_newest(i: int) -> int:
+            stack = [i]
+            best = i
+            while stack:
+                node = stack.pop()
+                best = min(best, node)
+                stack.extend(children.get(node, ()))
+            return best
+
+        for i in roots:
+            newest[i] = subtree_newest(i)
+        roots.sort(key=newest.__getitem__)
+
+        order = []
+        depths = {}
+        for root in roots:
+            stack = [(root, 0)]
+            while stack:
+                node, depth = stack.pop()
+                order.append(node)
+                depths[node] = depth
+                # 下标越大越旧；按从新到旧入栈，出栈时较旧的先展开
+                for child in sorted(children.get(node, ())):
+                    stack.append((child, depth + 1))
+        return order, depths